@@ -1,12 +1,13 @@
 # type: ignore[attr-defined]
 
 
+from typing import List, Optional
+
 import dotenv
 import typer
 from rich.console import Console
 
 from svaeva_redux import version as ver
-from svaeva_redux.schemas.utils import initialize_redis
 
 app = typer.Typer(
     name="svaeva-redux",
@@ -23,9 +24,197 @@ def version_callback(print_version: bool) -> None:
 
 
 @app.command(name="initialize-db")
-def initialize_db() -> None:
+def initialize_db(
+    presets: Optional[str] = typer.Option(
+        None, "--presets", help="JSON or YAML file with the conversation presets to seed instead of the defaults."
+    ),
+    force: bool = typer.Option(False, "--force", help="Rebuild the indexes and rewrite every preset."),
+) -> None:
+    """Create the search indexes and seed the conversation presets that changed."""
+    # Imported here so commands that do not touch Redis start without redis_om, numpy and the prompts.
+    from svaeva_redux.schemas.utils import initialize_redis, load_presets
+
     console.print("Initializing redis...")
-    initialize_redis()
+    seeded = initialize_redis(load_presets(presets) if presets else None, force=force)
+    console.print(f"Seeded {len(seeded)} conversation preset(s)")
+
+
+@app.command(name="migrate-indexes")
+def migrate_indexes(
+    profile: Optional[str] = typer.Option(
+        None, "--profile", help="Index profile (full, lookup, moderation) or JSON/YAML file, INDEX_PROFILE by default."
+    ),
+) -> None:
+    """Rebuild the search indexes with an index profile and report their memory before and after."""
+    from rich.table import Table
+
+    from svaeva_redux.schemas.utils import migrate_indexes as migrate
+
+    table = Table("index", "before MB", "after MB")
+    for name, memory in sorted(migrate(profile).items()):
+        table.add_row(name, *("-" if memory[when] is None else f"{memory[when]:.3f}" for when in ("before", "after")))
+    console.print(table)
+
+
+@app.command(name="collect-garbage")
+def collect_garbage() -> None:
+    """Delete the interned prompts and avatar blobs that no document references anymore."""
+    from svaeva_redux.schemas.utils import collect_interned_values, collect_user_image_blobs
+
+    console.print(f"Deleted {collect_interned_values()} interned value(s)", highlight=False)
+    console.print(f"Deleted {collect_user_image_blobs()} avatar blob(s)", highlight=False)
+
+
+def print_transfer_report(verb: str, report: dict) -> None:
+    records = ", ".join(f"{count} {name}" for name, count in report["records"].items())
+    console.print(
+        f"{verb} {records} ({report['bytes'] / 1e6:.1f} MB) in {report['seconds']:.2f}s: "
+        f"{report['records_per_second']:.0f} records/s, {report['mb_per_second']:.1f} MB/s",
+        highlight=False,
+    )
+
+
+@app.command()
+def export(
+    path: str = typer.Argument(..., help="NDJSON file, compressed if it ends in .gz, .bz2 or .xz, - for stdout."),
+    model: Optional[List[str]] = typer.Option(None, "--model", help="Model to export, can be repeated."),
+    batch_size: int = typer.Option(500, "--batch-size", help="Documents per SCAN call and read round trip."),
+) -> None:
+    """Stream users, images, videos and conversations to an NDJSON file."""
+    from svaeva_redux.schemas.transfer import export_records, open_ndjson
+
+    with open_ndjson(path, "w") as stream:
+        report = export_records(stream, model, batch_size)
+    if path != "-":
+        print_transfer_report("Exported", report)
+
+
+@app.command(name="import")
+def import_(
+    path: str = typer.Argument(..., help="NDJSON file written by export, - for stdin."),
+    batch_size: int = typer.Option(500, "--batch-size", help="Records per pipeline."),
+) -> None:
+    """Load an NDJSON export, overwriting the documents with the same keys."""
+    from svaeva_redux.schemas.transfer import import_records, open_ndjson
+
+    with open_ndjson(path) as stream:
+        report = import_records(stream, batch_size)
+    print_transfer_report("Imported", report)
+
+
+@app.command()
+def ingest(
+    sources: List[str] = typer.Argument(..., help="Text files, directories, globs or NDJSON files of {id, text}."),
+    schema: Optional[str] = typer.Option(None, "--schema", help="redisvl index schema, documents.yaml by default."),
+    chunk_size: int = typer.Option(1000, "--chunk-size", help="Characters per chunk."),
+    overlap: int = typer.Option(200, "--overlap", help="Characters shared by consecutive chunks."),
+    batch_size: int = typer.Option(64, "--batch-size", help="Chunks per embedding call and write pipeline."),
+    workers: int = typer.Option(0, "--workers", help="Embedding processes, 0 to embed in this process."),
+    embedder: Optional[str] = typer.Option(None, "--embedder", help="module:attribute of the embedder to use."),
+    create_index: bool = typer.Option(True, "--create-index/--no-create-index", help="Create the index first."),
+    restart: bool = typer.Option(False, "--restart", help="Ignore the checkpoint and ingest every document."),
+) -> None:
+    """Chunk, embed and load documents into the RAG vector index, resuming after the last complete document."""
+    from svaeva_redux.rag.redisvl.ingest import DOCUMENTS_SCHEMA, load_embedder, load_index_schema
+    from svaeva_redux.rag.redisvl.ingest import ingest as run
+
+    schema = schema or DOCUMENTS_SCHEMA
+    report = run(
+        sources,
+        create=create_index,
+        restart=restart,
+        embedder=load_embedder(embedder, load_index_schema(schema)["dims"]),
+        schema=schema,
+        chunk_size=chunk_size,
+        overlap=overlap,
+        batch_size=batch_size,
+        workers=workers,
+    )
+    console.print(
+        f"Ingested {report['documents']} document(s) ({report['skipped']} unchanged, {report['chunks']} chunks) "
+        f"in {report['seconds']:.2f}s: {report['documents_per_second']:.1f} docs/s, "
+        f"{report['chunks_per_second']:.1f} chunks/s",
+        highlight=False,
+    )
+
+
+@app.command(name="rebalance-shards")
+def rebalance_shards(
+    batch_size: int = typer.Option(500, "--batch-size", help="Documents per read round trip."),
+    history_shards: Optional[str] = typer.Option(
+        None, "--history-shards", help="Chat history shards, name=url,name=url, to rebalance too."
+    ),
+    history_key_prefix: str = typer.Option("message_store:", "--history-key-prefix", help="Chat history key prefix."),
+) -> None:
+    """Move users, images and videos (and chat histories) to their shard after REDIS_SHARDS changed."""
+    from svaeva_redux.connection import parse_shards
+    from svaeva_redux.schemas.utils import rebalance_shards as rebalance
+
+    for shard, moved in sorted(rebalance(batch_size).items()):
+        console.print(f"Moved {moved} document(s) off shard {shard}", highlight=False)
+    if history_shards:
+        from svaeva_redux.langchain.redis import rebalance_histories
+
+        moved = rebalance_histories(parse_shards(history_shards), history_key_prefix, batch_size)
+        for shard, count in sorted(moved.items()):
+            console.print(f"Moved {count} chat histories off shard {shard}", highlight=False)
+
+
+@app.command()
+def stats(
+    prometheus: bool = typer.Option(False, "--prometheus", help="Print in the Prometheus text format."),
+    reset: bool = typer.Option(False, "--reset", help="Clear the totals after printing them."),
+) -> None:
+    """Summarize the operation latencies flushed to Redis (see SVAEVA_METRICS_FLUSH_INTERVAL)."""
+    from rich.table import Column, Table
+
+    from svaeva_redux.metrics import clear_metrics, load_metrics, render_prometheus
+
+    operations = load_metrics()
+    if prometheus:
+        console.print(render_prometheus(operations), end="", markup=False, highlight=False)
+    else:
+        table = Table(
+            Column("operation", no_wrap=True), "count", "errors", "mean ms", "p50 ms", "p95 ms", "p99 ms", "mean bytes"
+        )
+        for operation, op_stats in sorted(operations.items()):
+            count = max(op_stats.count, 1)
+            table.add_row(
+                operation,
+                str(op_stats.count),
+                str(op_stats.errors),
+                f"{op_stats.seconds / count * 1000:.2f}",
+                *(f"<= {op_stats.quantile(q) * 1000:g}" for q in (0.5, 0.95, 0.99)),
+                str(op_stats.payload_bytes // count),
+            )
+        console.print(table)
+    if reset:
+        clear_metrics()
+
+
+@app.command()
+def bench(
+    target: str = typer.Option(
+        "fake", "--target", help="fake (in-process), redis-stack (spawned locally) or configured (REDIS_* settings)."
+    ),
+    iterations: int = typer.Option(100, "--iterations", help="Timed iterations per benchmark."),
+    only: Optional[List[str]] = typer.Option(None, "--only", help="Benchmark to run, can be repeated."),
+    output: Optional[str] = typer.Option(None, "--output", help="Write the JSON report to this file."),
+    allow_writes: bool = typer.Option(
+        False, "--allow-writes", help="Allow --target configured: writes bench keys, rebuilds indexes and presets."
+    ),
+) -> None:
+    """Benchmark the hot paths and print a JSON report."""
+    import json
+
+    from svaeva_redux.bench import run_benchmarks
+
+    report = json.dumps(run_benchmarks(target, iterations, only, allow_writes), indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
 
 
 @app.command()
@@ -0,0 +1,266 @@
+import contextlib
+import platform
+import shutil
+import socket
+import subprocess
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from svaeva_redux import connection
+from svaeva_redux import version as package_version  # type: ignore[attr-defined]
+
+TARGETS = ("configured", "redis-stack", "fake")
+
+_PREFIX = "svaeva-bench"
+
+
+def _summary(name: str, params: Dict[str, Any], timings: List[int]) -> Dict[str, Any]:
+    samples = np.array(timings, dtype=np.float64) / 1000
+    return {
+        "name": name,
+        "params": params,
+        "iterations": len(timings),
+        "mean_us": float(samples.mean()),
+        "p50_us": float(np.percentile(samples, 50)),
+        "p95_us": float(np.percentile(samples, 95)),
+        "min_us": float(samples.min()),
+        "max_us": float(samples.max()),
+    }
+
+
+def _measure(name: str, params: Dict[str, Any], iterations: int, operation: Callable[[int], Any]) -> Dict[str, Any]:
+    timings: List[int] = []
+    for i in range(iterations):
+        start = time.perf_counter_ns()
+        operation(i)
+        timings.append(time.perf_counter_ns() - start)
+    return _summary(name, params, timings)
+
+
+def bench_user_model(iterations: int) -> List[Dict[str, Any]]:
+    from svaeva_redux.schemas.redis import UserModel
+
+    pk = f"{_PREFIX}-user"
+    user = UserModel(id=pk, group_id="bench", platform_id="bench", first_name="bench")
+
+    def save(i: int) -> None:
+        user.interaction_count = i
+        user.save()
+
+    try:
+        return [
+            _measure("user_model.save", {}, iterations, save),
+            _measure("user_model.get", {}, iterations, lambda i: UserModel.get(pk)),
+        ]
+    finally:
+        UserModel.delete(pk)
+
+
+def bench_update_user_avatar(iterations: int, depths: Sequence[int] = (0, 10, 100)) -> List[Dict[str, Any]]:
+    from svaeva_redux.schemas.blobs import blob_digest, blob_key
+    from svaeva_redux.schemas.redis import UserImageModel
+    from svaeva_redux.schemas.utils import update_user_avatar
+
+    image = bytes(64 * 1024)
+    results: List[Dict[str, Any]] = []
+    for depth in depths:
+        pk = f"{_PREFIX}-avatar-{depth}"
+        images = [f"{depth}-{i}".encode() + image for i in range(depth + iterations)]
+        try:
+            for data in images[:depth]:
+                update_user_avatar(pk, data, "prompt", max_history_depth=depth)
+
+            def update(i: int, pk: str = pk, images: List[bytes] = images, depth: int = depth) -> None:
+                update_user_avatar(pk, images[depth + i], "prompt", max_history_depth=depth)
+
+            params = {"history_depth": depth, "image_bytes": len(images[0])}
+            results.append(_measure("update_user_avatar", params, iterations, update))
+        finally:
+            UserImageModel.delete(pk)
+            UserImageModel.db().delete(*(blob_key(blob_digest(data)) for data in images))
+    return results
+
+
+def bench_update_user_conversation_embedding(iterations: int, dim: int = 1536) -> List[Dict[str, Any]]:
+    from svaeva_redux.schemas.embeddings import embedding_key
+    from svaeva_redux.schemas.redis import UserModel
+    from svaeva_redux.schemas.utils import update_user_conversation_embedding
+
+    pk = f"{_PREFIX}-embedding"
+    UserModel(id=pk, group_id="bench", platform_id="bench").save()
+    embeddings = np.random.default_rng(0).random((iterations, dim), dtype=np.float32)
+    try:
+        return [
+            _measure(
+                "update_user_conversation_embedding",
+                {"dim": dim},
+                iterations,
+                lambda i: update_user_conversation_embedding(pk, embeddings[i]),
+            )
+        ]
+    finally:
+        UserModel.delete(pk)
+        UserModel.db().delete(embedding_key(pk))
+
+
+def bench_chat_history_messages(
+    iterations: int, session_lengths: Sequence[int] = (10, 100, 1000), window: int = 20
+) -> List[Dict[str, Any]]:
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    from svaeva_redux.langchain.redis import RedisChatMessageHistoryWindowed
+
+    settings = connection.redis_settings()
+    url = settings.get("url") or f"redis://{settings['host']}:{settings['port']}/{settings['db']}"
+    results: List[Dict[str, Any]] = []
+    for length in session_lengths:
+        history = RedisChatMessageHistoryWindowed(
+            f"{_PREFIX}-{length}", url=url, key_prefix=f"{_PREFIX}:", chat_history_length=window
+        )
+        history.clear()
+        try:
+            for i in range(length):
+                history.add_message((HumanMessage if i % 2 == 0 else AIMessage)(content=f"message {i} " * 20))
+
+            def read(i: int, history: RedisChatMessageHistoryWindowed = history) -> Any:
+                return history.messages
+
+            results.append(
+                _measure("chat_history.messages", {"session_length": length, "window": window}, iterations, read)
+            )
+        finally:
+            history.clear()
+    return results
+
+
+def bench_initialize_redis(iterations: int) -> List[Dict[str, Any]]:
+    from svaeva_redux.schemas.utils import initialize_redis
+
+    iterations = max(1, min(iterations, 10))
+    return [
+        _measure("initialize_redis", {"force": True}, iterations, lambda i: initialize_redis(force=True)),
+        _measure("initialize_redis", {"force": False}, iterations, lambda i: initialize_redis()),
+    ]
+
+
+BENCHMARKS: Dict[str, Callable[[int], List[Dict[str, Any]]]] = {
+    "user_model": bench_user_model,
+    "update_user_avatar": bench_update_user_avatar,
+    "update_user_conversation_embedding": bench_update_user_conversation_embedding,
+    "chat_history_messages": bench_chat_history_messages,
+    "initialize_redis": bench_initialize_redis,
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port: int = s.getsockname()[1]
+        return port
+
+
+@contextlib.contextmanager
+def redis_target(target: str) -> Iterator[str]:
+    """Point the package connections at a benchmark target for the duration of the block.
+
+    Args:
+        target (str): ``configured`` (the REDIS_* settings), ``redis-stack`` (a ``redis-stack-server``
+            spawned on a free port) or ``fake`` (an in-process fakeredis server, needs ``fakeredis[json,lua]``).
+
+    Yields:
+        str: A description of the server.
+    """
+    if target == "configured":
+        settings = connection.redis_settings()
+        yield settings.get("url") or f"{settings['host']}:{settings['port']}/{settings['db']}"
+        return
+    if target not in TARGETS:
+        raise ValueError(f"Unknown target {target}, expected one of {TARGETS}")
+
+    port = _free_port()
+    stop: Callable[[], None]
+    if target == "redis-stack":
+        executable = shutil.which("redis-stack-server")
+        if executable is None:
+            raise RuntimeError("redis-stack-server is not on the PATH")
+        process = subprocess.Popen(
+            [executable, "--port", str(port), "--save", "", "--appendonly", "no"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        stop = process.terminate
+    else:
+        try:
+            from fakeredis import TcpFakeServer
+        except ImportError:
+            raise ImportError(
+                "Could not import fakeredis python package. Please install it with `pip install fakeredis[json,lua]`."
+            )
+        server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+
+    try:
+        # Clear every setting that selects another server (or authenticates to one) from the environment.
+        server_settings = {"url": None, "unix_socket_path": None, "shards": None, "username": None, "password": None}
+        with connection.override_redis(**server_settings, host="127.0.0.1", port=port, db=0):
+            deadline = time.monotonic() + 10
+            while True:
+                try:
+                    connection.redis_connection.ping()
+                    break
+                except Exception:
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.05)
+            yield f"{target} 127.0.0.1:{port}"
+    finally:
+        stop()
+
+
+def run_benchmarks(
+    target: str = "fake", iterations: int = 100, names: Optional[List[str]] = None, allow_writes: bool = False
+) -> Dict[str, Any]:
+    """Run the benchmarks and return their results as a JSON-serializable report.
+
+    A benchmark that fails (e.g. on a server lacking a module) is reported with its error instead of results.
+
+    Args:
+        target (str): Where to run, see ``redis_target``.
+        iterations (int): Timed iterations per benchmark.
+        names (Optional[List[str]]): Only run these ``BENCHMARKS``.
+        allow_writes (bool): Allow the ``configured`` target. The benchmarks write and delete ``svaeva-bench``
+            keys, and ``initialize_redis`` rebuilds the indexes and rewrites the presets of the server.
+
+    Returns:
+        Dict[str, Any]: The report.
+    """
+    names = list(BENCHMARKS) if not names else names
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(f"Unknown benchmarks {sorted(unknown)}, expected some of {list(BENCHMARKS)}")
+    if target == "configured" and not allow_writes:
+        raise ValueError("The benchmarks write to the configured server, pass allow_writes=True to run them there")
+    report: Dict[str, Any] = {
+        "version": package_version,
+        "python": platform.python_version(),
+        "timestamp": datetime.now().isoformat(),
+        "iterations": iterations,
+        "results": [],
+        "errors": {},
+    }
+    with redis_target(target) as server:
+        report["target"] = server
+        for name in names:
+            try:
+                report["results"].extend(BENCHMARKS[name](iterations))
+            except Exception as e:
+                report["errors"][name] = f"{type(e).__name__}: {e}"
+    return report
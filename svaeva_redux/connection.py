@@ -0,0 +1,326 @@
+import asyncio
+import contextlib
+import os
+import threading
+import weakref
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+import redis
+import redis.asyncio
+import redis.asyncio.retry
+import redis.retry
+from redis.backoff import ExponentialBackoff
+
+
+def parse_shards(value: str) -> Dict[str, str]:
+    """Parse ``name=url,name=url`` into ``{name: url}``."""
+    shards = {}
+    for item in value.split(","):
+        name, separator, url = item.strip().partition("=")
+        if not separator or not name or not url:
+            raise ValueError(f"Invalid shard {item!r}, expected name=url")
+        shards[name] = url
+    return shards
+
+
+# Setting: (environment variable, parser).
+_ENV_SETTINGS: Dict[str, Tuple[str, Callable[[str], Any]]] = {
+    "url": ("REDIS_URL", str),
+    "host": ("REDIS_HOST", str),
+    "port": ("REDIS_PORT", int),
+    "db": ("REDIS_DB_INDEX", int),
+    "unix_socket_path": ("REDIS_UNIX_SOCKET", str),
+    "username": ("REDIS_USERNAME", str),
+    "password": ("REDIS_PASSWORD", str),
+    "max_connections": ("REDIS_MAX_CONNECTIONS", int),
+    "pool_timeout": ("REDIS_POOL_TIMEOUT", float),
+    "socket_timeout": ("REDIS_SOCKET_TIMEOUT", float),
+    "socket_connect_timeout": ("REDIS_SOCKET_CONNECT_TIMEOUT", float),
+    "socket_keepalive": ("REDIS_SOCKET_KEEPALIVE", lambda value: value.lower() in ("1", "true", "yes", "on")),
+    "health_check_interval": ("REDIS_HEALTH_CHECK_INTERVAL", int),
+    "retries": ("REDIS_RETRIES", int),
+    "backoff_base": ("REDIS_BACKOFF_BASE", float),
+    "backoff_cap": ("REDIS_BACKOFF_CAP", float),
+    "shards": ("REDIS_SHARDS", parse_shards),
+}
+
+DEFAULT_SETTINGS: Dict[str, Any] = {
+    "host": "localhost",
+    "port": 6379,
+    "db": 0,
+    "max_connections": 50,
+    "pool_timeout": 20.0,
+    "socket_timeout": 5.0,
+    "socket_connect_timeout": 5.0,
+    "socket_keepalive": True,
+    "health_check_interval": 30,
+    "retries": 3,
+    "backoff_base": 0.05,
+    "backoff_cap": 1.0,
+}
+
+# Settings that select the server rather than configure its connections.
+_ADDRESS_SETTINGS = ("url", "host", "port", "db", "unix_socket_path", "shards")
+
+_settings: Dict[str, Any] = {}
+_dotenv_loaded = False
+_clients: Dict[str, Any] = {}
+_clients_lock = threading.Lock()
+# Shard the ``LazyRedis`` clients send commands to in the current context, None for the configured server.
+_current_shard: ContextVar[Optional[str]] = ContextVar("svaeva_redux_shard", default=None)
+
+
+def configure_redis(**settings: Any) -> None:
+    """Override the Redis connection settings read from the environment.
+
+    Accepts the keys of ``DEFAULT_SETTINGS``, ``url`` (``redis://``, ``rediss://`` or ``unix://``),
+    ``unix_socket_path``, ``shards`` (``{name: url}``, see ``svaeva_redux.shards``), and any other keyword
+    argument of the redis-py connection classes. Clients created before are dropped and rebuilt with the
+    new settings on next use.
+
+    Examples:
+        .. code:: python
+
+            >>> configure_redis(host="redis.internal", port=6380, db=1, max_connections=20)  # doctest: +SKIP
+    """
+    _settings.update(settings)
+    redis_connection.reset()
+    async_redis_connection.reset()
+    with _clients_lock:
+        _clients.clear()
+
+
+@contextlib.contextmanager
+def override_redis(**settings: Any) -> Iterator[None]:
+    """Apply ``configure_redis(**settings)`` for the duration of the block only."""
+    previous = dict(_settings)
+    configure_redis(**settings)
+    try:
+        yield
+    finally:
+        _settings.clear()
+        configure_redis(**previous)
+
+
+def load_env() -> None:
+    """Load the ``.env`` file into the environment, once."""
+    global _dotenv_loaded
+    if not _dotenv_loaded:
+        import dotenv
+
+        dotenv.load_dotenv(override=True)
+        _dotenv_loaded = True
+
+
+def redis_settings() -> Dict[str, Any]:
+    """Return the connection settings.
+
+    ``configure_redis`` overrides take precedence over the ``REDIS_*`` environment variables, which take
+    precedence over ``DEFAULT_SETTINGS``.
+    """
+    load_env()
+    settings = dict(DEFAULT_SETTINGS)
+    for name, (variable, parse) in _ENV_SETTINGS.items():
+        value = os.getenv(variable)
+        if value:
+            settings[name] = parse(value)
+    settings.update(_settings)
+    return settings
+
+
+def create_client(url: Optional[str] = None, asyncio: bool = False, **overrides: Any) -> Any:
+    """Build a Redis client on a bounded blocking pool, retrying transient errors with exponential backoff.
+
+    When all ``max_connections`` are in use, commands wait up to ``pool_timeout`` seconds for a free
+    connection instead of opening more.
+
+    Args:
+        url (Optional[str]): Connect to this URL instead of the configured server.
+        asyncio (bool): Build a ``redis.asyncio`` client.
+        **overrides (Any): Settings overriding ``redis_settings()``.
+
+    Returns:
+        Any: A ``redis.Redis`` or ``redis.asyncio.Redis`` client.
+    """
+    settings = {**redis_settings(), **overrides}
+    if url is not None:
+        settings["url"] = url
+    module = redis.asyncio if asyncio else redis
+    retry_cls = redis.asyncio.retry.Retry if asyncio else redis.retry.Retry
+    backoff = ExponentialBackoff(cap=settings.pop("backoff_cap"), base=settings.pop("backoff_base"))
+
+    kwargs = {name: value for name, value in settings.items() if name not in _ADDRESS_SETTINGS}
+    kwargs["timeout"] = kwargs.pop("pool_timeout")
+    kwargs["retry"] = retry_cls(backoff, kwargs.pop("retries"))
+    # Socket level errors too, connection attempts raise them before they are wrapped.
+    kwargs["retry_on_error"] = [redis.exceptions.ConnectionError, redis.exceptions.TimeoutError, OSError]
+
+    url, path = settings.get("url"), settings.get("unix_socket_path")
+    is_unix_socket = url.startswith("unix://") if url else bool(path)
+    if is_unix_socket:
+        # TCP only options.
+        kwargs.pop("socket_keepalive", None)
+        kwargs.pop("socket_connect_timeout", None)
+    if url:
+        pool = module.BlockingConnectionPool.from_url(url, **kwargs)
+    elif path:
+        connection_class = module.UnixDomainSocketConnection
+        pool = module.BlockingConnectionPool(connection_class=connection_class, path=path, db=settings["db"], **kwargs)
+    else:
+        pool = module.BlockingConnectionPool(host=settings["host"], port=settings["port"], db=settings["db"], **kwargs)
+    return module.Redis(connection_pool=pool)
+
+
+def shard_url(name: str) -> str:
+    """Return the URL of the shard ``name``."""
+    shards = redis_settings().get("shards") or {}
+    if name not in shards:
+        raise ValueError(f"Unknown shard {name}, expected one of {list(shards)}")
+    url: str = shards[name]
+    return url
+
+
+def current_shard() -> Optional[str]:
+    """Return the shard selected by ``use_shard`` in the current context, None for the configured server."""
+    return _current_shard.get()
+
+
+@contextlib.contextmanager
+def use_shard(name: Optional[str]) -> Iterator[None]:
+    """Send the commands of ``redis_connection`` and ``async_redis_connection`` to shard ``name`` in the block.
+
+    The selection follows the context: threads and asyncio tasks started elsewhere are not affected. None
+    selects the configured server.
+    """
+    token = _current_shard.set(name)
+    try:
+        yield
+    finally:
+        _current_shard.reset(token)
+
+
+def get_shared_client(url: str, factory: Optional[Callable[[], Any]] = None) -> Any:
+    """Return the Redis client for ``url``, created on first use and shared by the whole process.
+
+    Redis clients are thread safe and pool their connections, so every user of a server reuses the same
+    pool instead of opening its own.
+
+    Args:
+        url (str): The Redis URL.
+        factory (Optional[Callable[[], Any]]): Builds the client, ``create_client(url)`` by default.
+    """
+    client = _clients.get(url)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(url)
+            if client is None:
+                client = _clients[url] = factory() if factory is not None else create_client(url)
+    return client
+
+
+class LazyScript:
+    """Lua script registered on a ``LazyRedis``, run on the client it stands in for at call time.
+
+    Scripts run by SHA, loaded on a server the first time it does not know them.
+    """
+
+    def __init__(self, lazy_client: "LazyRedis", script: str):
+        self.lazy_client = lazy_client
+        self.script = script
+        self._script: Optional[Any] = None
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        client = self.lazy_client.client
+        if self._script is None:
+            self._script = client.register_script(self.script)
+        kwargs.setdefault("client", client)
+        return self._script(*args, **kwargs)
+
+
+class LazyRedis:
+    """Stand-in for a Redis client, built on first use from the settings current at that time.
+
+    Within ``use_shard`` it stands in for the client of that shard instead, built by ``shard_factory``.
+    """
+
+    def __init__(self, factory: Callable[[], Any], shard_factory: Optional[Callable[[str], Any]] = None):
+        self._factory = factory
+        self._shard_factory = shard_factory
+        # Shard name (None for the configured server): client.
+        self._clients: Dict[Optional[str], Any] = {}
+        self._lock = threading.Lock()
+
+    def _scope(self) -> Dict[Optional[str], Any]:
+        """The clients usable by the caller."""
+        return self._clients
+
+    @property
+    def client(self) -> Any:
+        return self._get(_current_shard.get() if self._shard_factory is not None else None)
+
+    def shard(self, name: str) -> Any:
+        """Return the client of shard ``name``, whatever shard the context selected."""
+        return self._get(name)
+
+    def _get(self, name: Optional[str]) -> Any:
+        clients = self._scope()
+        client = clients.get(name)
+        if client is None:
+            with self._lock:
+                client = clients.get(name)
+                if client is None:
+                    client = clients[name] = self._build(name)
+        return client
+
+    def _build(self, name: Optional[str]) -> Any:
+        if name is None:
+            return self._factory()
+        if self._shard_factory is None:
+            raise ValueError(f"{type(self).__name__} has no shards")
+        return self._shard_factory(name)
+
+    def reset(self) -> None:
+        """Drop the clients, the next use builds new ones."""
+        self._clients = {}
+
+    def register_script(self, script: str) -> LazyScript:
+        return LazyScript(self, script)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self._scope().get(None)!r})"
+
+
+class AsyncLazyRedis(LazyRedis):
+    """``LazyRedis`` for ``redis.asyncio`` clients, which only work in the event loop they connected from.
+
+    Each running event loop gets its own clients (dropped with the loop), so successive ``asyncio.run``
+    calls do not reuse connections of a closed loop.
+    """
+
+    def __init__(self, factory: Callable[[], Any], shard_factory: Optional[Callable[[str], Any]] = None):
+        super().__init__(factory, shard_factory)
+        self._loops: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Optional[str], Any]]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def _scope(self) -> Dict[Optional[str], Any]:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return self._clients
+        with self._lock:
+            return self._loops.setdefault(loop, {})
+
+    def reset(self) -> None:
+        super().reset()
+        self._loops = weakref.WeakKeyDictionary()
+
+
+redis_connection = LazyRedis(create_client, lambda name: create_client(shard_url(name)))
+async_redis_connection = AsyncLazyRedis(
+    lambda: create_client(asyncio=True), lambda name: create_client(shard_url(name), asyncio=True)
+)
@@ -1,5 +1,7 @@
 import json
-from typing import List, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
 
 from langchain_community.chat_message_histories import (
     RedisChatMessageHistory,
@@ -7,12 +9,67 @@ from langchain_community.chat_message_histories import (
 from langchain_community.utilities.redis import get_client
 from langchain_core.messages import (
     BaseMessage,
+    message_to_dict,
     messages_from_dict,
 )
 
+from svaeva_redux import connection
+from svaeva_redux.langchain.tokens import TokenCounter, conversation_token_budget, count_message_tokens
+from svaeva_redux.metrics import instrument, record_payload, timed
+from svaeva_redux.shards import hash_ring, move_keys
+
+
+def get_shared_client(url: str) -> Any:
+    """Return the process-wide client for ``url``, see ``svaeva_redux.connection.get_shared_client``.
+
+    Sentinel URLs, which the connection module does not handle, go through langchain's ``get_client``.
+    """
+    factory = (lambda: get_client(redis_url=url)) if "sentinel" in url.split("://", 1)[0] else None
+    return connection.get_shared_client(url, factory)
+
+
+# Messages in chronological order, with the token count stored alongside each (None if unknown).
+Window = List[Tuple[BaseMessage, Optional[int]]]
+
+
+class MessageWindowCache:
+    """Decoded message windows (and their token counts) of recently read sessions, keyed by Redis key.
+
+    Each entry remembers the list length it was read at, so a later read only fetches and decodes the
+    messages appended since. Least recently used sessions are evicted beyond ``max_sessions``.
+    """
+
+    def __init__(self, max_sessions: int = 1024):
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, Tuple[int, Window]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Tuple[int, "Window"]]:
+        entry = self._sessions.get(key)
+        if entry is not None:
+            self._sessions.move_to_end(key)
+        return entry
+
+    def put(self, key: str, length: int, window: "Window") -> None:
+        self._sessions[key] = (length, window)
+        self._sessions.move_to_end(key)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def invalidate(self, key: str) -> None:
+        self._sessions.pop(key, None)
+
 
 class RedisChatMessageHistoryWindowed(RedisChatMessageHistory):
-    """Chat message history stored in a Redis database."""
+    """Chat message history stored in a Redis database, read back as a window of the latest messages.
+
+    The window holds the latest ``chat_history_length`` messages or, if ``max_token_budget`` is set, as many
+    of the latest ones as fit in that many tokens: when the first ``chat_history_length`` all fit, older
+    messages are read in stages twice as long each time until the budget is used up. Token counts are
+    computed once when a message is added and stored with it, so windowing never re-tokenizes the history.
+
+    With ``shard_urls`` (``{name: url}``), the history is stored on the shard that the consistent hash of
+    ``session_id`` selects, and ``url`` is ignored; see ``rebalance_histories`` when shards change.
+    """
 
     def __init__(
         self,
@@ -21,14 +78,20 @@ class RedisChatMessageHistoryWindowed(RedisChatMessageHistory):
         key_prefix: str = "message_store:",
         ttl: Optional[int] = None,
         chat_history_length: int = 20,
+        cache: Optional[MessageWindowCache] = None,
+        max_token_budget: Optional[int] = None,
+        token_counter: Optional[TokenCounter] = None,
+        shard_urls: Optional[Mapping[str, str]] = None,
     ):
         try:
             import redis
         except ImportError:
             raise ImportError("Could not import redis python package. " "Please install it with `pip install redis`.")
 
+        if shard_urls:
+            url = shard_urls[history_shard(shard_urls, session_id)]
         try:
-            self.redis_client = get_client(redis_url=url)
+            self.redis_client = get_shared_client(url)
         except redis.exceptions.ConnectionError as error:
             raise ConnectionError(f"Could not connect to Redis at {url}.") from error
 
@@ -36,13 +99,200 @@ class RedisChatMessageHistoryWindowed(RedisChatMessageHistory):
         self.key_prefix = key_prefix
         self.ttl = ttl
         self.chat_history_length = chat_history_length
+        self.cache = cache
+        self.max_token_budget = max_token_budget
+        self.token_counter = token_counter
+
+    def add_message(self, message: BaseMessage) -> None:
+        """Append the message, with its token count, to the record in Redis"""
+        record = message_to_dict(message)
+        record["token_count"] = count_message_tokens(message, self.token_counter)
+        data = json.dumps(record)
+        with timed("chat_history.add_message"):
+            record_payload(len(data))
+            pipeline = self.redis_client.pipeline()
+            pipeline.lpush(self.key, data)
+            if self.ttl:
+                pipeline.expire(self.key, self.ttl)
+            pipeline.execute()
+
+    @staticmethod
+    def _decode(items: List[bytes]) -> Window:
+        record_payload(sum(map(len, items)))
+        # Messages are LPUSHed, so Redis returns them newest first.
+        records = [json.loads(m.decode("utf-8")) for m in items[::-1]]
+        return list(zip(messages_from_dict(records), [record.get("token_count") for record in records]))
+
+    @classmethod
+    def from_conversation(cls, session_id: str, conversation: Any, **kwargs: Any) -> "RedisChatMessageHistoryWindowed":
+        """Build the history of a session of ``conversation`` (a ``ConversationModel``), windowed by its
+        ``chat_history_length`` and the tokens its context leaves for history (see ``conversation_token_budget``).
+        """
+        budget = conversation_token_budget(conversation, kwargs.get("token_counter"))
+        return cls(session_id, chat_history_length=conversation.chat_history_length, max_token_budget=budget, **kwargs)
+
+    def _fit_budget(self, window: Window, length: int) -> List[BaseMessage]:
+        """Keep the latest messages of ``window``, the newest of the ``length`` in the history, that fit in
+        ``max_token_budget``, reading older ones in stages while they all fit."""
+        if self.max_token_budget is None:
+            return [message for message, _ in window]
+        fitted: List[BaseMessage] = []
+        used = read = 0
+        stage = len(window)
+        while True:
+            for message, token_count in reversed(window):
+                if token_count is None:
+                    token_count = count_message_tokens(message, self.token_counter)
+                if used + token_count > self.max_token_budget:
+                    return fitted[::-1]
+                used += token_count
+                fitted.append(message)
+            read += len(window)
+            if not window or read >= length:
+                return fitted[::-1]
+            stage *= 2
+            # The oldest messages are the last items of the list: index them from the tail, so messages
+            # pushed in the meantime do not shift them.
+            older = length - read
+            window = self._decode(self.redis_client.lrange(self.key, -older, -max(older - stage, 0) - 1))
 
     @property
     def messages(self) -> List[BaseMessage]:  # type: ignore
-        """Retrieve the messages from Redis"""
-        _items = self.redis_client.lrange(self.key, 0, -1)
-        # items = [json.loads(m.decode("utf-8")) for m in _items[::-1]]
-        _items = _items[0 : self.chat_history_length]
-        items = [json.loads(m.decode("utf-8")) for m in _items[::-1]]
-        messages = messages_from_dict(items)
-        return messages
+        """Retrieve the latest messages from Redis, within ``chat_history_length`` and ``max_token_budget``"""
+        with timed("chat_history.messages"):
+            return self._read_messages()
+
+    def _read_messages(self) -> List[BaseMessage]:
+        if self.chat_history_length <= 0:
+            return []
+        if self.cache is None:
+            pipeline = self.redis_client.pipeline()
+            pipeline.lrange(self.key, 0, self.chat_history_length - 1)
+            if self.max_token_budget is not None:
+                pipeline.llen(self.key)
+            items, *lengths = pipeline.execute()
+            return self._fit_budget(self._decode(items), lengths[0] if lengths else len(items))
+
+        length = self.redis_client.llen(self.key)
+        known = 0
+        window: Window = []
+        entry = self.cache.get(self.key)
+        if entry is not None and entry[0] <= length and len(entry[1]) >= min(entry[0], self.chat_history_length):
+            known, window = entry
+        if length > known:
+            # Index from the tail: positions counted from the oldest message do not move when
+            # other writers push new messages in the meantime.
+            skip = max(known, length - self.chat_history_length)
+            window = window + self._decode(self.redis_client.lrange(self.key, -length, -(skip + 1)))
+        window = window[-self.chat_history_length :]
+        self.cache.put(self.key, length, window)
+        return self._fit_budget(window, length)
+
+    def messages_since(self, watermark: int) -> Tuple[int, List[BaseMessage]]:
+        """Retrieve the messages added after the first ``watermark`` ones, oldest first, with the history length
+
+        The window limits do not apply. A length below ``watermark`` means the history was cleared or expired
+        since, and all its messages are returned.
+        """
+        with timed("chat_history.messages_since"):
+            pipeline = self.redis_client.pipeline()
+            pipeline.llen(self.key)
+            # Messages are LPUSHed: the oldest ``watermark`` ones are the last items of the list.
+            pipeline.lrange(self.key, 0, -(watermark + 1))
+            length, items = pipeline.execute()
+            if length < watermark:
+                items = self.redis_client.lrange(self.key, 0, -1)
+            return length, [message for message, _ in self._decode(items)]
+
+    def clear(self) -> None:
+        """Clear session memory from Redis"""
+        super().clear()
+        if self.cache is not None:
+            self.cache.invalidate(self.key)
+
+
+def history_shard(shard_urls: Mapping[str, str], session_id: str) -> str:
+    """Return the name of the shard in ``shard_urls`` storing the history of ``session_id``."""
+    return hash_ring(tuple(sorted(shard_urls))).node(session_id)
+
+
+@instrument("chat_history.fetch_messages")
+def fetch_messages(histories: Sequence[RedisChatMessageHistoryWindowed]) -> List[List[BaseMessage]]:
+    """Retrieve the message windows of several histories, in one pipelined round trip per Redis client.
+
+    The round trips to different clients (e.g. shards) run in parallel.
+
+    Args:
+        histories (Sequence[RedisChatMessageHistoryWindowed]): The histories.
+
+    Returns:
+        List[List[BaseMessage]]: The messages of each history, as ``history.messages`` would return them.
+    """
+    windows: List[List[BaseMessage]] = [[] for _ in histories]
+    by_client: Dict[int, List[int]] = {}
+    for i, history in enumerate(histories):
+        if history.chat_history_length > 0:
+            by_client.setdefault(id(history.redis_client), []).append(i)
+
+    def fetch(indices: List[int]) -> None:
+        # A transaction, so each window is read at the length read with it.
+        pipeline = histories[indices[0]].redis_client.pipeline()
+        for i in indices:
+            pipeline.lrange(histories[i].key, 0, histories[i].chat_history_length - 1)
+            pipeline.llen(histories[i].key)
+        results = pipeline.execute()
+        for i, items, length in zip(indices, results[::2], results[1::2]):
+            windows[i] = histories[i]._fit_budget(histories[i]._decode(items), length)
+
+    if len(by_client) > 1:
+        with ThreadPoolExecutor(len(by_client), thread_name_prefix="fetch_messages") as executor:
+            list(executor.map(fetch, by_client.values()))
+    else:
+        for indices in by_client.values():
+            fetch(indices)
+    return windows
+
+
+@instrument("chat_history.rebalance_histories")
+def rebalance_histories(
+    shard_urls: Mapping[str, str], key_prefix: str = "message_store:", batch_size: int = 500
+) -> Dict[str, int]:
+    """Move the chat histories to the shard owning their session, after shards were added or removed.
+
+    A moved history is appended to the messages its session may already have on its new shard (written
+    there since the change, so newer), keeping its TTL, then deleted from the old one.
+
+    Args:
+        shard_urls (Mapping[str, str]): The shards, ``{name: url}``, as given to the histories.
+        key_prefix (str): Key prefix of the histories.
+        batch_size (int): Keys per SCAN call.
+
+    Returns:
+        Dict[str, int]: The number of histories moved off each shard.
+    """
+    clients = {name: get_shared_client(url) for name, url in shard_urls.items()}
+    moved = {name: 0 for name in shard_urls}
+    for name, client in clients.items():
+        for key in client.scan_iter(match=f"{key_prefix}*", count=batch_size, _type="list"):
+            key = key.decode() if isinstance(key, bytes) else key
+            owner = history_shard(shard_urls, key[len(key_prefix) :])
+            if owner == name:
+                continue
+            target = clients[owner]
+            if not target.exists(key):
+                move_keys(client, target, [key])
+            else:
+                pipeline = client.pipeline()
+                pipeline.lrange(key, 0, -1)
+                pipeline.pttl(key)
+                items, ttl = pipeline.execute()
+                pipeline = target.pipeline()
+                # Newest first, like LPUSH writes them: the older messages go after the newer ones.
+                if items:
+                    pipeline.rpush(key, *items)
+                if ttl > 0:
+                    pipeline.pexpire(key, ttl)
+                pipeline.execute()
+                client.delete(key)
+            moved[name] += 1
+    return moved
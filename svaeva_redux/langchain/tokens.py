@@ -0,0 +1,59 @@
+import math
+import re
+from typing import Any, Callable, Optional
+
+from langchain_core.messages import BaseMessage
+
+# Counts the tokens of a piece of text.
+TokenCounter = Callable[[str], int]
+
+# Tokens every chat message costs on top of its content (role and separators).
+MESSAGE_TOKEN_OVERHEAD = 4
+
+_WORD = re.compile(r"\w+")
+_SYMBOL = re.compile(r"[^\w\s]")
+
+
+def approximate_token_count(text: str) -> int:
+    """Estimate the token count of ``text`` without a tokenizer model.
+
+    Words count one token per four characters (BPE vocabularies split long and rare words), every
+    punctuation mark or symbol counts one token.
+
+    Examples:
+        .. code:: python
+
+            >>> approximate_token_count("Hello, world!")  # 2 + 2 words, 2 punctuation marks
+            6
+    """
+    words = sum(math.ceil(len(word) / 4) for word in _WORD.findall(text))
+    return words + len(_SYMBOL.findall(text))
+
+
+def tiktoken_token_counter(encoding_name: str = "cl100k_base") -> TokenCounter:
+    """Return a counter using an OpenAI ``tiktoken`` encoding."""
+    try:
+        import tiktoken
+    except ImportError:
+        raise ImportError("Could not import tiktoken python package. " "Please install it with `pip install tiktoken`.")
+
+    encoding = tiktoken.get_encoding(encoding_name)
+    return lambda text: len(encoding.encode(text))
+
+
+def count_message_tokens(message: BaseMessage, token_counter: Optional[TokenCounter] = None) -> int:
+    """Return the tokens ``message`` takes up in a chat prompt."""
+    token_counter = token_counter or approximate_token_count
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    return token_counter(content) + MESSAGE_TOKEN_OVERHEAD
+
+
+def conversation_token_budget(conversation: Any, token_counter: Optional[TokenCounter] = None) -> int:
+    """Return the tokens left for chat history by a ``ConversationModel``.
+
+    That is the model context minus the completion (``max_tokens``) and the system prompt.
+    """
+    token_counter = token_counter or approximate_token_count
+    system_prompt_tokens = token_counter(conversation.lm_system_prompt or "") + MESSAGE_TOKEN_OVERHEAD
+    budget: int = max(0, conversation.model_token_limit - conversation.max_tokens - system_prompt_tokens)
+    return budget
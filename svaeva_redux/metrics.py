@@ -0,0 +1,304 @@
+import atexit
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from types import TracebackType
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Type
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets, the last bucket is +Inf.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+METRICS_KEY = "svaeva_redux:metrics"
+
+# Called with the operation name around every timed operation, returning a context manager (e.g. a tracing span).
+Hook = Callable[[str], ContextManager[Any]]
+
+_current: ContextVar[Optional["Timer"]] = ContextVar("svaeva_redux_timer", default=None)
+
+
+class OperationStats:
+    """Latency histogram, error count and payload size total of one operation."""
+
+    __slots__ = ("count", "errors", "seconds", "payload_bytes", "buckets")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.payload_bytes = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, seconds: float, payload_bytes: int, error: bool) -> None:
+        self.count += 1
+        self.seconds += seconds
+        self.payload_bytes += payload_bytes
+        self.errors += error
+        self.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate a latency quantile as the upper bound of the bucket it falls in."""
+        rank, seen = q * self.count, 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def copy(self) -> "OperationStats":
+        stats = OperationStats()
+        stats.count, stats.errors, stats.seconds, stats.payload_bytes = (
+            self.count,
+            self.errors,
+            self.seconds,
+            self.payload_bytes,
+        )
+        stats.buckets = list(self.buckets)
+        return stats
+
+    def to_fields(self) -> Dict[str, float]:
+        fields = {"count": self.count, "errors": self.errors, "seconds": self.seconds, "bytes": self.payload_bytes}
+        fields.update({f"bucket{i}": count for i, count in enumerate(self.buckets)})
+        return fields
+
+
+class Metrics:
+    """Process-wide registry of operation stats.
+
+    Once something is observed, the stats are flushed to Redis every SVAEVA_METRICS_FLUSH_INTERVAL seconds
+    (10 by default) and at exit, from a background thread; 0 leaves flushing to explicit ``flush`` calls.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = os.getenv("SVAEVA_METRICS", "1").lower() not in ("0", "false", "no", "off")
+        self.flush_interval = float(os.getenv("SVAEVA_METRICS_FLUSH_INTERVAL", 10))
+        self.hooks: List[Hook] = []
+        self._operations: Dict[str, OperationStats] = {}
+        self._flushed: Dict[str, OperationStats] = {}
+        self._lock = threading.Lock()
+        # Serializes flushes (background, at exit and explicit) and resets, so no delta is sent twice.
+        self._flush_lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+
+    def observe(self, operation: str, seconds: float, payload_bytes: int = 0, error: bool = False) -> None:
+        with self._lock:
+            stats = self._operations.get(operation)
+            if stats is None:
+                stats = self._operations[operation] = OperationStats()
+            stats.observe(seconds, payload_bytes, error)
+        if self.flush_interval > 0 and self._flusher is None:
+            self.start_flusher(self.flush_interval)
+
+    def snapshot(self) -> Dict[str, OperationStats]:
+        """Return a copy of the stats of every operation observed in this process."""
+        with self._lock:
+            return {operation: stats.copy() for operation, stats in self._operations.items()}
+
+    def reset(self) -> None:
+        with self._flush_lock, self._lock:
+            self._operations.clear()
+            self._flushed.clear()
+
+    def flush(self, db: Any = None) -> None:
+        """Add the stats observed since the last flush to the totals in Redis, shared by every process."""
+        if db is None:
+            from svaeva_redux.connection import redis_connection as db
+        with self._flush_lock:
+            snapshot = self.snapshot()
+            pipeline = db.pipeline(transaction=False)
+            for operation, stats in snapshot.items():
+                flushed = self._flushed.get(operation, OperationStats()).to_fields()
+                for field, value in stats.to_fields().items():
+                    delta = value - flushed[field]
+                    if delta and field == "seconds":
+                        pipeline.hincrbyfloat(METRICS_KEY, f"{operation}|{field}", delta)
+                    elif delta:
+                        pipeline.hincrby(METRICS_KEY, f"{operation}|{field}", int(delta))
+            pipeline.execute()
+            self._flushed = snapshot
+
+    def start_flusher(self, interval: float) -> None:
+        """Flush every ``interval`` seconds, and at exit, from a background thread."""
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_forever, args=(interval,), daemon=True)
+        self._flusher.start()
+        atexit.register(self._try_flush)
+
+    def _flush_forever(self, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            self._try_flush()
+
+    def _try_flush(self) -> None:
+        import redis.exceptions
+
+        try:
+            self.flush()
+        except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError) as e:
+            # Redis may be briefly unavailable, the next flush catches up.
+            logger.debug(f"Could not flush the metrics: {e}")
+
+
+metrics = Metrics()
+
+
+class Timer:
+    """Context manager recording the latency, payload size and outcome of an operation.
+
+    Nested timers of the same operation (an override calling ``super()``) only record once.
+    """
+
+    __slots__ = ("operation", "payload_bytes", "error", "_start", "_token", "_spans")
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.payload_bytes = 0
+        self.error = False
+
+    def __enter__(self) -> "Timer":
+        current = _current.get()
+        if not metrics.enabled or (current is not None and current.operation == self.operation):
+            self._token = None
+            return current or self
+        self._token = _current.set(self)
+        self._spans = [hook(self.operation) for hook in metrics.hooks]
+        for span in self._spans:
+            span.__enter__()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(
+        self, exc_type: Optional[Type[BaseException]], exc: Optional[BaseException], tb: Optional[TracebackType]
+    ) -> None:
+        if self._token is None:
+            return
+        metrics.observe(
+            self.operation, time.perf_counter() - self._start, self.payload_bytes, self.error or exc_type is not None
+        )
+        _current.reset(self._token)
+        for span in reversed(self._spans):
+            span.__exit__(exc_type, exc, tb)
+
+
+def timed(operation: str) -> Timer:
+    """Time the enclosed block as ``operation``.
+
+    Examples:
+        .. code:: python
+
+            >>> with timed("chat_history.messages"):  # doctest: +SKIP
+            ...     items = client.lrange(key, 0, 9)
+            ...     record_payload(sum(map(len, items)))
+    """
+    return Timer(operation)
+
+
+def instrument(operation: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator timing every call of a function or coroutine function as ``operation``."""
+
+    def decorator(function: Callable[..., Any]) -> Callable[..., Any]:
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with Timer(operation):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with Timer(operation):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record_payload(size: int) -> None:
+    """Add ``size`` bytes to the payload of the operation being timed."""
+    current = _current.get()
+    if current is not None:
+        current.payload_bytes += size
+
+
+def record_error() -> None:
+    """Count the operation being timed as failed, for errors that are handled rather than raised."""
+    current = _current.get()
+    if current is not None:
+        current.error = True
+
+
+def add_hook(hook: Hook) -> None:
+    """Run ``hook(operation)`` as a context manager around every timed operation.
+
+    Examples:
+        .. code:: python
+
+            >>> from opentelemetry import trace  # doctest: +SKIP
+            >>> tracer = trace.get_tracer("svaeva_redux")  # doctest: +SKIP
+            >>> add_hook(tracer.start_as_current_span)  # doctest: +SKIP
+    """
+    metrics.hooks.append(hook)
+
+
+def remove_hook(hook: Hook) -> None:
+    metrics.hooks.remove(hook)
+
+
+def load_metrics(db: Any = None) -> Dict[str, OperationStats]:
+    """Return the totals flushed to Redis by every process."""
+    if db is None:
+        from svaeva_redux.connection import redis_connection as db
+    operations: Dict[str, OperationStats] = {}
+    for key, value in db.hgetall(METRICS_KEY).items():
+        operation, field = key.decode().rsplit("|", 1)
+        stats = operations.setdefault(operation, OperationStats())
+        if field.startswith("bucket"):
+            stats.buckets[int(field[len("bucket") :])] = int(value)
+        elif field == "seconds":
+            stats.seconds = float(value)
+        else:
+            setattr(stats, {"bytes": "payload_bytes"}.get(field, field), int(value))
+    return operations
+
+
+def clear_metrics(db: Any = None) -> None:
+    """Delete the totals flushed to Redis."""
+    if db is None:
+        from svaeva_redux.connection import redis_connection as db
+    db.delete(METRICS_KEY)
+    metrics._flushed = metrics.snapshot()
+
+
+def render_prometheus(operations: Dict[str, OperationStats]) -> str:
+    """Render operation stats in the Prometheus text exposition format."""
+    lines = [
+        "# HELP svaeva_redux_operation_seconds Latency of svaeva_redux Redis operations.",
+        "# TYPE svaeva_redux_operation_seconds histogram",
+    ]
+    for operation, stats in sorted(operations.items()):
+        cumulative = 0
+        for bound, count in zip((*LATENCY_BUCKETS, "+Inf"), stats.buckets):
+            cumulative += count
+            lines.append(f'svaeva_redux_operation_seconds_bucket{{operation="{operation}",le="{bound}"}} {cumulative}')
+        lines.append(f'svaeva_redux_operation_seconds_sum{{operation="{operation}"}} {stats.seconds}')
+        lines.append(f'svaeva_redux_operation_seconds_count{{operation="{operation}"}} {stats.count}')
+    for name, attribute, help_text in (
+        ("errors", "errors", "Failed svaeva_redux Redis operations."),
+        ("payload_bytes", "payload_bytes", "Payload bytes written or read by svaeva_redux Redis operations."),
+    ):
+        lines.append(f"# HELP svaeva_redux_operation_{name}_total {help_text}")
+        lines.append(f"# TYPE svaeva_redux_operation_{name}_total counter")
+        for operation, stats in sorted(operations.items()):
+            value = getattr(stats, attribute)
+            lines.append(f'svaeva_redux_operation_{name}_total{{operation="{operation}"}} {value}')
+    return "\n".join(lines) + "\n"
@@ -1,3 +1,5 @@
+import os
+
 from redisvl.schema import IndexSchema
 
-schema = IndexSchema.from_yaml("svaeva_redux/rag/redisvl/schema.yaml")
+schema = IndexSchema.from_yaml(os.path.join(os.path.dirname(__file__), "schema.yaml"))
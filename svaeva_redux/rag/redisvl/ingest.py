@@ -0,0 +1,301 @@
+import glob
+import hashlib
+import importlib
+import json
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from svaeva_redux.connection import redis_connection
+from svaeva_redux.metrics import instrument, record_payload
+
+DOCUMENTS_SCHEMA = os.path.join(os.path.dirname(__file__), "documents.yaml")
+# Outside the document prefix, which RediSearch matches as a plain string prefix.
+CHECKPOINT_KEY_PREFIX = "svaeva_redux:checkpoint:"
+TEXT_EXTENSIONS = (".txt", ".md", ".rst")
+
+# Maps a batch of texts to a (len(texts), dims) float32 array. Must be picklable to run in worker processes.
+Embedder = Callable[[List[str]], NDArray[Any]]
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+class Document:
+    """A text to ingest, identified by ``id``. Re-ingesting an unchanged id is skipped."""
+
+    __slots__ = ("id", "text", "source")
+
+    def __init__(self, id: str, text: str, source: str = ""):
+        self.id = id
+        self.text = text
+        self.source = source
+
+    @property
+    def digest(self) -> str:
+        return hashlib.sha256(self.text.encode()).hexdigest()
+
+
+class HashingEmbedder:
+    """Deterministic, offline bag-of-words embedder: each token is hashed to a signed dimension.
+
+    Good enough to exercise and test the pipeline, and for keyword-like similarity, without a model or an
+    API key. Plug in a real embedder (see ``load_embedder``) for semantic search.
+    """
+
+    def __init__(self, dims: int = 256):
+        self.dims = dims
+
+    def __call__(self, texts: List[str]) -> NDArray[Any]:
+        vectors = np.zeros((len(texts), self.dims), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in _TOKEN.findall(text.lower()):
+                value = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "little")
+                vectors[row, value % self.dims] += 1.0 if value >> 63 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        normalized: NDArray[Any] = vectors / np.where(norms == 0, 1.0, norms)
+        return normalized
+
+
+def load_embedder(spec: Optional[str], dims: int) -> Embedder:
+    """Resolve ``module:attribute`` to an embedder (instantiated with ``dims`` if it is a class).
+
+    ``None`` is the ``HashingEmbedder``.
+    """
+    if spec is None:
+        return HashingEmbedder(dims)
+    module, _, attribute = spec.partition(":")
+    embedder = getattr(importlib.import_module(module), attribute)
+    loaded: Embedder = embedder(dims) if isinstance(embedder, type) else embedder
+    return loaded
+
+
+def load_index_schema(path: str = DOCUMENTS_SCHEMA) -> Dict[str, Any]:
+    """Read the index name, key prefix and vector field (name and dims) of a redisvl YAML schema."""
+    import yaml
+
+    with open(path) as f:
+        schema = yaml.safe_load(f)
+    vector = next(field for field in schema["fields"] if field["type"] == "vector")
+    return {
+        "name": schema["index"]["name"],
+        "prefix": schema["index"]["prefix"],
+        "key_separator": schema["index"].get("key_separator", ":"),
+        "vector_field": vector["name"],
+        "dims": int(vector["attrs"]["dims"]),
+    }
+
+
+def create_index(path: str = DOCUMENTS_SCHEMA, db: Any = None) -> None:
+    """Create the redisvl index described by the schema, unless it exists."""
+    try:
+        from redisvl.index import SearchIndex
+    except ImportError:
+        raise ImportError("Could not import redisvl python package. Please install it with `pip install redisvl`.")
+    index = SearchIndex.from_yaml(path)
+    index.set_client(redis_connection.client if db is None else db)
+    index.create(overwrite=False)
+
+
+def iter_documents(sources: Sequence[str]) -> Iterator[Document]:
+    """Read documents lazily from text files, directories of them, globs, and NDJSON files.
+
+    NDJSON lines are ``{"id": ..., "text": ..., "source": ...}``; text files become one document each,
+    identified by their path.
+    """
+    for source in sources:
+        if os.path.isdir(source):
+            paths = sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(source)
+                for name in names
+                if name.endswith((*TEXT_EXTENSIONS, ".ndjson", ".jsonl"))
+            )
+        else:
+            paths = sorted(glob.glob(source)) or [source]
+        for path in paths:
+            if path.endswith((".ndjson", ".jsonl")):
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            record = json.loads(line)
+                            yield Document(str(record["id"]), record["text"], record.get("source", path))
+            else:
+                with open(path, encoding="utf-8") as f:
+                    yield Document(path, f.read(), path)
+
+
+def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> Iterator[str]:
+    """Split ``text`` into chunks of about ``chunk_size`` characters overlapping by ``overlap``, cut on whitespace."""
+    if overlap >= chunk_size:
+        raise ValueError("overlap must be smaller than chunk_size")
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            cut = text.rfind(" ", start + overlap + 1, end)
+            end = cut if cut > start else end
+        chunk = text[start:end].strip()
+        if chunk:
+            yield chunk
+        if end == len(text):
+            return
+        start = max(end - overlap, start + 1)
+
+
+# (document id, source, chunk index, chunk text)
+Chunk = Tuple[str, str, int, str]
+
+
+class Ingestion:
+    """Streams documents through chunking, batched embedding (in a process pool) and pipelined writes.
+
+    At most ``max_pending`` embedding batches are in flight, so memory stays bounded by
+    ``batch_size * max_pending`` chunks whatever the corpus size. A document is checkpointed (its text hash
+    and chunk count) in the pipeline that writes its last chunk, so an interrupted run resumes after the
+    last complete document, and re-ingesting a changed document replaces its chunks.
+    """
+
+    def __init__(
+        self,
+        embedder: Optional[Embedder] = None,
+        schema: str = DOCUMENTS_SCHEMA,
+        chunk_size: int = 1000,
+        overlap: int = 200,
+        batch_size: int = 64,
+        workers: int = 0,
+        db: Any = None,
+    ):
+        self.schema = load_index_schema(schema)
+        self.embedder = embedder or HashingEmbedder(self.schema["dims"])
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.workers = workers
+        self.max_pending = max(2 * workers, 1)
+        self.db = redis_connection if db is None else db
+        self.checkpoint_key = f"{CHECKPOINT_KEY_PREFIX}{self.schema['name']}"
+        self.stats = {"documents": 0, "skipped": 0, "chunks": 0}
+        # Document id: (text digest, chunk count, chunk count of the previous ingestion) until checkpointed.
+        self._progress: Dict[str, Tuple[str, int, int]] = {}
+
+    def chunk_key(self, doc_id: str, index: int) -> str:
+        separator = self.schema["key_separator"]
+        return f"{self.schema['prefix']}{separator}{doc_id}{separator}{index}"
+
+    def reset(self) -> None:
+        """Forget the checkpoint, so every document is ingested again."""
+        self.db.delete(self.checkpoint_key)
+
+    def _batches(self, documents: Iterable[Document]) -> Iterator[Tuple[List[Chunk], List[str]]]:
+        """Yield chunk batches, each with the documents whose last chunk it holds."""
+        batch: List[Chunk] = []
+        completed: List[str] = []
+        for document in documents:
+            digest = document.digest
+            previous = self.db.hget(self.checkpoint_key, document.id)
+            previous_digest, _, previous_count = (previous.decode() if previous else "").partition(":")
+            if previous_digest == digest:
+                self.stats["skipped"] += 1
+                continue
+            chunks = list(chunk_text(document.text, self.chunk_size, self.overlap))
+            self._progress[document.id] = (digest, len(chunks), int(previous_count or 0))
+            if not chunks:
+                completed.append(document.id)
+            for index, chunk in enumerate(chunks):
+                batch.append((document.id, document.source, index, chunk))
+                if index == len(chunks) - 1:
+                    completed.append(document.id)
+                if len(batch) >= self.batch_size:
+                    yield batch, completed
+                    batch, completed = [], []
+        if batch or completed:
+            yield batch, completed
+
+    def _write(self, batch: List[Chunk], vectors: NDArray[Any], completed: List[str]) -> None:
+        if len(vectors) != len(batch) or (len(batch) and vectors.shape[1] != self.schema["dims"]):
+            raise ValueError(f"The embedder returned {vectors.shape}, expected ({len(batch)}, {self.schema['dims']})")
+        pipeline = self.db.pipeline(transaction=False)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        for (doc_id, source, index, text), vector in zip(batch, vectors):
+            data = vector.tobytes()
+            pipeline.hset(
+                self.chunk_key(doc_id, index),
+                mapping={
+                    "doc_id": doc_id,
+                    "source": source,
+                    "chunk_index": index,
+                    "content": text,
+                    self.schema["vector_field"]: data,
+                },
+            )
+            record_payload(len(text) + len(data))
+        for doc_id in completed:
+            digest, total, previous = self._progress.pop(doc_id)
+            stale = [self.chunk_key(doc_id, index) for index in range(total, previous)]
+            if stale:
+                pipeline.delete(*stale)
+            pipeline.hset(self.checkpoint_key, doc_id, f"{digest}:{total}")
+            self.stats["documents"] += 1
+        pipeline.execute()
+        self.stats["chunks"] += len(batch)
+
+    @instrument("rag.ingest")
+    def run(self, documents: Iterable[Document]) -> Dict[str, Any]:
+        """Ingest ``documents``, returning the counts, seconds and throughput."""
+        start = time.perf_counter()
+        executor: Optional[Executor] = ProcessPoolExecutor(self.workers) if self.workers > 0 else None
+        pending: Deque[Tuple[List[Chunk], List[str], "Future[NDArray[Any]]"]] = deque()
+        try:
+            for batch, completed in self._batches(documents):
+                if not batch:
+                    self._write([], np.zeros((0, self.schema["dims"]), dtype=np.float32), completed)
+                    continue
+                texts = [chunk[3] for chunk in batch]
+                if executor is None:
+                    self._write(batch, self.embedder(texts), completed)
+                    continue
+                pending.append((batch, completed, executor.submit(self.embedder, texts)))
+                # Writes keep the submission order, so checkpoints never run ahead of the chunks they cover.
+                while len(pending) >= self.max_pending:
+                    done_batch, done_completed, future = pending.popleft()
+                    self._write(done_batch, future.result(), done_completed)
+            while pending:
+                done_batch, done_completed, future = pending.popleft()
+                self._write(done_batch, future.result(), done_completed)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+        seconds = time.perf_counter() - start
+        return {
+            **self.stats,
+            "seconds": seconds,
+            "documents_per_second": self.stats["documents"] / seconds if seconds else 0.0,
+            "chunks_per_second": self.stats["chunks"] / seconds if seconds else 0.0,
+        }
+
+
+def ingest(sources: Sequence[str], create: bool = True, restart: bool = False, **options: Any) -> Dict[str, Any]:
+    """Ingest the documents of ``sources`` (see ``iter_documents``) into the redisvl document index.
+
+    Args:
+        sources (Sequence[str]): Files, directories, globs or NDJSON files.
+        create (bool): Create the index first if it does not exist (needs redisvl and RediSearch).
+        restart (bool): Ignore the checkpoint of previous runs.
+        **options (Any): ``Ingestion`` arguments.
+
+    Returns:
+        Dict[str, Any]: Documents written and skipped, chunks, seconds and throughput.
+    """
+    ingestion = Ingestion(**options)
+    if create:
+        create_index(options.get("schema", DOCUMENTS_SCHEMA), options.get("db"))
+    if restart:
+        ingestion.reset()
+    report: Dict[str, Any] = ingestion.run(iter_documents(sources))
+    return report
@@ -0,0 +1,108 @@
+import hashlib
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+BLOB_KEY_PREFIX = "svaeva_redux:blob:"
+# Digests written since the last collection started (see ``list_blobs``), outside the blob key space.
+BLOB_WRITES_KEY = "svaeva_redux:blob_writes"
+
+# KEYS[1] is BLOB_WRITES_KEY, KEYS[i + 1] the key of the blob with digest ARGV[i].
+_DELETE_UNWRITTEN_LUA = """
+local deleted = 0
+for i, digest in ipairs(ARGV) do
+    if redis.call('SISMEMBER', KEYS[1], digest) == 0 then
+        deleted = deleted + redis.call('DEL', KEYS[i + 1])
+    end
+end
+return deleted
+"""
+
+
+def blob_digest(data: bytes) -> str:
+    """Return the content address (sha256 hex digest) of a blob."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def blob_key(digest: str) -> str:
+    """Return the Redis key holding the blob with the given digest."""
+    return f"{BLOB_KEY_PREFIX}{digest}"
+
+
+def put_blob(db: Any, data: bytes) -> str:
+    """Store a blob under its content address.
+
+    Identical content maps to the same key, so writing an existing blob is a no-op on the server. The
+    digest is recorded as written first, so a collection running meanwhile keeps the blob (see
+    ``delete_unreferenced_blobs``).
+
+    Args:
+        db (Any): Redis client or pipeline.
+        data (bytes): The blob content.
+
+    Returns:
+        str: The blob digest.
+    """
+    digest = blob_digest(data)
+    db.sadd(BLOB_WRITES_KEY, digest)
+    db.set(blob_key(digest), data, nx=True)
+    return digest
+
+
+def get_blobs(db: Any, digests: List[str]) -> Dict[str, Optional[bytes]]:
+    """Fetch several blobs in a single round trip.
+
+    Args:
+        db (Any): Redis client.
+        digests (List[str]): The blob digests.
+
+    Returns:
+        Dict[str, Optional[bytes]]: Blob content by digest, ``None`` for missing blobs.
+    """
+    if not digests:
+        return {}
+    values = db.mget([blob_key(digest) for digest in digests])
+    return dict(zip(digests, values))
+
+
+def list_blobs(db: Any, batch_size: int = 500) -> List[str]:
+    """Start a collection: forget the blobs written so far and return the digests of every stored blob.
+
+    Args:
+        db (Any): Redis client.
+        batch_size (int): SCAN count hint.
+
+    Returns:
+        List[str]: The stored blob digests.
+    """
+    db.delete(BLOB_WRITES_KEY)
+    digests = []
+    for key in db.scan_iter(match=f"{BLOB_KEY_PREFIX}*", count=batch_size):
+        key = key.decode() if isinstance(key, bytes) else key
+        digests.append(key[len(BLOB_KEY_PREFIX) :])
+    return digests
+
+
+def delete_unreferenced_blobs(
+    db: Any, candidates: Iterable[str], referenced: Iterable[str], batch_size: int = 500
+) -> int:
+    """Delete the blobs of ``candidates`` whose digest is not in ``referenced``.
+
+    Blobs written (or rewritten, for identical content) since ``list_blobs`` are kept: a document saved
+    while the references were read may use them.
+
+    Args:
+        db (Any): Redis client.
+        candidates (Iterable[str]): Digests listed by ``list_blobs`` before ``referenced`` was collected.
+        referenced (Iterable[str]): Digests that are still in use.
+        batch_size (int): Delete batch size.
+
+    Returns:
+        int: The number of deleted blobs.
+    """
+    keep: Set[str] = set(referenced)
+    stale = [digest for digest in candidates if digest not in keep]
+    delete = db.register_script(_DELETE_UNWRITTEN_LUA)
+    deleted = 0
+    for start in range(0, len(stale), batch_size):
+        batch = stale[start : start + batch_size]
+        deleted += delete(keys=[BLOB_WRITES_KEY, *(blob_key(digest) for digest in batch)], args=batch)
+    return deleted
@@ -0,0 +1,98 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Invalidation message dropping every entry instead of a single key.
+INVALIDATE_ALL = "*"
+
+
+class ModelCache:
+    """Read-through in-process cache of model instances, bounded by a TTL and a number of entries.
+
+    Cached instances are shared by every caller and must be treated as read-only. Writers publish the
+    key they changed on ``channel`` (see ``publish_invalidation``), and every process listening on it
+    drops its entry at once; the TTL bounds staleness if an invalidation is lost.
+    """
+
+    def __init__(self, channel: str, ttl: float = 300.0, max_entries: int = 256):
+        self.channel = channel
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, so a load that raced one is returned but not cached.
+        self._generation = 0
+        self._listener: Optional[Any] = None
+
+    def get(self, key: str, load: Callable[[str], Any]) -> Any:
+        """Return the cached instance for ``key``, calling ``load(key)`` on a miss or expired entry."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+        value = load(key)
+        with self._lock:
+            if generation != self._generation:
+                return value
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key: str = INVALIDATE_ALL) -> None:
+        """Drop the entry for ``key``, or every entry for ``INVALIDATE_ALL``."""
+        with self._lock:
+            self._generation += 1
+            if key == INVALIDATE_ALL:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Return the hit and miss counters and the number of cached entries."""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    def publish_invalidation(self, db: Any, key: str = INVALIDATE_ALL) -> None:
+        """Drop ``key`` locally and publish its invalidation to the other processes.
+
+        Args:
+            db (Any): Redis client or pipeline, the message is sent when a pipeline executes.
+            key (str): The changed key.
+        """
+        self.invalidate(key)
+        db.publish(self.channel, key)
+
+    def listen(self, db: Any) -> None:
+        """Subscribe to invalidations in a background thread, unless already subscribed."""
+        with self._lock:
+            if self._listener is not None:
+                return
+            pubsub = db.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.channel: self._on_message})
+            self._listener = pubsub.run_in_thread(sleep_time=1.0, daemon=True, exception_handler=self._on_error)
+
+    def _on_message(self, message: Dict[str, Any]) -> None:
+        key = message["data"]
+        self.invalidate(key.decode() if isinstance(key, bytes) else key)
+
+    def _on_error(self, error: Exception, pubsub: Any, thread: Any) -> None:
+        # Invalidations may have been missed while disconnected: start over and resubscribe on the next get.
+        logger.warning(f"Lost the {self.channel} subscription, clearing the cache: {error}")
+        thread.stop()
+        pubsub.close()
+        with self._lock:
+            self._listener = None
+            self._generation += 1
+            self._entries.clear()
@@ -0,0 +1,154 @@
+import mmap
+import os
+from typing import IO, Any, Dict, Iterable, Iterator, Optional, Union
+
+from svaeva_redux.connection import redis_connection
+
+CHUNK_KEY_PREFIX = "svaeva_redux:chunk:"
+VIDEO_CHUNK_SIZE = int(os.getenv("VIDEO_CHUNK_SIZE", 1024 * 1024))
+
+# Bytes, a path, a binary file object or an iterable of byte strings of any size.
+ChunkSource = Union[bytes, str, IO[bytes], Iterable[bytes]]
+
+
+def chunk_key(ref: str, index: int) -> str:
+    """Return the Redis key holding chunk ``index`` of the stored object ``ref``."""
+    return f"{CHUNK_KEY_PREFIX}{ref}:{index}"
+
+
+def chunk_count(size: int, chunk_size: int) -> int:
+    return -(-size // chunk_size)
+
+
+def iter_chunks(source: ChunkSource, chunk_size: int = VIDEO_CHUNK_SIZE) -> Iterator[bytes]:
+    """Split ``source`` into ``chunk_size`` byte chunks (the last one shorter), reading it incrementally."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        for start in range(0, len(view), chunk_size):
+            yield bytes(view[start : start + chunk_size])
+        return
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            yield from iter_chunks(f, chunk_size)
+        return
+    if hasattr(source, "read"):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    buffer = bytearray()
+    for data in source:
+        buffer += data
+        while len(buffer) >= chunk_size:
+            yield bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def _chunk_range(size: int, chunk_size: int, start: int, stop: Optional[int]) -> range:
+    stop = size if stop is None else min(stop, size)
+    return range(max(start, 0), max(stop, start, 0))
+
+
+class RedisChunkStore:
+    """Chunks stored under separate Redis keys, so no single command moves more than one chunk."""
+
+    name = "redis"
+
+    def __init__(self, db: Any = redis_connection):
+        self.db = db
+
+    def put(self, db: Any, ref: str, index: int, data: bytes, chunk_size: int) -> None:
+        """Write a chunk on ``db``, a client or a (sync or asyncio) pipeline."""
+        db.set(chunk_key(ref, index), data)
+
+    def read(
+        self, ref: str, size: int, chunk_size: int, start: int = 0, stop: Optional[int] = None, db: Any = None
+    ) -> Iterator[bytes]:
+        """Yield the bytes ``[start, stop)`` of the object, at most one chunk at a time, from ``db`` if given."""
+        db = self.db if db is None else db
+        wanted = _chunk_range(size, chunk_size, start, stop)
+        if not wanted:
+            return
+        for index in range(wanted.start // chunk_size, chunk_count(wanted.stop, chunk_size)):
+            offset = index * chunk_size
+            first, last = max(wanted.start, offset) - offset, min(wanted.stop, offset + chunk_size) - offset
+            data = db.getrange(chunk_key(ref, index), first, last - 1)
+            if len(data) != last - first:
+                raise IOError(f"Chunk {index} of {ref} is missing or truncated")
+            yield data
+
+    def remove(self, db: Any, ref: str, size: int, chunk_size: int) -> None:
+        keys = [chunk_key(ref, index) for index in range(chunk_count(size, chunk_size))]
+        if keys:
+            db.delete(*keys)
+
+
+class FileChunkStore:
+    """Objects stored as one local file each, read through a memory map.
+
+    Suits a single host (or a shared volume) serving large videos: ranges are sliced straight out of the
+    page cache and Redis only holds the manifest.
+    """
+
+    name = "file"
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, ref: str) -> str:
+        return os.path.join(self.root, ref)
+
+    def put(self, db: Any, ref: str, index: int, data: bytes, chunk_size: int) -> None:
+        """Write a chunk at its offset in the object's file (``db`` is unused)."""
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(ref)
+        with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+            f.seek(index * chunk_size)
+            f.write(data)
+
+    def read(
+        self, ref: str, size: int, chunk_size: int, start: int = 0, stop: Optional[int] = None, db: Any = None
+    ) -> Iterator[bytes]:
+        """Yield the bytes ``[start, stop)`` of the object, at most ``chunk_size`` at a time (``db`` is unused)."""
+        wanted = _chunk_range(size, chunk_size, start, stop)
+        if not wanted:
+            return
+        with open(self.path(ref), "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if len(mapped) < wanted.stop:
+                raise IOError(f"{self.path(ref)} is truncated")
+            for offset in range(wanted.start, wanted.stop, chunk_size):
+                yield mapped[offset : min(offset + chunk_size, wanted.stop)]
+
+    def remove(self, db: Any, ref: str, size: int, chunk_size: int) -> None:
+        try:
+            os.remove(self.path(ref))
+        except FileNotFoundError:
+            pass
+
+
+ChunkStore = Union[RedisChunkStore, FileChunkStore]
+
+_stores: Dict[str, ChunkStore] = {}
+
+
+def chunk_store(name: Optional[str] = None) -> ChunkStore:
+    """Return the chunk store ``name`` (``redis`` or ``file``), by default ``file`` if VIDEO_STORE_PATH is set.
+
+    The file store keeps its files under VIDEO_STORE_PATH.
+    """
+    if name is None:
+        name = "file" if os.getenv("VIDEO_STORE_PATH") else "redis"
+    if name not in _stores:
+        if name == "redis":
+            _stores[name] = RedisChunkStore()
+        elif name == "file":
+            root = os.getenv("VIDEO_STORE_PATH")
+            if not root:
+                raise ValueError("The file chunk store needs VIDEO_STORE_PATH")
+            _stores[name] = FileChunkStore(root)
+        else:
+            raise ValueError(f"Unknown chunk store {name}, expected redis or file")
+    return _stores[name]
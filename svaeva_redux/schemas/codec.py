@@ -0,0 +1,219 @@
+import base64
+import hashlib
+import os
+import zlib
+from typing import Any, Dict, Iterable, List, Mapping, MutableMapping, Optional, Set, TypeGuard
+
+INTERN_KEY_PREFIX = "svaeva_redux:interned:"
+# Digests interned since the last collection started (see ``list_interned``), outside the interned key space.
+INTERN_WRITES_KEY = "svaeva_redux:interned_writes"
+CODEC_ALGORITHMS = ("raw", "zlib", "zstd")
+
+# Encoded values are "<marker><algorithm>:<base64 data>" or, when interned, "<marker><algorithm>@<digest>".
+# The NUL marker never starts the prompts and other text these fields hold.
+_MARKER = "\x00"
+
+
+def intern_key(digest: str) -> str:
+    """Return the Redis key holding the interned value with the given digest."""
+    return f"{INTERN_KEY_PREFIX}{digest}"
+
+
+# KEYS[1] is INTERN_WRITES_KEY, KEYS[i + 1] the key of the value with digest ARGV[i].
+_DELETE_UNWRITTEN_LUA = """
+local deleted = 0
+for i, digest in ipairs(ARGV) do
+    if redis.call('SISMEMBER', KEYS[1], digest) == 0 then
+        deleted = deleted + redis.call('DEL', KEYS[i + 1])
+    end
+end
+return deleted
+"""
+
+
+def put_interned(db: Any, data: bytes) -> str:
+    """Store an interned value under its content hash and return the digest.
+
+    Writing an existing value is a no-op on the server. The digest is recorded as written first, so a
+    collection running meanwhile keeps the value (see ``delete_unreferenced_interned``).
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    db.sadd(INTERN_WRITES_KEY, digest)
+    db.set(intern_key(digest), data, nx=True)
+    return digest
+
+
+def _compress(algorithm: str, data: bytes, level: Optional[int]) -> bytes:
+    if algorithm == "zlib":
+        return zlib.compress(data, 6 if level is None else level)
+    if algorithm == "zstd":
+        compressed: bytes = _zstd().ZstdCompressor(level=3 if level is None else level).compress(data)
+        return compressed
+    return data
+
+
+def _decompress(algorithm: str, data: bytes) -> bytes:
+    if algorithm == "zlib":
+        return zlib.decompress(data)
+    if algorithm == "zstd":
+        decompressed: bytes = _zstd().ZstdDecompressor().decompress(data)
+        return decompressed
+    return data
+
+
+def _zstd() -> Any:
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Could not import zstandard python package. Please install it with `pip install zstandard`.")
+    return zstandard
+
+
+class FieldCodec:
+    """Compresses, and optionally interns, large string fields of model documents.
+
+    Values shorter than ``threshold`` characters are stored as is. Longer ones are compressed with
+    ``algorithm`` and either inlined as base64 (when that is actually smaller) or, with ``intern``, stored
+    once under their content hash so identical values (the same prompt in several presets) share one copy
+    and the document only keeps a short reference. Encoded fields must not be indexed.
+
+    Decoding does not depend on the codec settings: documents written with any settings, or before the
+    codec existed, always load.
+    """
+
+    def __init__(
+        self, algorithm: Optional[str] = None, threshold: int = 1024, intern: bool = True, level: Optional[int] = None
+    ):
+        if algorithm is not None and algorithm not in CODEC_ALGORITHMS:
+            raise ValueError(f"Unknown codec {algorithm}, expected one of {CODEC_ALGORITHMS}")
+        if algorithm == "zstd":
+            _zstd()
+        self.algorithm = algorithm
+        self.threshold = threshold
+        self.intern = intern
+        self.level = level
+
+    @classmethod
+    def from_env(cls) -> "FieldCodec":
+        """Build the codec from FIELD_CODEC (raw, zlib or zstd, off when unset), FIELD_CODEC_THRESHOLD and
+        FIELD_CODEC_INTERN."""
+        algorithm = os.getenv("FIELD_CODEC", "").lower() or None
+        return cls(
+            algorithm=None if algorithm in (None, "none", "off") else algorithm,
+            threshold=int(os.getenv("FIELD_CODEC_THRESHOLD", 1024)),
+            intern=os.getenv("FIELD_CODEC_INTERN", "1").lower() not in ("0", "false", "no", "off"),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.algorithm is not None
+
+    def encode(self, db: Any, value: Any) -> Any:
+        """Encode a field value, writing interned data on ``db`` (a client or a sync or asyncio pipeline)."""
+        algorithm = self.algorithm
+        if algorithm is None or not isinstance(value, str) or len(value) < self.threshold:
+            return value
+        data = _compress(algorithm, value.encode(), self.level)
+        if self.intern:
+            digest = put_interned(db, data)
+            return f"{_MARKER}{algorithm}@{digest}"
+        encoded = f"{_MARKER}{algorithm}:{base64.b64encode(data).decode('ascii')}"
+        return encoded if len(encoded) < len(value) else value
+
+    def encode_fields(self, db: Any, document: MutableMapping[str, Any], fields: Iterable[str]) -> None:
+        for field in fields:
+            if field in document:
+                document[field] = self.encode(db, document[field])
+
+
+def is_encoded(value: Any) -> TypeGuard[str]:
+    return isinstance(value, str) and value.startswith(_MARKER)
+
+
+def interned_digests(document: Mapping[str, Any], fields: Iterable[str]) -> List[str]:
+    """Return the digests of the interned values referenced by the ``fields`` of ``document``."""
+    digests = []
+    for field in fields:
+        value = document.get(field)
+        if is_encoded(value) and "@" in value:
+            digests.append(value.split("@", 1)[1])
+    return digests
+
+
+def decode_value(value: Any, interned: Mapping[str, Optional[bytes]]) -> Any:
+    """Decode a field value, given the interned data it may reference."""
+    if not is_encoded(value):
+        return value
+    if "@" in value:
+        algorithm, digest = value[1:].split("@", 1)
+        data = interned.get(digest)
+        if data is None:
+            raise KeyError(f"Interned value {digest} is missing")
+    else:
+        algorithm, encoded = value[1:].split(":", 1)
+        data = base64.b64decode(encoded)
+    return _decompress(algorithm, data).decode()
+
+
+def decode_fields(
+    document: MutableMapping[str, Any], fields: Iterable[str], interned: Mapping[str, Optional[bytes]]
+) -> MutableMapping[str, Any]:
+    for field in fields:
+        if field in document:
+            document[field] = decode_value(document[field], interned)
+    return document
+
+
+def get_interned(db: Any, digests: List[str]) -> Dict[str, Optional[bytes]]:
+    """Fetch several interned values in a single round trip."""
+    if not digests:
+        return {}
+    return dict(zip(digests, db.mget([intern_key(digest) for digest in digests])))
+
+
+async def async_get_interned(db: Any, digests: List[str]) -> Dict[str, Optional[bytes]]:
+    """Fetch several interned values in a single round trip on an asyncio client."""
+    if not digests:
+        return {}
+    return dict(zip(digests, await db.mget([intern_key(digest) for digest in digests])))
+
+
+def list_interned(db: Any, batch_size: int = 500) -> List[str]:
+    """Start a collection: forget the values interned so far and return the digests of every stored value."""
+    db.delete(INTERN_WRITES_KEY)
+    digests = []
+    for key in db.scan_iter(match=f"{INTERN_KEY_PREFIX}*", count=batch_size):
+        key = key.decode() if isinstance(key, bytes) else key
+        digests.append(key[len(INTERN_KEY_PREFIX) :])
+    return digests
+
+
+def delete_unreferenced_interned(
+    db: Any, candidates: Iterable[str], referenced: Iterable[str], batch_size: int = 500
+) -> int:
+    """Delete the interned values of ``candidates`` whose digest is not in ``referenced``.
+
+    Values interned (or interned again, for identical content) since ``list_interned`` are kept: a document
+    saved while the references were read may use them.
+
+    Args:
+        db (Any): Redis client.
+        candidates (Iterable[str]): Digests listed (see ``list_interned``) before ``referenced`` was collected,
+            so values interned by saves running meanwhile are not candidates.
+        referenced (Iterable[str]): Digests that are still in use.
+        batch_size (int): Delete batch size.
+
+    Returns:
+        int: The number of deleted values.
+    """
+    keep: Set[str] = set(referenced)
+    stale = [digest for digest in candidates if digest not in keep]
+    delete = db.register_script(_DELETE_UNWRITTEN_LUA)
+    deleted = 0
+    for start in range(0, len(stale), batch_size):
+        batch = stale[start : start + batch_size]
+        deleted += delete(keys=[INTERN_WRITES_KEY, *(intern_key(digest) for digest in batch)], args=batch)
+    return deleted
+
+
+field_codec = FieldCodec.from_env()
@@ -0,0 +1,108 @@
+import atexit
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from svaeva_redux.connection import use_shard
+from svaeva_redux.metrics import instrument, record_error
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindCounter:
+    """Aggregate increments of a numeric JSON field in memory and apply them to Redis in batches.
+
+    Every ``flush_interval`` seconds, and at exit, a background thread sends one ``JSON.NUMINCRBY`` per
+    document that was incremented since the last flush (and sets ``timestamp_path`` to the time of its latest
+    increment), all in a single pipeline. Increments of a busy document are thus merged, and never rewrite
+    the rest of it. Increments still pending are lost if the process is killed.
+    """
+
+    def __init__(self, db: Any, path: str, timestamp_path: Optional[str] = None, flush_interval: float = 0.0):
+        self.db = db
+        self.path = path
+        self.timestamp_path = timestamp_path
+        self.flush_interval = flush_interval
+        # Key: (increment, latest timestamp, shard of the document).
+        self._pending: Dict[str, Tuple[int, float, Optional[str]]] = {}
+        self._lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.flush_interval > 0
+
+    def add(self, key: str, amount: int = 1, timestamp: Optional[float] = None, shard: Optional[str] = None) -> None:
+        """Queue an increment of the document at ``key``, stored on ``shard`` (see ``svaeva_redux.shards``)."""
+        with self._lock:
+            pending = self._pending.get(key, (0, 0.0, None))[0]
+            self._pending[key] = (pending + amount, time.time() if timestamp is None else timestamp, shard)
+        if self._flusher is None and self.enabled:
+            self.start()
+
+    def pending(self, key: str) -> int:
+        """Return the increment of ``key`` not flushed yet."""
+        return self._pending.get(key, (0, 0.0, None))[0]
+
+    @instrument("write_behind_counter.flush")
+    def flush(self) -> int:
+        """Apply the pending increments, returning the number of documents updated.
+
+        Increments of documents deleted in the meantime are dropped. If Redis cannot be reached the
+        increments are queued again for the next flush.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        by_shard: Dict[Optional[str], Dict[str, Tuple[int, float, Optional[str]]]] = {}
+        for key, increment in pending.items():
+            by_shard.setdefault(increment[2], {})[key] = increment
+        missing: List[str] = []
+        error: Optional[Exception] = None
+        for shard, increments in by_shard.items():
+            try:
+                with use_shard(shard):
+                    missing += self._flush(increments)
+            except Exception as e:  # Queued again, the other shards are still flushed.
+                error = e
+        if error is not None:
+            raise error
+        if missing:
+            record_error()
+            logger.warning(f"Dropped the {self.path} increments of {len(missing)} missing documents: {missing[:10]}")
+        return len(pending) - len(missing)
+
+    def _flush(self, pending: Dict[str, Tuple[int, float, Optional[str]]]) -> List[str]:
+        """Apply the increments of one shard in a pipeline, returning the keys of the missing documents."""
+        pipeline = self.db.pipeline(transaction=False)
+        for key, (amount, timestamp, _) in pending.items():
+            pipeline.json().numincrby(key, self.path, amount)
+            if self.timestamp_path is not None:
+                pipeline.json().set(key, self.timestamp_path, timestamp)
+        try:
+            results = pipeline.execute(raise_on_error=False)
+        except Exception:
+            with self._lock:
+                for key, (amount, timestamp, shard) in pending.items():
+                    queued, latest, _ = self._pending.get(key, (0, 0.0, shard))
+                    self._pending[key] = (queued + amount, max(timestamp, latest), shard)
+            raise
+        commands = 1 if self.timestamp_path is None else 2
+        return [key for key, result in zip(pending, results[::commands]) if isinstance(result, Exception)]
+
+    def start(self) -> None:
+        """Start the background flusher, unless already started."""
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_forever, daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+
+    def _flush_forever(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:  # Redis may be briefly unavailable, the increments are retried.
+                logger.warning(f"Could not flush the {self.path} increments: {e}")
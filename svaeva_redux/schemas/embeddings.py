@@ -0,0 +1,109 @@
+from typing import Any, Dict, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from numpy.typing import NDArray
+
+EMBEDDING_KEY_PREFIX = "svaeva_redux:embedding:"
+EMBEDDING_DTYPE = np.dtype("<f4")
+
+# Updates the search tags of an existing embedding, without creating one for users that have none.
+_RETAG_EMBEDDING_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HSET', KEYS[1], 'group_id', ARGV[1], 'platform_id', ARGV[2])
+end
+"""
+
+
+def embedding_key(user_id: str) -> str:
+    """Return the Redis key holding the conversation embedding of a user."""
+    return f"{EMBEDDING_KEY_PREFIX}{user_id}"
+
+
+def encode_embedding(embedding: Union[NDArray[Any], Sequence[float]]) -> bytes:
+    """Pack an embedding as little-endian float32 bytes."""
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def decode_embedding(data: bytes) -> NDArray[Any]:
+    """Unpack float32 bytes into a read-only, zero-copy ``np.ndarray`` view."""
+    return np.frombuffer(data, dtype=EMBEDDING_DTYPE)
+
+
+def write_embedding(
+    db: Any,
+    user_id: str,
+    embedding: Union[NDArray[Any], Sequence[float]],
+    group_id: Optional[str] = None,
+    platform_id: Optional[str] = None,
+) -> None:
+    """Store an embedding (and the tags used to pre-filter similarity search) in the user's hash.
+
+    Args:
+        db (Any): Redis client or pipeline.
+        user_id (str): The user ID.
+        embedding (Union[np.ndarray, Sequence[float]]): The embedding.
+        group_id (Optional[str]): The user's group.
+        platform_id (Optional[str]): The user's platform.
+    """
+    mapping: Dict[str, Union[bytes, str]] = {"vector": encode_embedding(embedding)}
+    if group_id is not None:
+        mapping["group_id"] = group_id
+    if platform_id is not None:
+        mapping["platform_id"] = platform_id
+    db.hset(embedding_key(user_id), mapping=mapping)
+
+
+def retag_embedding(db: Any, user_id: str, group_id: str, platform_id: str) -> None:
+    """Update the search tags of a user's embedding, if the user has one."""
+    db.eval(_RETAG_EMBEDDING_LUA, 1, embedding_key(user_id), group_id, platform_id)
+
+
+def read_embedding(db: Any, user_id: str) -> Optional[NDArray[Any]]:
+    """Load a user's embedding, or ``None`` if the user has none."""
+    data = db.hget(embedding_key(user_id), "vector")
+    return None if data is None else decode_embedding(data)
+
+
+def read_embedding_state(db: Any, user_id: str) -> Tuple[Optional[NDArray[Any]], float, Optional[int]]:
+    """Load a user's embedding with the weight and watermark of its incremental aggregate.
+
+    Returns:
+        Tuple[Optional[np.ndarray], float, Optional[int]]: The embedding (``None`` if the user has none), the
+        weight of the messages folded into it, and the number of history messages processed (``None`` if the
+        embedding was not built incrementally).
+    """
+    vector, weight, watermark = db.hmget(embedding_key(user_id), ["vector", "weight", "watermark"])
+    if vector is None or watermark is None:
+        return None, 0.0, None
+    return decode_embedding(vector), float(weight or 0), int(watermark)
+
+
+def fold_embeddings(
+    mean: Optional[NDArray[Any]], weight: float, vectors: NDArray[Any], decay: float = 1.0
+) -> Tuple[NDArray[Any], float]:
+    """Fold new vectors, oldest first, into a running weighted mean.
+
+    With ``decay`` 1 the mean weighs every vector equally, as if it had been computed over the whole history;
+    below 1 each vector's weight is multiplied by ``decay`` whenever a newer one is folded, so the mean follows
+    the recent messages. The cost only depends on the number of new vectors.
+
+    Args:
+        mean (Optional[np.ndarray]): The current mean, ``None`` for none.
+        weight (float): The total weight of the vectors in ``mean``.
+        vectors (np.ndarray): The new vectors, one per row, oldest first.
+        decay (float): Weight kept by older vectors for each newer one, in ``(0, 1]``.
+
+    Returns:
+        Tuple[np.ndarray, float]: The new mean and its total weight.
+    """
+    if not 0 < decay <= 1:
+        raise ValueError(f"decay must be in (0, 1], not {decay}")
+    vectors = np.asarray(vectors, dtype=np.float64)
+    weights = decay ** np.arange(len(vectors) - 1, -1, -1, dtype=np.float64)
+    total = vectors.T @ weights
+    new_weight = float(weights.sum())
+    if mean is not None and weight > 0:
+        kept = weight * decay ** len(vectors)
+        total = total + kept * np.asarray(mean, dtype=np.float64)
+        new_weight += kept
+    return (total / new_weight).astype(EMBEDDING_DTYPE), new_weight
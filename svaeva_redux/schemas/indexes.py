@@ -0,0 +1,177 @@
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Mapping, Optional, Tuple, Union
+
+from redis.exceptions import ResponseError
+from redis_om.model.model import NUMERIC_TYPES, model_registry
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("TAG", "NUMERIC", "TEXT")
+
+# Model name: {field name: index type}. Models left out keep the indexes declared on their fields, and
+# primary keys are always indexed.
+IndexProfile = Mapping[str, Mapping[str, str]]
+
+_LOOKUP_USERS = {"group_id": "TAG", "platform_id": "TAG"}
+
+INDEX_PROFILES: Dict[str, Optional[IndexProfile]] = {
+    # The indexes declared on the model fields.
+    "full": None,
+    # Lookups by id, group and platform only: writes re-index two fields instead of a dozen.
+    "lookup": {
+        "ConversationModel": {},
+        "UserModel": _LOOKUP_USERS,
+        "UserImageModel": _LOOKUP_USERS,
+        "UserVideoModel": _LOOKUP_USERS,
+    },
+    # Lookups plus the fields used to moderate and browse users.
+    "moderation": {
+        "ConversationModel": {"engine": "TAG", "engine_type": "TAG", "author": "TAG"},
+        "UserModel": {
+            **_LOOKUP_USERS,
+            "flagged": "NUMERIC",
+            "interaction_count": "NUMERIC",
+            "username": "TAG",
+            "email": "TAG",
+            "description": "TEXT",
+            "date_created_timestamp": "NUMERIC",
+        },
+        "UserImageModel": _LOOKUP_USERS,
+        "UserVideoModel": _LOOKUP_USERS,
+    },
+}
+
+# Model name: {field name: (index, full_text_search)} as declared, to switch back from another profile.
+_declared: Dict[str, Dict[str, Tuple[Any, Any]]] = {}
+
+
+def load_index_profile(profile: Union[str, IndexProfile, None]) -> Optional[IndexProfile]:
+    """Resolve a profile given by name (see ``INDEX_PROFILES``), JSON or YAML file path, or mapping."""
+    if profile is None or isinstance(profile, Mapping):
+        return profile
+    if profile in INDEX_PROFILES:
+        return INDEX_PROFILES[profile]
+    if not os.path.isfile(profile):
+        raise ValueError(f"Unknown index profile {profile}, expected a file or one of {list(INDEX_PROFILES)}")
+    with open(profile) as f:
+        if profile.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("Could not import yaml python package. Please install it with `pip install pyyaml`.")
+            loaded: IndexProfile = yaml.safe_load(f)
+        else:
+            loaded = json.load(f)
+    return loaded
+
+
+def apply_index_profile(profile: Union[str, IndexProfile, None]) -> None:
+    """Choose which model fields are indexed, and how, before the indexes are created or queried.
+
+    A ``TEXT`` string field is indexed for full-text search (``Field.like``) on top of exact matches.
+    Changing the profile changes ``schema_hash``, so the next ``initialize_redis`` rebuilds the indexes.
+
+    Args:
+        profile (Union[str, IndexProfile, None]): Name in ``INDEX_PROFILES``, path of a JSON or YAML
+            file mapping model names to ``{field: index type}``, or such a mapping.
+
+    Examples:
+        .. code:: python
+
+            >>> profile = {"UserModel": {"group_id": "TAG", "platform_id": "TAG", "age": "NUMERIC"}}
+            >>> apply_index_profile(profile)  # doctest: +SKIP
+    """
+    profile = load_index_profile(profile) or {}
+    models = {cls.__name__: cls for cls in model_registry.values()}
+    unknown = set(profile) - set(models)
+    if unknown:
+        raise ValueError(f"Unknown models {sorted(unknown)} in index profile")
+    for name, cls in models.items():
+        # Fields declared without redis_om's Field (plain defaults) can never be indexed.
+        indexable = {
+            field_name: field for field_name, field in cls.__fields__.items() if hasattr(field.field_info, "index")
+        }
+        declared = _declared.setdefault(
+            name,
+            {
+                field_name: (field.field_info.index, field.field_info.full_text_search)
+                for field_name, field in indexable.items()
+            },
+        )
+        fields = profile.get(name)
+        if fields is None:
+            for field_name, field in indexable.items():
+                field.field_info.index, field.field_info.full_text_search = declared[field_name]
+            continue
+        unknown = set(fields) - set(indexable)
+        if unknown:
+            raise ValueError(f"Unknown or unindexable {name} fields {sorted(unknown)} in index profile")
+        for field_name, field in indexable.items():
+            index_type = fields.get(field_name)
+            if index_type is not None:
+                _check_index_type(name, field_name, field.outer_type_, index_type.upper())
+                if field_name in getattr(cls, "codec_fields", ()):
+                    raise ValueError(f"{name}.{field_name} is encoded by the field codec and cannot be indexed")
+            if field.field_info.primary_key is True:
+                continue
+            field.field_info.index = index_type is not None
+            field.field_info.full_text_search = index_type is not None and index_type.upper() == "TEXT"
+
+
+def _check_index_type(model: str, field: str, typ: Any, index_type: str) -> None:
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type} of {model}.{field}, expected one of {INDEX_TYPES}")
+    # redis_om derives NUMERIC from the field type, only strings can choose between TAG and TEXT.
+    numeric = isinstance(typ, type) and issubclass(typ, NUMERIC_TYPES)
+    if numeric != (index_type == "NUMERIC") or (index_type == "TEXT" and typ is not str):
+        raise ValueError(f"{model}.{field} ({getattr(typ, '__name__', typ)}) cannot be indexed as {index_type}")
+
+
+def index_memory(db: Any) -> Dict[str, Optional[float]]:
+    """Return the memory (MB) of every search index, None for the ones that do not exist.
+
+    Args:
+        db (Any): Redis client.
+    """
+    from svaeva_redux.schemas.search import EMBEDDING_INDEX_NAME
+
+    names = [cls._meta.index_name for cls in model_registry.values()] + [EMBEDDING_INDEX_NAME]
+    memory: Dict[str, Optional[float]] = {}
+    for name in names:
+        info = _index_info(db, name)
+        if info is None:
+            memory[name] = None
+        elif "total_index_memory_sz_mb" in info:
+            memory[name] = float(info["total_index_memory_sz_mb"])
+        else:
+            memory[name] = sum(float(value) for key, value in info.items() if key.endswith(("_sz_mb", "_size_mb")))
+    return memory
+
+
+def wait_for_indexing(db: Any, timeout: float = 60.0) -> bool:
+    """Wait until the search indexes finished indexing the existing documents, returning False on timeout."""
+    deadline = time.monotonic() + timeout
+    for cls in model_registry.values():
+        while True:
+            info = _index_info(db, cls._meta.index_name)
+            if info is None or str(info.get("indexing", 0)) in ("0", "0.0"):
+                break
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.1)
+    return True
+
+
+def _index_info(db: Any, name: str) -> Optional[Dict[str, Any]]:
+    try:
+        info = db.ft(name).info()
+    except ResponseError:  # Missing index, or no search module.
+        return None
+    return {_decode(key): _decode(value) for key, value in info.items()}
+
+
+def _decode(value: Any) -> Any:
+    return value.decode() if isinstance(value, bytes) else value
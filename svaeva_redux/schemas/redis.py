@@ -1,28 +1,346 @@
+import abc
+import asyncio
+import hashlib
+import json
 import os
 import uuid
+from contextvars import ContextVar
 from datetime import datetime
-from typing import List, Optional
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    ClassVar,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
-import dotenv
+import numpy as np
 import redis
+import redis.asyncio
+from numpy.typing import NDArray
+from redis.commands.json.path import Path
 from redis_om import (
     Field,
     JsonModel,
 )
+from redis_om.model.model import FindQuery, NotFoundError
+
+from svaeva_redux.connection import async_redis_connection, current_shard, load_env, redis_connection, use_shard
+from svaeva_redux.metrics import record_payload, timed
+from svaeva_redux.schemas.blobs import blob_digest, blob_key, get_blobs, put_blob
+from svaeva_redux.schemas.cache import ModelCache
+from svaeva_redux.schemas.chunks import (
+    VIDEO_CHUNK_SIZE,
+    ChunkSource,
+    RedisChunkStore,
+    chunk_count,
+    chunk_key,
+    chunk_store,
+    iter_chunks,
+)
+from svaeva_redux.schemas.codec import (
+    async_get_interned,
+    decode_fields,
+    field_codec,
+    get_interned,
+    interned_digests,
+)
+from svaeva_redux.schemas.counters import WriteBehindCounter
+from svaeva_redux.schemas.embeddings import (
+    EMBEDDING_DTYPE,
+    decode_embedding,
+    embedding_key,
+    read_embedding,
+    retag_embedding,
+    write_embedding,
+)
+from svaeva_redux.schemas.indexes import apply_index_profile
+from svaeva_redux.shards import move_keys, shard_router
 
-dotenv.load_dotenv(override=True)
-redis_connection = redis.Redis(
-    host=os.getenv("REDIS_HOST"),
-    port=int(os.getenv("REDIS_PORT")),
-    db=int(os.getenv("REDIS_DB_INDEX")),
+try:
+    from pydantic.v1 import PrivateAttr
+except ImportError:
+    from pydantic import PrivateAttr
+
+load_env()
+conversation_cache = ModelCache(
+    channel="svaeva_redux:invalidate:conversation",
+    ttl=float(os.getenv("CONVERSATION_CACHE_TTL", 300)),
+    max_entries=int(os.getenv("CONVERSATION_CACHE_SIZE", 256)),
+)
+
+# Set INTERACTION_COUNT_FLUSH_INTERVAL (seconds) to aggregate UserModel.increment_interaction_count in memory.
+interaction_counter = WriteBehindCounter(
+    redis_connection,
+    ".interaction_count",
+    ".date_accessed_timestamp",
+    flush_interval=float(os.getenv("INTERACTION_COUNT_FLUSH_INTERVAL", 0)),
 )
 
+_executing_query: ContextVar[bool] = ContextVar("svaeva_redux_executing_query", default=False)
+
+
+class TimedFindQuery(FindQuery):
+    """FindQuery timing each query as ``<Model>.find``, including the pages fetched to exhaust the results."""
+
+    def copy(self, **kwargs: Any) -> "TimedFindQuery":
+        original = self.dict()
+        original.update(**kwargs)
+        return TimedFindQuery(**original)
+
+    def execute(self, exhaust_results=True, return_raw_result=False):
+        if _executing_query.get():
+            return super().execute(exhaust_results, return_raw_result)
+        token = _executing_query.set(True)
+        try:
+            with timed(f"{self.model.__name__}.find"), self.model._on_model_shard():
+                return super().execute(exhaust_results, return_raw_result)
+        finally:
+            _executing_query.reset(token)
+
+
+class AsyncJsonModel(JsonModel, abc.ABC):
+    """JsonModel that can also be read and written without blocking on ``Meta.async_database``."""
+
+    # Non-indexed string fields stored through ``field_codec`` (compressed and interned once large enough).
+    codec_fields: ClassVar[Tuple[str, ...]] = ()
+    # Field whose value selects the shard of a document when REDIS_SHARDS is set (see ``svaeva_redux.shards``).
+    # Documents of models without one stay on the configured server.
+    shard_field: ClassVar[Optional[str]] = None
+
+    @classmethod
+    def async_db(cls) -> "redis.asyncio.Redis[Any]":
+        database: "redis.asyncio.Redis[Any]" = cls._meta.async_database
+        return database
+
+    @property
+    def shard(self) -> Optional[str]:
+        """The shard this document belongs to, None when sharding is off or the model is unsharded."""
+        return None if self.shard_field is None else shard_router.shard_for(getattr(self, self.shard_field))
+
+    def shard_db(self) -> Any:
+        """The client of this document's shard, ``db()`` when sharding is off or the model is unsharded."""
+        return self.db() if self.shard is None else self._meta.database.shard(self.shard)
+
+    def _on_shard(self) -> ContextManager[None]:
+        """Send the commands of the block to this document's shard."""
+        return use_shard(self.shard)
+
+    @classmethod
+    def _on_model_shard(cls) -> ContextManager[None]:
+        """Keep the shard selected by the caller for sharded models, use the configured server otherwise."""
+        return use_shard(current_shard() if cls.shard_field is not None else None)
+
+    @classmethod
+    def locate(cls, pk: Any) -> Optional[str]:
+        """Return the shard holding document ``pk``: the one selected by the caller (``shard_router.route``),
+        or else the one found by asking every shard. None when sharding is off or the model is unsharded."""
+        if cls.shard_field is None or not shard_router.enabled:
+            return None
+        return current_shard() or shard_router.locate(cls.make_key(pk))
+
+    @classmethod
+    async def async_locate(cls, pk: Any) -> Optional[str]:
+        if cls.shard_field is None or not shard_router.enabled:
+            return None
+        return current_shard() or await shard_router.async_locate(cls.make_key(pk))
+
+    @classmethod
+    def shard_keys(cls, db: Any, pk: Any) -> Tuple[List[str], List[str]]:
+        """Return the keys of document ``pk`` on ``db`` that belong to its shard: those that move with it,
+        and shared ones that are copied (e.g. content-addressed blobs)."""
+        return [cls.make_key(pk)], []
+
+    @classmethod
+    def move_to_shard(cls, pk: Any, source: str, target: str) -> int:
+        """Move document ``pk``, and whatever is stored alongside it, from shard ``source`` to ``target``."""
+        database = cls._meta.database
+        moved, copied = cls.shard_keys(database.shard(source), pk)
+        count: int = move_keys(database.shard(source), database.shard(target), moved, copied)
+        return count
+
+    def _prepare_save(self) -> None:
+        """Fill in generated fields before the document is written."""
+
+    def save(self, pipeline: Optional["redis.client.Pipeline[Any]"] = None) -> None:
+        with timed(f"{type(self).__name__}.save"), self._on_shard():
+            self._save(pipeline)
+
+    async def async_save(self, pipeline: Optional["redis.asyncio.client.Pipeline[Any]"] = None) -> None:
+        with timed(f"{type(self).__name__}.async_save"), self._on_shard():
+            await self._async_save(pipeline)
+
+    def _serialize(self, db: Any) -> Any:
+        self._prepare_save()
+        self.check()
+        document = self.json()
+        record_payload(len(document))
+        document = json.loads(document)
+        field_codec.encode_fields(db, document, self.codec_fields)
+        return document
+
+    def _save(self, pipeline: Optional["redis.client.Pipeline[Any]"]) -> None:
+        """Write the document, and whatever is stored alongside it, on ``pipeline`` or the database."""
+        db = self._get_db(pipeline)
+        db.json().set(self.key(), Path.root_path(), self._serialize(db))
+
+    async def _async_save(self, pipeline: Optional["redis.asyncio.client.Pipeline[Any]"]) -> None:
+        db = self.async_db() if pipeline is None else pipeline
+        await db.json().set(self.key(), Path.root_path(), self._serialize(db))
+
+    @classmethod
+    def get(cls, pk: Any) -> "AsyncJsonModel":
+        with timed(f"{cls.__name__}.get"), use_shard(cls.locate(pk)):
+            document = cls.db().json().get(cls.make_key(pk))
+            if document is None:
+                raise NotFoundError
+            interned = get_interned(cls.db(), interned_digests(document, cls.codec_fields))
+        model: AsyncJsonModel = cls.parse_obj(decode_fields(document, cls.codec_fields, interned))
+        return model
+
+    @classmethod
+    async def async_get(cls, pk: str) -> "AsyncJsonModel":
+        with timed(f"{cls.__name__}.async_get"), use_shard(await cls.async_locate(pk)):
+            document = await cls.async_db().json().get(cls.make_key(pk))
+            if document is None:
+                raise NotFoundError
+            interned = await async_get_interned(cls.async_db(), interned_digests(document, cls.codec_fields))
+        model: AsyncJsonModel = cls.parse_obj(decode_fields(document, cls.codec_fields, interned))
+        return model
+
+    @classmethod
+    def delete(cls, pk: Any, pipeline: Optional["redis.client.Pipeline[Any]"] = None) -> int:
+        with use_shard(cls.locate(pk) if pipeline is None else current_shard()):
+            deleted: int = super().delete(pk, pipeline=pipeline)
+        return deleted
+
+    @classmethod
+    def from_redis(cls, res: Any) -> List["AsyncJsonModel"]:
+        models: List[AsyncJsonModel] = super().from_redis(res)
+        if cls.codec_fields:
+            documents = [model.dict() for model in models]
+            digests = [digest for document in documents for digest in interned_digests(document, cls.codec_fields)]
+            interned = get_interned(cls.db(), digests)
+            models = [cls.parse_obj(decode_fields(document, cls.codec_fields, interned)) for document in documents]
+        return models
+
+    @classmethod
+    def find(cls, *expressions: Any, knn: Optional[Any] = None) -> "TimedFindQuery":
+        return TimedFindQuery(expressions=expressions, knn=knn, model=cls)
+
+
+class TrackedJsonModel(AsyncJsonModel, abc.ABC):
+    """AsyncJsonModel with id generation and created/updated/accessed timestamps.
+
+    Writes are tracked with dirty flags rather than per-attribute timestamps:
+    ``date_accessed_timestamp`` is stamped once when the document is loaded or saved, and
+    ``date_updated_timestamp`` once per save that follows a field assignment.
+    """
+
+    if TYPE_CHECKING:
+        id: Optional[str]
+        date_created_timestamp: Optional[float]
+        date_updated_timestamp: Optional[float]
+        date_accessed_timestamp: Optional[float]
+
+    _dirty: Set[str] = PrivateAttr(default_factory=set)
+
+    def __init__(self, **data: Any) -> None:
+        # Per-access datetimes leaked into documents written by earlier versions.
+        data.pop("date_accessed", None)
+        data.pop("date_updated", None)
+        super().__init__(**data)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        object.__setattr__(self, name, value)
+        if not name.startswith("_"):
+            self._dirty.add(name)
+
+    @property
+    def dirty_fields(self) -> Set[str]:
+        """Names of the attributes assigned since the model was loaded or last saved."""
+        return set(self._dirty)
+
+    def _touch(self) -> None:
+        object.__setattr__(self, "date_accessed_timestamp", datetime.now().timestamp())
+
+    def _prepare_save(self) -> None:
+        now = datetime.now().timestamp()
+        if self.id is None:
+            self.id = str(uuid.uuid4())
+        if self.date_created_timestamp is None:
+            self.date_created_timestamp = now
+        if self._dirty or self.date_updated_timestamp is None:
+            self.date_updated_timestamp = now
+        self.date_accessed_timestamp = now
+
+    def save(self, pipeline: Optional["redis.client.Pipeline[Any]"] = None) -> None:
+        if pipeline is None:
+            self._follow_shard()
+        super().save(pipeline)
+
+    async def async_save(self, pipeline: Optional["redis.asyncio.client.Pipeline[Any]"] = None) -> None:
+        if pipeline is None:
+            await asyncio.to_thread(self._follow_shard)
+        await super().async_save(pipeline)
+
+    def _follow_shard(self) -> None:
+        """Move the stored document to its new shard when its ``shard_field`` changed, before saving it there."""
+        if self.shard_field not in self._dirty or self.shard is None or self.id is None:
+            return
+        source = shard_router.locate(self.key())
+        if source is not None and source != self.shard:
+            type(self).move_to_shard(self.id, source, self.shard)
+
+    def _save(self, pipeline: Optional["redis.client.Pipeline[Any]"]) -> None:
+        super()._save(pipeline)
+        self._dirty.clear()
+
+    async def _async_save(self, pipeline: Optional["redis.asyncio.client.Pipeline[Any]"]) -> None:
+        await super()._async_save(pipeline)
+        self._dirty.clear()
+
+    @classmethod
+    def get(cls, pk: str) -> "TrackedJsonModel":
+        model = super().get(pk)
+        model._touch()
+        return model
+
+    @classmethod
+    async def async_get(cls, pk: str) -> "TrackedJsonModel":
+        model = await super().async_get(pk)
+        model._touch()
+        return model
+
+    def __str__(self):
+        attributes = []
+        for attribute, value in vars(self).items():
+            attributes.append(f"{attribute}: {value}")
+        return "\n".join(attributes)
+
+    def __eq__(self, other: object) -> bool:
+        for attribute, value in vars(self).items():
+            if attribute == "password" or attribute == "date_accessed_timestamp":
+                continue
+            if value != getattr(other, attribute):
+                return False
+        return True
+
+
+class ConversationModel(AsyncJsonModel):
+    codec_fields = ("lm_system_prompt", "vlm_system_prompt")
 
-class ConversationModel(JsonModel):
     name: str = Field(index=True, primary_key=True)
     chain_type: str = Field("chain_with_history", index=True)
-    lm_system_prompt: str = Field("", index=True)
-    vlm_system_prompt: str = Field("", index=True)
+    lm_system_prompt: str = Field("", index=False)
+    vlm_system_prompt: str = Field("", index=False)
     chat_history_length: int = Field(10)
     engine: str = Field(index=True)
     engine_type: str = Field(index=True)
@@ -36,15 +354,44 @@ class ConversationModel(JsonModel):
     api_key: Optional[str] = None
     date_created_timestamp: Optional[float] = Field(index=True)
 
-    def save(self) -> None:
+    def _prepare_save(self) -> None:
         self.date_created_timestamp = datetime.now().timestamp()
-        super().save()
+
+    def _save(self, pipeline: Optional["redis.client.Pipeline[Any]"]) -> None:
+        super()._save(pipeline)
+        conversation_cache.publish_invalidation(self.db() if pipeline is None else pipeline, self.name)
+
+    async def _async_save(self, pipeline: Optional["redis.asyncio.client.Pipeline[Any]"]) -> None:
+        await super()._async_save(pipeline)
+        conversation_cache.invalidate(self.name)
+        await (self.async_db() if pipeline is None else pipeline).publish(conversation_cache.channel, self.name)
+
+    @classmethod
+    def delete(cls, pk: Any, pipeline: Optional["redis.client.Pipeline[Any]"] = None) -> int:
+        with cls._on_model_shard():
+            deleted = super().delete(pk, pipeline=pipeline)
+            conversation_cache.publish_invalidation(cls.db() if pipeline is None else pipeline, pk)
+        return deleted
+
+    @classmethod
+    def get_cached(cls, name: str) -> "ConversationModel":
+        """Resolve a conversation by name through the in-process ``conversation_cache``.
+
+        The first call subscribes this process to the invalidations published by ``save`` and ``delete``.
+        The returned instance is shared and must not be modified.
+        """
+        conversation_cache.listen(cls.db())
+        conversation: ConversationModel = conversation_cache.get(name, cls.get)
+        return conversation
 
     class Meta:
         database = redis_connection
+        async_database = async_redis_connection
+
 
+class UserModel(TrackedJsonModel):
+    shard_field = "group_id"
 
-class UserModel(JsonModel):
     version: str = "1.0"
     commit: str = "commit"
     id: Optional[str] = Field(index=True, primary_key=True)
@@ -72,156 +419,387 @@ class UserModel(JsonModel):
     )
     language_code: Optional[str] = Field(index=True, description="ISO 3166-1 alpha-2 country code")
     english_proficiency: Optional[str] = Field(regex="^(A1|A2|B1|B2|C1|C2)$", description="CEFR level")
-    conversation_embedding: Optional[List[float]] = Field([], index=False, description="Conversation Embedding")
     date_created_timestamp: Optional[float] = Field(index=True)
     date_updated_timestamp: Optional[float] = Field(index=True)
     date_accessed_timestamp: Optional[float] = Field(index=True)
+    _embedding: Optional[NDArray[Any]] = PrivateAttr(None)
+    _embedding_loaded: bool = PrivateAttr(False)
+    _embedding_pending: bool = PrivateAttr(False)
 
-    def save(self) -> None:
-        now = datetime.now()
+    def __init__(self, **data: Any) -> None:
+        # The conversation embedding is stored as packed float32 in a side hash (see schemas.embeddings).
+        # Lists passed in, or found in documents written before the codec existed, are moved there on save.
+        embedding = data.pop("conversation_embedding", None)
+        super().__init__(**data)
+        if embedding is not None and len(embedding):
+            self.conversation_embedding_array = embedding
+            self._dirty.clear()
+
+    @property
+    def conversation_embedding_array(self) -> Optional[NDArray[Any]]:
+        """Conversation Embedding as a read-only float32 array, loaded on first read."""
+        if not self._embedding_loaded:
+            self._embedding = None if self.id is None else read_embedding(self.shard_db(), self.id)
+            self._embedding_loaded = True
+        return self._embedding
+
+    @conversation_embedding_array.setter
+    def conversation_embedding_array(self, value: Union[NDArray[Any], Sequence[float], None]) -> None:
+        has_value = value is not None and len(value) > 0
+        self._embedding = np.asarray(value, dtype=EMBEDDING_DTYPE) if has_value else None
+        self._embedding_loaded = True
+        self._embedding_pending = True
+
+    @property
+    def conversation_embedding(self) -> List[float]:
+        """Conversation Embedding as a list of floats."""
+        embedding = self.conversation_embedding_array
+        return [] if embedding is None else embedding.tolist()
+
+    @conversation_embedding.setter
+    def conversation_embedding(self, value: Optional[List[float]]) -> None:
+        self.conversation_embedding_array = value
+
+    async def async_load_embedding(self) -> None:
+        """Fetch the conversation embedding on the asyncio connection, so later reads do not block."""
+        if not self._embedding_loaded and self.id is not None:
+            with self._on_shard():
+                data = await self.async_db().hget(embedding_key(self.id), "vector")
+            self._embedding = None if data is None else decode_embedding(data)
+            self._embedding_loaded = True
+
+    def _write_embedding(self, db: Any, retag: bool) -> None:
         if self.id is None:
-            self.id = str(uuid.uuid4())
-        if self.date_created_timestamp is None:
-            self.date_created_timestamp = now.timestamp()
-        if self.date_updated_timestamp is None:
-            self.date_updated_timestamp = now.timestamp()
-        if self.date_accessed_timestamp is None:
-            self.date_accessed_timestamp = now.timestamp()
-        super().save()
-
-    def increment_interaction_count(self, **kwargs) -> None:
-        self.interaction_count += 1
-        self.date_accessed_timestamp = datetime.now().timestamp()
-        super().save()
-
-    def __getattribute__(self, name):
-        object.__setattr__(self, "date_accessed", datetime.now())
-        object.__setattr__(self, "date_accessed_timestamp", datetime.now().timestamp())
-        return object.__getattribute__(self, name)
+            return
+        if self._embedding_pending:
+            if self._embedding is None:
+                db.delete(embedding_key(self.id))
+            else:
+                write_embedding(db, self.id, self._embedding, self.group_id, self.platform_id)
+        elif retag:
+            retag_embedding(db, self.id, self.group_id, self.platform_id)
+        self._embedding_pending = False
 
-    def __setattr__(self, name, value) -> None:
-        object.__setattr__(self, "date_updated", datetime.now())
-        object.__setattr__(self, "date_updated_timestamp", datetime.now().timestamp())
-        object.__setattr__(self, name, value)
+    def _save(self, pipeline: Optional["redis.client.Pipeline[Any]"]) -> None:
+        retag = bool(self._dirty & {"group_id", "platform_id"})
+        db = self.db().pipeline(transaction=False) if pipeline is None else pipeline
+        super()._save(db)
+        self._write_embedding(db, retag)
+        if pipeline is None:
+            db.execute()
 
-    def __str__(self):
-        attributes = []
-        for attribute, value in vars(self).items():
-            attributes.append(f"{attribute}: {value}")
-        return "\n".join(attributes)
+    async def _async_save(self, pipeline: Optional["redis.asyncio.client.Pipeline[Any]"]) -> None:
+        retag = bool(self._dirty & {"group_id", "platform_id"})
+        db = self.async_db().pipeline(transaction=False) if pipeline is None else pipeline
+        await super()._async_save(db)
+        self._write_embedding(db, retag)
+        if pipeline is None:
+            await db.execute()
 
-    def __eq__(self, other) -> bool:
-        for attribute, value in vars(self).items():
-            if attribute == "password" or attribute == "date_accessed":
-                continue
-            if value != getattr(other, attribute):
-                return False
-        return True
+    def increment_interaction_count(self, amount: int = 1) -> None:
+        """Add ``amount`` to the interaction count and stamp the access time, without rewriting the document.
+
+        The increment runs server-side (``JSON.NUMINCRBY``), so concurrent workers never lose increments, and
+        the instance is refreshed with the resulting count. With ``interaction_counter`` write-behind enabled
+        the increment is queued instead, and the stored and instance counts catch up on the next flush.
+        A user not saved yet is saved whole.
+        """
+        now = datetime.now().timestamp()
+        object.__setattr__(self, "date_accessed_timestamp", now)
+        if self.id is not None and interaction_counter.enabled:
+            interaction_counter.add(self.key(), amount, now, self.shard)
+            return
+        with timed("UserModel.increment_interaction_count"), self._on_shard():
+            if self.id is not None:
+                pipeline = self.db().pipeline(transaction=True)
+                pipeline.json().numincrby(self.key(), ".interaction_count", amount)
+                pipeline.json().set(self.key(), ".date_accessed_timestamp", now)
+                try:
+                    count, _ = pipeline.execute()
+                except redis.ResponseError:
+                    if self.db().exists(self.key()):
+                        raise
+                else:
+                    object.__setattr__(self, "interaction_count", int(count))
+                    return
+            self.interaction_count += amount
+            self.save()
+
+    @classmethod
+    def shard_keys(cls, db: Any, pk: Any) -> Tuple[List[str], List[str]]:
+        return [cls.make_key(pk), embedding_key(pk)], []
 
     class Meta:
         database = redis_connection
+        async_database = async_redis_connection
 
 
-class UserImageModel(JsonModel):
+class UserImageModel(TrackedJsonModel):
+    shard_field = "group_id"
+
     version: str = "1.0"
     commit: str = "commit"
     id: Optional[str] = Field(index=True, primary_key=True)
     group_id: Optional[str] = Field(index=True)
     platform_id: Optional[str] = Field(index=True)
-    avatar_image_bytes: Optional[bytes] = Field(index=False, description="Avatar Image")
+    avatar_image_ref: Optional[str] = Field(index=False, description="Avatar Image blob digest")
     avatar_image_prompt: Optional[str] = Field(index=False, description="Avatar Image Prompt")
-    avatar_image_bytes_history: Optional[List[bytes]] = Field([], index=False, description="Avatar Image History")
+    avatar_image_ref_history: Optional[List[str]] = Field([], index=False, description="Avatar Image History digests")
     avatar_image_prompt_history: Optional[List[str]] = Field([], index=False, description="Avatar Image Prompt History")
     date_created_timestamp: Optional[float] = Field(index=True)
     date_updated_timestamp: Optional[float] = Field(index=True)
     date_accessed_timestamp: Optional[float] = Field(index=True)
+    _blobs: Dict[str, bytes] = PrivateAttr(default_factory=dict)
+    _pending_blobs: Set[str] = PrivateAttr(default_factory=set)
 
-    def save(self) -> None:
-        now = datetime.now()
-        if self.id is None:
-            self.id = str(uuid.uuid4())
-        if self.date_created_timestamp is None:
-            self.date_created_timestamp = now.timestamp()
-        if self.date_updated_timestamp is None:
-            self.date_updated_timestamp = now.timestamp()
-        if self.date_accessed_timestamp is None:
-            self.date_accessed_timestamp = now.timestamp()
-        super().save()
-
-    def __getattribute__(self, name):
-        object.__setattr__(self, "date_accessed", datetime.now())
-        object.__setattr__(self, "date_accessed_timestamp", datetime.now().timestamp())
-        return object.__getattribute__(self, name)
+    def __init__(self, **data: Any) -> None:
+        # Image bytes live in the blob store, the document only keeps their digests. Inline bytes
+        # (from callers or documents written before the blob store existed) are moved there on save.
+        image_bytes = data.pop("avatar_image_bytes", None)
+        image_bytes_history = data.pop("avatar_image_bytes_history", None)
+        super().__init__(**data)
+        if image_bytes is not None:
+            self.avatar_image_bytes = image_bytes
+        if image_bytes_history:
+            self.avatar_image_bytes_history = image_bytes_history
+        self._dirty.clear()
 
-    def __setattr__(self, name, value) -> None:
-        object.__setattr__(self, "date_updated", datetime.now())
-        object.__setattr__(self, "date_updated_timestamp", datetime.now().timestamp())
-        object.__setattr__(self, name, value)
+    @property
+    def avatar_image_bytes(self) -> Optional[bytes]:
+        """Avatar Image, loaded from the blob store on first read."""
+        if self.avatar_image_ref is None:
+            return None
+        return self._load_blobs([self.avatar_image_ref])[0]
 
-    def __str__(self):
-        attributes = []
-        for attribute, value in vars(self).items():
-            attributes.append(f"{attribute}: {value}")
-        return "\n".join(attributes)
+    @avatar_image_bytes.setter
+    def avatar_image_bytes(self, value: Optional[bytes]) -> None:
+        self.avatar_image_ref = None if value is None else self._stage_blob(value)
 
-    def __eq__(self, other) -> bool:
-        for attribute, value in vars(self).items():
-            if attribute == "password" or attribute == "date_accessed":
-                continue
-            if value != getattr(other, attribute):
-                return False
-        return True
+    @property
+    def avatar_image_bytes_history(self) -> List[Optional[bytes]]:
+        """Avatar Image History, loaded from the blob store on first read."""
+        return self._load_blobs(self.avatar_image_ref_history or [])
+
+    @avatar_image_bytes_history.setter
+    def avatar_image_bytes_history(self, values: List[bytes]) -> None:
+        self.avatar_image_ref_history = [self._stage_blob(value) for value in values]
+
+    def _stage_blob(self, value: Union[bytes, str]) -> str:
+        if isinstance(value, str):
+            value = value.encode()
+        digest = blob_digest(value)
+        self._blobs[digest] = value
+        self._pending_blobs.add(digest)
+        return digest
+
+    def _load_blobs(self, digests: List[str]) -> List[Optional[bytes]]:
+        missing = [digest for digest in set(digests) if digest not in self._blobs]
+        for digest, value in get_blobs(self.shard_db(), missing).items():
+            if value is not None:
+                self._blobs[digest] = value
+        return [self._blobs.get(digest) for digest in digests]
+
+    async def async_load_blobs(self) -> None:
+        """Fetch all referenced image bytes on the asyncio connection, so later reads do not block."""
+        digests = [self.avatar_image_ref] + list(self.avatar_image_ref_history or [])
+        missing = [digest for digest in set(digests) if digest and digest not in self._blobs]
+        if not missing:
+            return
+        with self._on_shard():
+            values = await self.async_db().mget([blob_key(digest) for digest in missing])
+        for digest, value in zip(missing, values):
+            if value is not None:
+                self._blobs[digest] = value
+
+    def _save(self, pipeline: Optional["redis.client.Pipeline[Any]"]) -> None:
+        db = self.db().pipeline(transaction=False) if pipeline is None else pipeline
+        for digest in self._pending_blobs:
+            record_payload(len(self._blobs[digest]))
+            put_blob(db, self._blobs[digest])
+        super()._save(db)
+        if pipeline is None:
+            db.execute()
+        self._pending_blobs.clear()
+
+    async def _async_save(self, pipeline: Optional["redis.asyncio.client.Pipeline[Any]"]) -> None:
+        db = self.async_db().pipeline(transaction=False) if pipeline is None else pipeline
+        for digest in self._pending_blobs:
+            record_payload(len(self._blobs[digest]))
+            put_blob(db, self._blobs[digest])
+        await super()._async_save(db)
+        if pipeline is None:
+            await db.execute()
+        self._pending_blobs.clear()
+
+    @classmethod
+    def shard_keys(cls, db: Any, pk: Any) -> Tuple[List[str], List[str]]:
+        document = db.json().get(cls.make_key(pk), "$.avatar_image_ref", "$.avatar_image_ref_history") or {}
+        refs = [*(document.get("$.avatar_image_ref") or [])]
+        for history in document.get("$.avatar_image_ref_history") or []:
+            refs.extend(history or [])
+        # Blobs are shared by identical images: they are copied, and left to collect_user_image_blobs.
+        return [cls.make_key(pk)], [blob_key(digest) for digest in dict.fromkeys(refs) if digest]
 
     class Meta:
         database = redis_connection
+        async_database = async_redis_connection
+
 
+class UserVideoModel(TrackedJsonModel):
+    shard_field = "group_id"
 
-class UserVideoModel(JsonModel):
     version: str = "1.0"
     commit: str = "commit"
     id: Optional[str] = Field(index=True, primary_key=True)
     group_id: Optional[str] = Field(index=True)
     platform_id: Optional[str] = Field(index=True)
-    avatar_video_bytes: Optional[str] = Field(index=False, description="Avatar Video")
+    avatar_video_ref: Optional[str] = Field(index=False, description="Avatar Video chunks reference")
+    avatar_video_store: Optional[str] = Field(index=False, description="Avatar Video chunk store")
+    avatar_video_size: Optional[int] = Field(index=False, description="Avatar Video size in bytes")
+    avatar_video_chunk_size: Optional[int] = Field(index=False, description="Avatar Video chunk size in bytes")
+    avatar_video_sha256: Optional[str] = Field(index=False, description="Avatar Video digest")
     date_created_timestamp: Optional[float] = Field(index=True)
     date_updated_timestamp: Optional[float] = Field(index=True)
     date_accessed_timestamp: Optional[float] = Field(index=True)
+    _pending_video: Optional[bytes] = PrivateAttr(None)
+    _replaced_video: Optional[Tuple[str, Optional[str], int, int]] = PrivateAttr(None)
 
-    def save(self) -> None:
-        now = datetime.now()
-        if self.id is None:
-            self.id = str(uuid.uuid4())
-        if self.date_created_timestamp is None:
-            self.date_created_timestamp = now.timestamp()
-        if self.date_updated_timestamp is None:
-            self.date_updated_timestamp = now.timestamp()
-        if self.date_accessed_timestamp is None:
-            self.date_accessed_timestamp = now.timestamp()
-        super().save()
-
-    def __getattribute__(self, name):
-        object.__setattr__(self, "date_accessed", datetime.now())
-        object.__setattr__(self, "date_accessed_timestamp", datetime.now().timestamp())
-        return object.__getattribute__(self, name)
+    def __init__(self, **data: Any) -> None:
+        # The video lives in fixed-size chunks of a chunk store, the document only keeps their manifest.
+        # Inline bytes (from callers or documents written before chunking existed) are moved there on save.
+        video_bytes = data.pop("avatar_video_bytes", None)
+        super().__init__(**data)
+        if video_bytes is not None:
+            self.avatar_video_bytes = video_bytes
+        self._dirty.clear()
 
-    def __setattr__(self, name, value) -> None:
-        object.__setattr__(self, "date_updated", datetime.now())
-        object.__setattr__(self, "date_updated_timestamp", datetime.now().timestamp())
-        object.__setattr__(self, name, value)
+    @property
+    def avatar_video_bytes(self) -> Optional[bytes]:
+        """Avatar Video, read whole from the chunk store; prefer ``iter_video`` for large videos."""
+        if self._pending_video is not None:
+            return self._pending_video
+        if self.avatar_video_ref is None:
+            return None
+        return b"".join(self.iter_video())
 
-    def __str__(self):
-        attributes = []
-        for attribute, value in vars(self).items():
-            attributes.append(f"{attribute}: {value}")
-        return "\n".join(attributes)
+    @avatar_video_bytes.setter
+    def avatar_video_bytes(self, value: Union[bytes, str, None]) -> None:
+        if isinstance(value, str):
+            value = value.encode()
+        self._replace_manifest(None, None, None, None, None)
+        self._pending_video = value
 
-    def __eq__(self, other) -> bool:
-        for attribute, value in vars(self).items():
-            if attribute == "password" or attribute == "date_accessed":
-                continue
-            if value != getattr(other, attribute):
-                return False
-        return True
+    def _replace_manifest(
+        self,
+        ref: Optional[str],
+        store: Optional[str],
+        size: Optional[int],
+        chunk_size: Optional[int],
+        sha256: Optional[str],
+    ) -> None:
+        if self._replaced_video is None and self.avatar_video_ref is not None:
+            self._replaced_video = (
+                self.avatar_video_ref,
+                self.avatar_video_store,
+                self.avatar_video_size or 0,
+                self.avatar_video_chunk_size or VIDEO_CHUNK_SIZE,
+            )
+        self.avatar_video_ref, self.avatar_video_store = ref, store
+        self.avatar_video_size, self.avatar_video_chunk_size, self.avatar_video_sha256 = size, chunk_size, sha256
+        self._pending_video = None
+
+    def _write_chunks(self, db: Any, source: ChunkSource, chunk_size: Optional[int]) -> None:
+        chunk_size = VIDEO_CHUNK_SIZE if chunk_size is None else chunk_size
+        store, ref, size, digest = chunk_store(), uuid.uuid4().hex, 0, hashlib.sha256()
+        for index, chunk in enumerate(iter_chunks(source, chunk_size)):
+            store.put(db, ref, index, chunk, chunk_size)
+            size += len(chunk)
+            digest.update(chunk)
+        record_payload(size)
+        self._replace_manifest(ref, store.name, size, chunk_size, digest.hexdigest())
+
+    def upload_video(self, source: ChunkSource, chunk_size: Optional[int] = None) -> None:
+        """Stream a video into the chunk store, save the document pointing at it, then drop the previous video.
+
+        Chunks are written one round trip each as ``source`` is read, so memory stays bounded by
+        ``chunk_size`` (``VIDEO_CHUNK_SIZE`` by default) whatever the video size.
+
+        Args:
+            source (ChunkSource): Bytes, a file path, a binary file object or an iterable of byte strings.
+            chunk_size (Optional[int]): Chunk size in bytes.
+        """
+        with timed("UserVideoModel.upload_video"):
+            self._write_chunks(self.shard_db(), source, chunk_size)
+        self.save()
+
+    def iter_video(self, start: int = 0, stop: Optional[int] = None) -> Iterator[bytes]:
+        """Yield the bytes ``[start, stop)`` of the video, at most one chunk at a time (e.g. for HTTP ranges)."""
+        if self._pending_video is not None:
+            yield from iter_chunks(self._pending_video[start:stop], VIDEO_CHUNK_SIZE)
+        elif self.avatar_video_ref is not None:
+            store = chunk_store(self.avatar_video_store)
+            size, chunk_size = self.avatar_video_size or 0, self.avatar_video_chunk_size or VIDEO_CHUNK_SIZE
+            yield from store.read(self.avatar_video_ref, size, chunk_size, start, stop, db=self.shard_db())
+
+    def read_video(self, start: int = 0, stop: Optional[int] = None) -> bytes:
+        """Return the bytes ``[start, stop)`` of the video."""
+        with timed("UserVideoModel.read_video"):
+            data = b"".join(self.iter_video(start, stop))
+            record_payload(len(data))
+        return data
+
+    def _stage_video(self, db: Any) -> None:
+        if self._pending_video is not None:
+            self._write_chunks(db, self._pending_video, None)
+
+    def _remove_replaced_video(self, db: Any) -> None:
+        if self._replaced_video is not None:
+            ref, store, size, chunk_size = self._replaced_video
+            chunk_store(store).remove(db, ref, size, chunk_size)
+            self._replaced_video = None
+
+    def _save(self, pipeline: Optional["redis.client.Pipeline[Any]"]) -> None:
+        db = self.db().pipeline(transaction=False) if pipeline is None else pipeline
+        self._stage_video(db)
+        super()._save(db)
+        self._remove_replaced_video(db)
+        if pipeline is None:
+            db.execute()
+
+    async def _async_save(self, pipeline: Optional["redis.asyncio.client.Pipeline[Any]"]) -> None:
+        db = self.async_db().pipeline(transaction=False) if pipeline is None else pipeline
+        self._stage_video(db)
+        await super()._async_save(db)
+        self._remove_replaced_video(db)
+        if pipeline is None:
+            await db.execute()
+
+    @classmethod
+    def _manifest(cls, db: Any, pk: Any) -> Tuple[Any, ...]:
+        paths = ("$.avatar_video_ref", "$.avatar_video_store", "$.avatar_video_size", "$.avatar_video_chunk_size")
+        manifest = db.json().get(cls.make_key(pk), *paths) or {}
+        return tuple(next(iter(manifest.get(path) or []), None) for path in paths)
+
+    @classmethod
+    def delete(cls, pk: Any, pipeline: Optional["redis.client.Pipeline[Any]"] = None) -> int:
+        with use_shard(cls.locate(pk) if pipeline is None else current_shard()):
+            ref, store, size, chunk_size = cls._manifest(cls.db(), pk)
+            deleted = super().delete(pk, pipeline=pipeline)
+            if ref is not None:
+                chunk_store(store).remove(cls.db() if pipeline is None else pipeline, ref, size, chunk_size)
+        return deleted
+
+    @classmethod
+    def shard_keys(cls, db: Any, pk: Any) -> Tuple[List[str], List[str]]:
+        ref, store, size, chunk_size = cls._manifest(db, pk)
+        if ref is None or store != RedisChunkStore.name:
+            return [cls.make_key(pk)], []
+        return [cls.make_key(pk), *(chunk_key(ref, index) for index in range(chunk_count(size, chunk_size)))], []
 
     class Meta:
         database = redis_connection
+        async_database = async_redis_connection
+
+
+# Before any index is created or queried.
+apply_index_profile(os.getenv("INDEX_PROFILE"))
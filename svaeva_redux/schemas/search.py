@@ -0,0 +1,365 @@
+import logging
+import os
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+from redis.commands.search.aggregation import AggregateRequest
+from redis.commands.search.field import TagField, VectorField
+from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+from redis.commands.search.query import Query
+from redis.exceptions import ResponseError
+from redis_om.model.token_escaper import TokenEscaper
+
+from svaeva_redux.connection import current_shard
+from svaeva_redux.schemas.embeddings import EMBEDDING_KEY_PREFIX, decode_embedding
+from svaeva_redux.schemas.redis import UserModel
+from svaeva_redux.shards import shard_router
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_EMBEDDING_DIM = int(os.getenv("CONVERSATION_EMBEDDING_DIM", 1536))
+EMBEDDING_INDEX_NAME = f"{EMBEDDING_KEY_PREFIX}index"
+DISTANCE_METRICS = ("COSINE", "L2", "IP")
+USER_REPORT_FIELDS = ("id", "interaction_count", "date_created_timestamp", "date_updated_timestamp")
+
+_escaper = TokenEscaper()
+
+
+def has_vector_search(db: Any = None) -> bool:
+    """Whether the Redis deployment has the search module loaded."""
+    return _has_search_module(UserModel.db() if db is None else db)
+
+
+@lru_cache(maxsize=None)
+def _has_search_module(db: Any) -> bool:
+    try:
+        db.execute_command("FT._LIST")
+    except ResponseError:
+        return False
+    return True
+
+
+def create_embedding_index(
+    dim: int = CONVERSATION_EMBEDDING_DIM,
+    algorithm: str = "HNSW",
+    distance_metric: str = "COSINE",
+    drop_existing: bool = False,
+) -> bool:
+    """Create the RediSearch vector index over the packed float32 conversation embedding hashes.
+
+    The index is separate from the one built by the Migrator, so embeddings of another dimension only
+    fail to index here and their users remain queryable by their other fields.
+
+    Args:
+        dim (int): Embedding dimension.
+        algorithm (str): ``HNSW`` or ``FLAT``.
+        distance_metric (str): ``COSINE``, ``L2`` or ``IP``.
+        drop_existing (bool): Drop and rebuild the index if it already exists.
+
+    Returns:
+        bool: True if the index was created, False if it already existed or search is unavailable.
+    """
+    if not has_vector_search():
+        logger.warning("Redis has no search module, find_similar_users will use the NumPy fallback")
+        return False
+    index = UserModel.db().ft(EMBEDDING_INDEX_NAME)
+    try:
+        index.info()
+        if not drop_existing:
+            return False
+        index.dropindex(delete_documents=False)
+    except ResponseError:
+        pass
+    index.create_index(
+        [
+            TagField("group_id"),
+            TagField("platform_id"),
+            VectorField(
+                "vector",
+                algorithm.upper(),
+                {"TYPE": "FLOAT32", "DIM": dim, "DISTANCE_METRIC": distance_metric.upper()},
+            ),
+        ],
+        definition=IndexDefinition(prefix=[EMBEDDING_KEY_PREFIX], index_type=IndexType.HASH),
+    )
+    logger.info(f"Created vector index {EMBEDDING_INDEX_NAME} ({algorithm}, {distance_metric}, dim={dim})")
+    return True
+
+
+def find_similar_users(
+    embedding: NDArray[Any],
+    k: int = 10,
+    group_id: Optional[str] = None,
+    platform_id: Optional[str] = None,
+    max_distance: Optional[float] = None,
+    distance_metric: str = "COSINE",
+) -> List[Tuple[str, float]]:
+    """Find the users whose conversation embedding is closest to ``embedding``.
+
+    Uses the RediSearch vector index when available and falls back to a NumPy brute-force scan otherwise.
+    With sharding, only the shard of ``group_id`` is searched, or else every shard in parallel.
+
+    Args:
+        embedding (np.ndarray): The query embedding.
+        k (int): Maximum number of users to return.
+        group_id (Optional[str]): Only consider users of this group.
+        platform_id (Optional[str]): Only consider users of this platform.
+        max_distance (Optional[float]): Only return users within this distance (range query).
+        distance_metric (str): Metric of the fallback scan, should match the index metric.
+
+    Returns:
+        List[Tuple[str, float]]: (user id, distance) pairs, closest first.
+    """
+    if shard_router.enabled and current_shard() is None:
+        arguments = (embedding, k, group_id, platform_id, max_distance, distance_metric)
+        if group_id is not None:
+            with shard_router.route(group_id):
+                return find_similar_users(*arguments)
+        found = shard_router.fan_out(lambda _: find_similar_users(*arguments))
+        return sorted((match for matches in found.values() for match in matches), key=lambda match: match[1])[:k]
+    query_vector = np.asarray(embedding, dtype=np.float32)
+    if has_vector_search():
+        try:
+            return _search_index(query_vector, k, group_id, platform_id, max_distance)
+        except ResponseError as e:
+            logger.warning(f"Vector search failed, falling back to a scan: {e}")
+    return _search_brute_force(query_vector, k, group_id, platform_id, max_distance, distance_metric)
+
+
+def _filter_expression(group_id: Optional[str], platform_id: Optional[str]) -> str:
+    filters = []
+    if group_id is not None:
+        filters.append(f"@group_id:{{{_escaper.escape(group_id)}}}")
+    if platform_id is not None:
+        filters.append(f"@platform_id:{{{_escaper.escape(platform_id)}}}")
+    return " ".join(filters)
+
+
+def _search_index(
+    query_vector: NDArray[Any],
+    k: int,
+    group_id: Optional[str],
+    platform_id: Optional[str],
+    max_distance: Optional[float],
+) -> List[Tuple[str, float]]:
+    filters = _filter_expression(group_id, platform_id)
+    params: Dict[str, Any] = {"vector": query_vector.tobytes()}
+    if max_distance is None:
+        query_string = f"({filters or '*'})=>[KNN {k} @vector $vector AS distance]"
+    else:
+        query_string = f"{filters} @vector:[VECTOR_RANGE $radius $vector]=>{{$YIELD_DISTANCE_AS: distance}}"
+        params["radius"] = max_distance
+    query = Query(query_string).sort_by("distance").return_fields("distance").paging(0, k).dialect(2)
+    result = UserModel.db().ft(EMBEDDING_INDEX_NAME).search(query, query_params=params)
+    return [(document.id[len(EMBEDDING_KEY_PREFIX) :], float(document.distance)) for document in result.docs]
+
+
+def _iter_embeddings(batch_size: int = 500) -> Iterator[Tuple[str, Optional[str], Optional[str], NDArray[Any]]]:
+    db = UserModel.db()
+    fields = ("vector", "group_id", "platform_id")
+
+    def fetch(batch):
+        pipeline = db.pipeline(transaction=False)
+        for key in batch:
+            pipeline.hmget(key, *fields)
+        for key, (vector, group, platform) in zip(batch, pipeline.execute()):
+            if vector:
+                yield (
+                    key[len(EMBEDDING_KEY_PREFIX) :],
+                    group.decode() if group is not None else None,
+                    platform.decode() if platform is not None else None,
+                    decode_embedding(vector),
+                )
+
+    keys = []
+    for key in db.scan_iter(match=f"{EMBEDDING_KEY_PREFIX}*", count=batch_size, _type="hash"):
+        keys.append(key.decode() if isinstance(key, bytes) else key)
+        if len(keys) >= batch_size:
+            yield from fetch(keys)
+            keys = []
+    if keys:
+        yield from fetch(keys)
+
+
+def _distances(matrix: NDArray[Any], query_vector: NDArray[Any], distance_metric: str) -> NDArray[Any]:
+    distances: NDArray[Any]
+    if distance_metric == "L2":
+        distances = np.sum((matrix - query_vector) ** 2, axis=1)
+    elif distance_metric == "IP":
+        distances = 1.0 - matrix @ query_vector
+    else:
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query_vector)
+        distances = 1.0 - (matrix @ query_vector) / np.where(norms == 0, 1.0, norms)
+    return distances
+
+
+def _search_brute_force(
+    query_vector: NDArray[Any],
+    k: int,
+    group_id: Optional[str],
+    platform_id: Optional[str],
+    max_distance: Optional[float],
+    distance_metric: str,
+) -> List[Tuple[str, float]]:
+    distance_metric = distance_metric.upper()
+    if distance_metric not in DISTANCE_METRICS:
+        raise ValueError(f"Unknown distance metric {distance_metric}, expected one of {DISTANCE_METRICS}")
+    ids, vectors = [], []
+    for user_id, user_group_id, user_platform_id, vector in _iter_embeddings():
+        if group_id is not None and user_group_id != group_id:
+            continue
+        if platform_id is not None and user_platform_id != platform_id:
+            continue
+        if len(vector) != len(query_vector):
+            continue
+        ids.append(user_id)
+        vectors.append(vector)
+    if not ids:
+        return []
+    distances = _distances(np.vstack(vectors), query_vector, distance_metric)
+    if max_distance is not None:
+        candidates = np.flatnonzero(distances <= max_distance)
+    else:
+        candidates = np.arange(len(ids))
+    if len(candidates) > k:
+        candidates = candidates[np.argpartition(distances[candidates], k - 1)[:k]]
+    candidates = candidates[np.argsort(distances[candidates], kind="stable")]
+    return [(ids[i], float(distances[i])) for i in candidates]
+
+
+def iter_user_pages(
+    group_id: Optional[str] = None,
+    platform_id: Optional[str] = None,
+    fields: Sequence[str] = USER_REPORT_FIELDS,
+    page_size: int = 500,
+) -> Iterator[List[Dict[str, Any]]]:
+    """Yield the users of a group and/or platform page by page, with only the requested fields.
+
+    Matching keys come from a RediSearch aggregation cursor (or a SCAN when search is unavailable) and each
+    page's fields are read with one pipelined multi-path JSON.GET, so neither the whole result set nor the
+    full documents (nor embeddings or avatars) are ever held in memory. With sharding, only the shard of
+    ``group_id`` is read, or else every shard in turn.
+
+    Args:
+        group_id (Optional[str]): Only users of this group.
+        platform_id (Optional[str]): Only users of this platform.
+        fields (Sequence[str]): ``UserModel`` fields to return, missing values are None.
+        page_size (int): Users per page and per round trip.
+
+    Yields:
+        List[Dict[str, Any]]: Up to ``page_size`` ``{field: value}`` dicts, in no particular order.
+
+    Examples:
+        .. code:: python
+
+            >>> total = 0
+            >>> pages = iter_user_pages(group_id="installation-1", fields=("id", "interaction_count"))
+            >>> for page in pages:  # doctest: +SKIP
+            ...     total += sum(user["interaction_count"] for user in page)
+    """
+    unknown = set(fields) - set(UserModel.__fields__)
+    if unknown:
+        raise ValueError(f"Unknown UserModel fields {sorted(unknown)}")
+    for db in _user_databases(group_id):
+        yield from _iter_pages(db, group_id, platform_id, fields, page_size)
+
+
+def _user_databases(group_id: Optional[str]) -> List[Any]:
+    # Explicit clients rather than ``use_shard``: a generator must not select a shard for its caller.
+    if not shard_router.enabled:
+        return [UserModel.db()]
+    database = UserModel._meta.database
+    if group_id is not None:
+        return [database.shard(shard_router.shard_for(group_id))]
+    return [database.shard(shard) for shard in shard_router.shards]
+
+
+def _iter_pages(
+    db: Any, group_id: Optional[str], platform_id: Optional[str], fields: Sequence[str], page_size: int
+) -> Iterator[List[Dict[str, Any]]]:
+    if has_vector_search(db):
+        try:
+            for keys in _search_user_keys(db, group_id, platform_id, page_size):
+                yield _project(db, keys, fields)
+            return
+        except ResponseError as e:  # E.g. an index profile that does not index group_id or platform_id.
+            logger.warning(f"User query failed, falling back to a scan: {e}")
+    yield from _scan_user_pages(db, group_id, platform_id, fields, page_size)
+
+
+def iter_users(
+    group_id: Optional[str] = None,
+    platform_id: Optional[str] = None,
+    fields: Sequence[str] = USER_REPORT_FIELDS,
+    page_size: int = 500,
+) -> Iterator[Dict[str, Any]]:
+    """Yield the users of ``iter_user_pages`` one by one."""
+    for page in iter_user_pages(group_id, platform_id, fields, page_size):
+        yield from page
+
+
+def _search_user_keys(
+    db: Any, group_id: Optional[str], platform_id: Optional[str], page_size: int
+) -> Iterator[List[str]]:
+    index = db.ft(UserModel._meta.index_name)
+    request = AggregateRequest(_filter_expression(group_id, platform_id) or "*").load("@__key").cursor(page_size)
+    result = index.aggregate(request)
+    try:
+        while True:
+            keys = [dict(zip(row[::2], row[1::2]))[b"__key"].decode() for row in result.rows]
+            if keys:
+                yield keys
+            if not result.cursor or not result.cursor.cid:
+                return
+            result = index.aggregate(result.cursor)
+    finally:
+        if result.cursor and result.cursor.cid:  # Abandoned before the end.
+            db.execute_command("FT.CURSOR", "DEL", UserModel._meta.index_name, result.cursor.cid)
+
+
+def _project(db: Any, keys: List[str], fields: Sequence[str]) -> List[Dict[str, Any]]:
+    pipeline = db.pipeline(transaction=False)
+    for key in keys:
+        pipeline.json().get(key, *(f"$.{field}" for field in fields))
+    users = []
+    for values in pipeline.execute():
+        if values is None:  # Deleted since it matched.
+            continue
+        if len(fields) == 1:
+            values = {f"$.{fields[0]}": values}
+        users.append({field: next(iter(values.get(f"$.{field}") or []), None) for field in fields})
+    return users
+
+
+def _scan_user_pages(
+    db: Any, group_id: Optional[str], platform_id: Optional[str], fields: Sequence[str], page_size: int
+) -> Iterator[List[Dict[str, Any]]]:
+    projected = list(dict.fromkeys([*fields, "group_id", "platform_id"]))
+    page: List[Dict[str, Any]] = []
+    keys: List[str] = []
+
+    def matches(user: Dict[str, Any]) -> bool:
+        return (group_id is None or user["group_id"] == group_id) and (
+            platform_id is None or user["platform_id"] == platform_id
+        )
+
+    def fetch() -> Iterator[Dict[str, Any]]:
+        for user in _project(db, keys, projected):
+            if matches(user):
+                yield {field: user[field] for field in fields}
+
+    for key in db.scan_iter(match=f"{UserModel.make_key('')}*", count=page_size, _type="ReJSON-RL"):
+        keys.append(key.decode() if isinstance(key, bytes) else key)
+        if len(keys) >= page_size:
+            page.extend(fetch())
+            keys = []
+        if len(page) >= page_size:
+            yield page[:page_size]
+            page = page[page_size:]
+    if keys:
+        page.extend(fetch())
+    while page:
+        yield page[:page_size]
+        page = page[page_size:]
@@ -0,0 +1,260 @@
+import base64
+import bz2
+import gzip
+import io
+import json
+import lzma
+import sys
+import time
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from svaeva_redux.connection import redis_connection
+from svaeva_redux.metrics import instrument, record_payload
+from svaeva_redux.schemas.blobs import get_blobs, put_blob
+from svaeva_redux.schemas.chunks import chunk_store
+from svaeva_redux.schemas.codec import get_interned, interned_digests, put_interned
+from svaeva_redux.schemas.embeddings import decode_embedding, embedding_key, write_embedding
+from svaeva_redux.schemas.redis import (
+    ConversationModel,
+    UserImageModel,
+    UserModel,
+    UserVideoModel,
+    conversation_cache,
+)
+from svaeva_redux.shards import shard_router
+
+EXPORTED_MODELS: Dict[str, Any] = {
+    cls.__name__: cls for cls in (ConversationModel, UserModel, UserImageModel, UserVideoModel)
+}
+
+# Records holding one chunk of the video of the UserVideoModel record before them.
+VIDEO_CHUNK = "VideoChunk"
+
+_COMPRESSION: Dict[str, Callable[..., Any]] = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+
+def open_ndjson(path: str, mode: str = "r") -> IO[str]:
+    """Open an NDJSON file as text, compressed according to its extension (``.gz``, ``.bz2`` or ``.xz``).
+
+    ``-`` is the standard input or output.
+    """
+    if path == "-":
+        return io.TextIOWrapper(sys.stdin.buffer if mode == "r" else sys.stdout.buffer, encoding="utf-8")
+    for extension, opener in _COMPRESSION.items():
+        if path.endswith(extension):
+            stream: IO[str] = opener(path, f"{mode}t", encoding="utf-8")
+            return stream
+    return open(path, mode, encoding="utf-8")
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def _scan_keys(db: Any, cls: Any, batch_size: int) -> Iterator[List[str]]:
+    prefix = cls.make_key("")
+    batch: List[str] = []
+    # Only the documents, not the index bookkeeping keys sharing their prefix.
+    for key in db.scan_iter(match=f"{prefix}*", count=batch_size, _type="ReJSON-RL"):
+        batch.append(key.decode() if isinstance(key, bytes) else key)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _sources(db: Any, cls: Any) -> List[Any]:
+    """The clients holding the documents of ``cls``: every shard for sharded models, unless ``db`` is given."""
+    if db is not None or cls.shard_field is None or not shard_router.enabled:
+        return [redis_connection if db is None else db]
+    return [redis_connection.shard(shard) for shard in shard_router.shards]
+
+
+def _export_batch(db: Any, cls: Any, keys: List[str]) -> Iterator[Dict[str, Any]]:
+    prefix = cls.make_key("")
+    documents = db.json().mget(keys, ".")
+    records = [
+        {"model": cls.__name__, "pk": key[len(prefix) :], "document": document}
+        for key, document in zip(keys, documents)
+        if document is not None  # Deleted since the scan.
+    ]
+    if cls is UserModel:
+        pipeline = db.pipeline(transaction=False)
+        for record in records:
+            pipeline.hget(embedding_key(record["pk"]), "vector")
+        for record, vector in zip(records, pipeline.execute()):
+            if vector is not None:
+                record["embedding"] = _b64(vector)
+    elif cls is UserImageModel:
+        references = {}
+        for record in records:
+            document = record["document"]
+            digests = [document.get("avatar_image_ref"), *(document.get("avatar_image_ref_history") or [])]
+            references[record["pk"]] = [digest for digest in dict.fromkeys(digests) if digest]
+        blobs = get_blobs(db, list({digest for digests in references.values() for digest in digests}))
+        for record in records:
+            record["blobs"] = {
+                digest: _b64(data) for digest in references[record["pk"]] if (data := blobs[digest]) is not None
+            }
+    if cls.codec_fields:
+        documents = [record["document"] for record in records]
+        digests = [digest for document in documents for digest in interned_digests(document, cls.codec_fields)]
+        interned = get_interned(db, list(dict.fromkeys(digests)))
+        for record in records:
+            record["interned"] = {
+                digest: _b64(data)
+                for digest in interned_digests(record["document"], cls.codec_fields)
+                if (data := interned[digest]) is not None
+            }
+    if cls is not UserVideoModel:
+        yield from records
+        return
+    for record in records:
+        yield record
+        document = record["document"]
+        ref, store = document.get("avatar_video_ref"), document.get("avatar_video_store")
+        if ref is None:
+            continue
+        size, chunk_size = document["avatar_video_size"], document["avatar_video_chunk_size"]
+        # One record per chunk, so a video never has to fit in memory.
+        for index, data in enumerate(chunk_store(store).read(ref, size, chunk_size, db=db)):
+            yield {
+                "model": VIDEO_CHUNK,
+                "store": store,
+                "pk": ref,
+                "index": index,
+                "chunk_size": chunk_size,
+                "data": _b64(data),
+            }
+
+
+@instrument("export_records")
+def export_records(
+    stream: IO[str], models: Optional[Sequence[str]] = None, batch_size: int = 500, db: Any = None
+) -> Dict[str, Any]:
+    """Stream model documents to ``stream`` as NDJSON, one record per line.
+
+    Documents are read by SCAN cursor in batches of ``batch_size`` (one JSON.MGET each), so memory stays
+    bounded whatever the dataset size. User embeddings and image blobs are included base64-encoded. With
+    sharding, the sharded models are read from every shard in turn.
+
+    Args:
+        stream (IO[str]): Text stream, see ``open_ndjson``.
+        models (Optional[Sequence[str]]): Names in ``EXPORTED_MODELS`` to export, all by default.
+        batch_size (int): Keys per SCAN call and per read round trip.
+        db (Any): Redis client, the package connection (and shards) by default.
+
+    Returns:
+        Dict[str, Any]: Records per model, bytes written, seconds and throughput.
+    """
+    counts: Dict[str, int] = {}
+    written = 0
+    start = time.perf_counter()
+    for name in models or EXPORTED_MODELS:
+        cls = _model(name)
+        counts[name] = 0
+        for source in _sources(db, cls):
+            for keys in _scan_keys(source, cls, batch_size):
+                for record in _export_batch(source, cls, keys):
+                    line = json.dumps(record, separators=(",", ":")) + "\n"
+                    stream.write(line)
+                    counts[record["model"]] = counts.get(record["model"], 0) + 1
+                    written += len(line)
+    record_payload(written)
+    return _report(counts, written, time.perf_counter() - start)
+
+
+def _target(record: Dict[str, Any], video_shard: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """Return the shard a record is written to (None for the configured server) and the shard of the video
+    whose chunks may follow it."""
+    if record["model"] == VIDEO_CHUNK:
+        return video_shard, video_shard
+    cls = _model(record["model"])
+    if cls.shard_field is None or not shard_router.enabled:
+        return None, None
+    shard = shard_router.shard_for(record["document"].get(cls.shard_field))
+    return shard, shard if cls is UserVideoModel else None
+
+
+def _import_record(pipeline: Any, record: Dict[str, Any]) -> None:
+    if record["model"] == VIDEO_CHUNK:
+        data = base64.b64decode(record["data"])
+        chunk_store(record["store"]).put(pipeline, record["pk"], record["index"], data, record["chunk_size"])
+        return
+    cls = _model(record["model"])
+    document = record["document"]
+    pipeline.json().set(cls.make_key(record["pk"]), ".", document)
+    if "embedding" in record:
+        vector = decode_embedding(base64.b64decode(record["embedding"]))
+        write_embedding(pipeline, record["pk"], vector, document.get("group_id"), document.get("platform_id"))
+    for data in record.get("interned", {}).values():
+        put_interned(pipeline, base64.b64decode(data))
+    for data in record.get("blobs", {}).values():
+        # Content-addressed: importing a blob that exists is a no-op.
+        put_blob(pipeline, base64.b64decode(data))
+
+
+@instrument("import_records")
+def import_records(stream: IO[str], batch_size: int = 500, db: Any = None) -> Dict[str, Any]:
+    """Load the NDJSON records written by ``export_records``, overwriting documents with the same key.
+
+    Records are written in pipelined batches of ``batch_size`` while reading, so memory stays bounded. With
+    sharding (and no ``db``), records of sharded models go to the shard owning their group.
+
+    Args:
+        stream (IO[str]): Text stream, see ``open_ndjson``.
+        batch_size (int): Records per pipeline.
+        db (Any): Redis client, the package connection (and shards) by default.
+
+    Returns:
+        Dict[str, Any]: Records per model, bytes read, seconds and throughput.
+    """
+    sharded = db is None and shard_router.enabled
+    db = redis_connection if db is None else db
+    counts: Dict[str, int] = {}
+    read = 0
+    start = time.perf_counter()
+    pipelines: Dict[Optional[str], Any] = {None: db.pipeline(transaction=False)}
+    pending = 0
+    video_shard: Optional[str] = None
+    for line in stream:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        shard = None
+        if sharded:
+            shard, video_shard = _target(record, video_shard)
+        if shard is not None and shard not in pipelines:
+            pipelines[shard] = redis_connection.shard(shard).pipeline(transaction=False)
+        _import_record(pipelines[shard], record)
+        counts[record["model"]] = counts.get(record["model"], 0) + 1
+        read += len(line)
+        pending += 1
+        if pending >= batch_size:
+            for pipeline in pipelines.values():
+                pipeline.execute()
+            pending = 0
+    if counts.get(ConversationModel.__name__):
+        conversation_cache.publish_invalidation(pipelines[None])
+    for pipeline in pipelines.values():
+        pipeline.execute()
+    record_payload(read)
+    return _report(counts, read, time.perf_counter() - start)
+
+
+def _model(name: str) -> Any:
+    if name not in EXPORTED_MODELS:
+        raise ValueError(f"Unknown model {name}, expected one of {list(EXPORTED_MODELS)}")
+    return EXPORTED_MODELS[name]
+
+
+def _report(counts: Dict[str, int], size: int, seconds: float) -> Dict[str, Any]:
+    records = sum(counts.values())
+    return {
+        "records": counts,
+        "bytes": size,
+        "seconds": seconds,
+        "records_per_second": records / seconds if seconds else 0.0,
+        "mb_per_second": size / 1e6 / seconds if seconds else 0.0,
+    }
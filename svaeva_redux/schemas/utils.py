@@ -1,14 +1,42 @@
+import asyncio
+import functools
+import hashlib
+import json
 import logging
+import os
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple, Union
 
 import dotenv
-import numpy as np
+from numpy.typing import NDArray
 from redis_om import Migrator
+from redis_om.model.encoders import jsonable_encoder
 from redis_om.model.model import NotFoundError
 
+from svaeva_redux.connection import async_redis_connection, current_shard, redis_connection, use_shard
+from svaeva_redux.metrics import instrument, record_error, record_payload
 from svaeva_redux.prompts.consonancia import lm_system_prompt as lm_system_prompt_consonancia
 from svaeva_redux.prompts.consonancia import vlm_system_prompt as vlm_system_prompt_consonancia
 from svaeva_redux.prompts.consonancia_retorno import lm_system_prompt as lm_system_prompt_consonancia_retorno
-from svaeva_redux.schemas.redis import ConversationModel, UserImageModel, UserModel
+from svaeva_redux.schemas.blobs import delete_unreferenced_blobs, list_blobs, put_blob
+from svaeva_redux.schemas.codec import delete_unreferenced_interned, interned_digests, list_interned
+from svaeva_redux.schemas.embeddings import (
+    embedding_key,
+    encode_embedding,
+    fold_embeddings,
+    read_embedding_state,
+    write_embedding,
+)
+from svaeva_redux.schemas.indexes import IndexProfile, apply_index_profile, index_memory, wait_for_indexing
+from svaeva_redux.schemas.redis import (
+    ConversationModel,
+    UserImageModel,
+    UserModel,
+    UserVideoModel,
+)
+from svaeva_redux.schemas.search import CONVERSATION_EMBEDDING_DIM, EMBEDDING_INDEX_NAME, create_embedding_index
+from svaeva_redux.shards import shard_router
+from svaeva_redux.utils import format_chat_history_as_text
 
 # Enable logging
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
@@ -17,132 +45,489 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 dotenv.load_dotenv(dotenv.find_dotenv())
 
+AVATAR_HISTORY_MAX_DEPTH = int(os.getenv("AVATAR_HISTORY_MAX_DEPTH", 10))
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", 500))
+SCHEMA_HASH_KEY = "svaeva_redux:seed:schema"
+PRESET_HASHES_KEY = "svaeva_redux:seed:conversations"
 
-def initialize_redis():
-    default_0 = {
-        "name": "default_0",
-        "chain_type": "chain_with_history",
-        "chat_history_length": 30,
-        "lm_system_prompt": "You are a helpful assistant.",
-        "vlm_system_prompt": "Tell me what this image is.",
-        "engine": "gpt-4",
-        "engine_type": "openai",
-        "temperature": 0.5,
-        "max_tokens": 150,
-        "model_token_limit": 8192,
-        "top_p": 1.0,
-        "frequency_penalty": 0.0,
-        "presence_penalty": 0.0,
-        "author": "master",
-    }
-
-    default_1 = {
-        "name": "default_1",
-        "chain_type": "chain_with_history",
-        "chat_history_length": 30,
-        "lm_system_prompt": "You are a helpful assistant.",
-        "vlm_system_prompt": "Tell me what this image isn't is.",
-        "engine": "gpt-4",
-        "engine_type": "openai",
-        "temperature": 0.5,
-        "max_tokens": 150,
-        "model_token_limit": 8192,
-        "top_p": 1.0,
-        "frequency_penalty": 0.0,
-        "presence_penalty": 0.0,
-        "author": "master",
-    }
-
-    consonancia = {
-        "name": "consonancia",
-        "chain_type": "chain_with_history",
-        "chat_history_length": 30,
-        "lm_system_prompt": lm_system_prompt_consonancia,
-        "vlm_system_prompt": vlm_system_prompt_consonancia,
-        "engine": "gpt-4",
-        "engine_type": "openai",
-        "temperature": 0.5,
-        "max_tokens": 150,
-        "model_token_limit": 8192,
-        "top_p": 1.0,
-        "frequency_penalty": 0.0,
-        "presence_penalty": 0.0,
-        "author": "master",
-    }
-
-    consonancia_retorno = {
-        "name": "consonancia-retorno",
-        "chain_type": "chain_with_history",
-        "chat_history_length": 30,
-        "lm_system_prompt": lm_system_prompt_consonancia_retorno,
-        "vlm_system_prompt": vlm_system_prompt_consonancia,
-        "engine": "gpt-4-turbo-preview",
-        "engine_type": "openai",
-        "temperature": 0.7,
-        "max_tokens": 150,
-        "model_token_limit": 8192,
-        "top_p": 1.0,
-        "frequency_penalty": 0.0,
-        "presence_penalty": 0.0,
-        "author": "master",
-    }
-    # Create a RediSearch index
+_DEFAULT_0 = {
+    "name": "default_0",
+    "chain_type": "chain_with_history",
+    "chat_history_length": 30,
+    "lm_system_prompt": "You are a helpful assistant.",
+    "vlm_system_prompt": "Tell me what this image is.",
+    "engine": "gpt-4",
+    "engine_type": "openai",
+    "temperature": 0.5,
+    "max_tokens": 150,
+    "model_token_limit": 8192,
+    "top_p": 1.0,
+    "frequency_penalty": 0.0,
+    "presence_penalty": 0.0,
+    "author": "master",
+}
+
+_DEFAULT_1 = {
+    "name": "default_1",
+    "chain_type": "chain_with_history",
+    "chat_history_length": 30,
+    "lm_system_prompt": "You are a helpful assistant.",
+    "vlm_system_prompt": "Tell me what this image isn't is.",
+    "engine": "gpt-4",
+    "engine_type": "openai",
+    "temperature": 0.5,
+    "max_tokens": 150,
+    "model_token_limit": 8192,
+    "top_p": 1.0,
+    "frequency_penalty": 0.0,
+    "presence_penalty": 0.0,
+    "author": "master",
+}
+
+_CONSONANCIA = {
+    "name": "consonancia",
+    "chain_type": "chain_with_history",
+    "chat_history_length": 30,
+    "lm_system_prompt": lm_system_prompt_consonancia,
+    "vlm_system_prompt": vlm_system_prompt_consonancia,
+    "engine": "gpt-4",
+    "engine_type": "openai",
+    "temperature": 0.5,
+    "max_tokens": 150,
+    "model_token_limit": 8192,
+    "top_p": 1.0,
+    "frequency_penalty": 0.0,
+    "presence_penalty": 0.0,
+    "author": "master",
+}
+
+_CONSONANCIA_RETORNO = {
+    "name": "consonancia-retorno",
+    "chain_type": "chain_with_history",
+    "chat_history_length": 30,
+    "lm_system_prompt": lm_system_prompt_consonancia_retorno,
+    "vlm_system_prompt": vlm_system_prompt_consonancia,
+    "engine": "gpt-4-turbo-preview",
+    "engine_type": "openai",
+    "temperature": 0.7,
+    "max_tokens": 150,
+    "model_token_limit": 8192,
+    "top_p": 1.0,
+    "frequency_penalty": 0.0,
+    "presence_penalty": 0.0,
+    "author": "master",
+}
+
+DEFAULT_CONVERSATIONS: List[Mapping[str, Any]] = [_DEFAULT_0, _DEFAULT_1, _CONSONANCIA, _CONSONANCIA_RETORNO]
+
+# Moves the current avatar into the (bounded) history and sets the new one, entirely on the server.
+# KEYS[1]: UserImageModel key
+# ARGV: new image blob digest (JSON), new prompt (JSON), max history depth, update timestamp
+# Returns 0 if the document does not exist yet, 1 otherwise.
+_PUSH_AVATAR_LUA = """
+local key = KEYS[1]
+if redis.call('EXISTS', key) == 0 then
+    return 0
+end
+local max_depth = tonumber(ARGV[3])
+local image = redis.call('JSON.GET', key, '.avatar_image_ref')
+local prompt = redis.call('JSON.GET', key, '.avatar_image_prompt')
+if image ~= 'null' and prompt ~= 'null' then
+    for _, field in ipairs({'.avatar_image_ref_history', '.avatar_image_prompt_history'}) do
+        if redis.call('JSON.TYPE', key, field) ~= 'array' then
+            redis.call('JSON.SET', key, field, '[]')
+        end
+    end
+    redis.call('JSON.ARRAPPEND', key, '.avatar_image_ref_history', image)
+    redis.call('JSON.ARRAPPEND', key, '.avatar_image_prompt_history', prompt)
+    for _, field in ipairs({'.avatar_image_ref_history', '.avatar_image_prompt_history'}) do
+        local length = redis.call('JSON.ARRLEN', key, field)
+        if max_depth <= 0 then
+            redis.call('JSON.SET', key, field, '[]')
+        elseif length > max_depth then
+            redis.call('JSON.ARRTRIM', key, field, length - max_depth, -1)
+        end
+    end
+end
+redis.call('JSON.SET', key, '.avatar_image_ref', ARGV[1])
+redis.call('JSON.SET', key, '.avatar_image_prompt', ARGV[2])
+redis.call('JSON.SET', key, '.date_updated_timestamp', ARGV[4])
+return 1
+"""
+_push_avatar_script = redis_connection.register_script(_PUSH_AVATAR_LUA)
+_async_push_avatar_script = async_redis_connection.register_script(_PUSH_AVATAR_LUA)
+
+# Stores a packed embedding in the user's embedding hash, tagged with the user's group and platform.
+# The incremental aggregate state is dropped: the embedding no longer summarizes the processed messages.
+# KEYS[1]: UserModel key, KEYS[2]: embedding key
+# ARGV: float32 embedding bytes, update timestamp
+# Returns 0 if the user does not exist, 1 otherwise.
+_SET_EMBEDDING_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+local tags = {}
+for _, field in ipairs({'group_id', 'platform_id'}) do
+    local value = cjson.decode(redis.call('JSON.GET', KEYS[1], '.' .. field))
+    if type(value) == 'string' then
+        table.insert(tags, field)
+        table.insert(tags, value)
+    end
+end
+redis.call('HSET', KEYS[2], 'vector', ARGV[1], unpack(tags))
+redis.call('HDEL', KEYS[2], 'weight', 'watermark')
+redis.call('JSON.SET', KEYS[1], '.date_updated_timestamp', ARGV[2])
+return 1
+"""
+_set_embedding_script = redis_connection.register_script(_SET_EMBEDDING_LUA)
+_async_set_embedding_script = async_redis_connection.register_script(_SET_EMBEDDING_LUA)
+
+# Stores an incrementally aggregated embedding, unless another update moved the watermark since it was read.
+# KEYS[1]: UserModel key, KEYS[2]: embedding key
+# ARGV: float32 embedding bytes, update timestamp, watermark read ('' for none), new watermark, new weight
+# Returns 0 if the user does not exist, -1 if the watermark changed, 1 otherwise.
+_FOLD_EMBEDDING_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+if (redis.call('HGET', KEYS[2], 'watermark') or '') ~= ARGV[3] then
+    return -1
+end
+local tags = {}
+for _, field in ipairs({'group_id', 'platform_id'}) do
+    local value = cjson.decode(redis.call('JSON.GET', KEYS[1], '.' .. field))
+    if type(value) == 'string' then
+        table.insert(tags, field)
+        table.insert(tags, value)
+    end
+end
+redis.call('HSET', KEYS[2], 'vector', ARGV[1], 'watermark', ARGV[4], 'weight', ARGV[5], unpack(tags))
+redis.call('JSON.SET', KEYS[1], '.date_updated_timestamp', ARGV[2])
+return 1
+"""
+_fold_embedding_script = redis_connection.register_script(_FOLD_EMBEDDING_LUA)
+
+# Sets fields of an existing user document in place, keeping the embedding search tags in sync.
+# KEYS[1]: UserModel key, KEYS[2]: embedding key
+# ARGV: update timestamp, 1 if group_id/platform_id change else 0, then field path / JSON value pairs
+# Returns 0 if the user does not exist, 1 otherwise.
+_UPDATE_USER_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for i = 3, #ARGV, 2 do
+    redis.call('JSON.SET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('JSON.SET', KEYS[1], '.date_updated_timestamp', ARGV[1])
+if ARGV[2] == '1' and redis.call('EXISTS', KEYS[2]) == 1 then
+    local group_id = cjson.decode(redis.call('JSON.GET', KEYS[1], '.group_id'))
+    local platform_id = cjson.decode(redis.call('JSON.GET', KEYS[1], '.platform_id'))
+    redis.call('HSET', KEYS[2], 'group_id', group_id, 'platform_id', platform_id)
+end
+return 1
+"""
+_update_user_script = redis_connection.register_script(_UPDATE_USER_LUA)
+
+
+def _on_user_shard(model: Any) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Run a helper whose first argument is a user id on the shard holding that ``model`` document.
+
+    The shard is the one selected by the caller (``shard_router.route(group_id)``), or else found by asking
+    every shard; see ``AsyncJsonModel.locate``.
+    """
+
+    def decorator(function: Callable[..., Any]) -> Callable[..., Any]:
+        if asyncio.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(user_id: str, *args: Any, **kwargs: Any) -> Any:
+                with use_shard(await model.async_locate(user_id)):
+                    return await function(user_id, *args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(user_id: str, *args: Any, **kwargs: Any) -> Any:
+            with use_shard(model.locate(user_id)):
+                return function(user_id, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _on_every_shard(function: Callable[..., int]) -> Callable[..., int]:
+    """Run a maintenance helper on every shard in parallel (unless one is selected), summing the counts."""
+
+    @functools.wraps(function)
+    def wrapper(*args: Any, **kwargs: Any) -> int:
+        if not shard_router.enabled or current_shard() is not None:
+            return function(*args, **kwargs)
+        return sum(shard_router.fan_out(lambda _: function(*args, **kwargs)).values())
+
+    return wrapper
+
+
+def preset_hash(preset: Mapping[str, Any]) -> str:
+    """Return the content hash of a conversation preset, as validated by ``ConversationModel``."""
+    model = ConversationModel(**preset)
+    return hashlib.sha256(model.json(exclude={"date_created_timestamp"}, sort_keys=True).encode()).hexdigest()
+
+
+def schema_hash() -> str:
+    """Return the hash of every RediSearch schema: the redis_om model indexes and the embedding index."""
+    from redis_om.model.model import model_registry
+
+    for cls in model_registry.values():
+        # redis_om drops the implicit pk field of models with a custom primary key on first instantiation,
+        # which changes their schema: resolve it up front so the hash (and the migrated index) is stable.
+        cls.validate_primary_key()
+    schemas = [f"{name}:{cls.redisearch_schema()}" for name, cls in sorted(model_registry.items())]
+    schemas.append(f"{EMBEDDING_INDEX_NAME}:{CONVERSATION_EMBEDDING_DIM}")
+    return hashlib.sha256("\n".join(schemas).encode()).hexdigest()
+
+
+def ensure_indexes(force: bool = False) -> bool:
+    """Create or migrate the search indexes, only if their schema changed since the last run.
+
+    Args:
+        force (bool): Run the migration even if the schema hash is unchanged.
+
+    Returns:
+        bool: True if the migration ran.
+    """
+    if shard_router.enabled and current_shard() is None:
+        # The configured server (conversations) and every shard (users) have their own indexes.
+        shards = shard_router.fan_out(lambda _: ensure_indexes(force))
+        return any([_ensure_indexes(force), *shards.values()])
+    return _ensure_indexes(force)
+
+
+def _ensure_indexes(force: bool) -> bool:
+    current = schema_hash()
+    stored = redis_connection.get(SCHEMA_HASH_KEY)
+    if not force and stored is not None and stored.decode() == current:
+        logger.info("Search indexes are up to date")
+        return False
     Migrator().run()
-    ConversationModel(**default_0).save()
-    ConversationModel(**default_1).save()
-    ConversationModel(**consonancia).save()
-    ConversationModel(**consonancia_retorno).save()
+    create_embedding_index(drop_existing=stored is not None or force)
+    redis_connection.set(SCHEMA_HASH_KEY, current)
+    return True
 
-    # Find All ConversationRedisModels
-    models = ConversationModel.find((ConversationModel.chain_type == "chain_with_history")).all()
-    models = sorted(models, key=lambda x: x.date_created_timestamp)
-    for model in models:
-        logger.info(f"Initialized ConversationModel: {model.name}")
 
+def migrate_indexes(profile: Union[str, IndexProfile, None] = None) -> Dict[str, Dict[str, Optional[float]]]:
+    """Rebuild the search indexes, with another index profile if given, and measure their memory.
 
-def update_user_avatar(user_id: str, image_bytes: bytes, image_prompt: str = ""):
-    # Update user avatars
-    try:
-        user = UserImageModel.get(user_id)
-    except Exception as e:
-        if isinstance(e, NotFoundError):
-            user = UserImageModel(id=user_id)
-            user.save()
+    Args:
+        profile (Union[str, IndexProfile, None]): Index profile to switch to, see ``apply_index_profile``.
+
+    Returns:
+        Dict[str, Dict[str, Optional[float]]]: Index name: ``{"before": MB, "after": MB}``, None for an index
+        that did not (or no longer does) exist.
+    """
+    before = index_memory(redis_connection)
+    if profile is not None:
+        apply_index_profile(profile)
+    ensure_indexes(force=True)
+    if not wait_for_indexing(redis_connection):
+        logger.warning("Indexing is still running, the memory after the migration is partial")
+    after = index_memory(redis_connection)
+    return {name: {"before": before.get(name), "after": after.get(name)} for name in {**before, **after}}
+
+
+def seed_conversations(presets: List[Mapping[str, Any]], force: bool = False) -> List[str]:
+    """Save the conversation presets that changed since they were last seeded, in a single pipeline.
+
+    Args:
+        presets (List[Mapping[str, Any]]): ``ConversationModel`` fields of each preset.
+        force (bool): Save every preset even if unchanged.
+
+    Returns:
+        List[str]: The names of the saved presets.
+    """
+    hashes = {preset["name"]: preset_hash(preset) for preset in presets}
+    if not hashes:
+        return []
+    # Presets deleted since they were seeded are saved again, whatever their recorded hash.
+    pipeline = redis_connection.pipeline(transaction=False)
+    pipeline.hmget(PRESET_HASHES_KEY, list(hashes))
+    for name in hashes:
+        pipeline.exists(ConversationModel.make_primary_key(name))
+    stored, *exists = pipeline.execute()
+    changed = [
+        preset
+        for preset, stored_hash, exist in zip(presets, stored, exists)
+        if force or not exist or stored_hash is None or stored_hash.decode() != hashes[preset["name"]]
+    ]
+    if not changed:
+        return []
+    pipeline = redis_connection.pipeline()
+    for preset in changed:
+        ConversationModel(**preset).save(pipeline=pipeline)
+    pipeline.hset(PRESET_HASHES_KEY, mapping={preset["name"]: hashes[preset["name"]] for preset in changed})
+    pipeline.execute()
+    return [preset["name"] for preset in changed]
+
+
+def load_presets(path: str) -> List[Dict[str, Any]]:
+    """Load conversation presets from a JSON or YAML file holding a list of ``ConversationModel`` fields."""
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError(
+                    "Could not import yaml python package. Please install it with `pip install pyyaml`."
+                )
+            presets = yaml.safe_load(f)
+        else:
+            presets = json.load(f)
+    if not isinstance(presets, list):
+        raise ValueError(f"{path} should hold a list of conversation presets")
+    return presets
+
+
+def initialize_redis(presets: Optional[List[Mapping[str, Any]]] = None, force: bool = False) -> List[str]:
+    """Create the search indexes and seed the conversation presets, skipping whatever is already up to date.
+
+    Args:
+        presets (Optional[List[Mapping[str, Any]]]): Conversation presets, ``DEFAULT_CONVERSATIONS`` by default.
+        force (bool): Rebuild the indexes and rewrite every preset.
+
+    Returns:
+        List[str]: The names of the saved presets.
+    """
+    ensure_indexes(force=force)
+    presets = DEFAULT_CONVERSATIONS if presets is None else presets
+    seeded = seed_conversations(presets, force=force)
+    for preset in presets:
+        status = "Initialized" if preset["name"] in seeded else "Unchanged"
+        logger.info(f"{status} ConversationModel: {preset['name']}")
+    if seeded:
+        # Rewritten presets may leave the previous version of their prompts unreferenced.
+        collect_interned_values()
+    return seeded
+
+
+def _user_group_id(user_id: str) -> Optional[str]:
+    """Return the ``group_id`` of user ``user_id``, read on the shard holding the user (None if unknown)."""
+    with use_shard(UserModel.locate(user_id)):
+        values = redis_connection.json().get(UserModel.make_primary_key(user_id), "$.group_id")
+    return values[0] if values else None
+
+
+async def _async_user_group_id(user_id: str) -> Optional[str]:
+    with use_shard(await UserModel.async_locate(user_id)):
+        values = await async_redis_connection.json().get(UserModel.make_primary_key(user_id), "$.group_id")
+    return values[0] if values else None
+
+
+@instrument("update_user_avatar")
+def update_user_avatar(
+    user_id: str,
+    image_bytes: bytes,
+    image_prompt: str = "",
+    max_history_depth: Optional[int] = None,
+    group_id: Optional[str] = None,
+) -> None:
+    """Update the avatar image for a user, keeping a bounded history on the server.
+
+    The image is written to the content-addressed blob store and the previous image reference and
+    prompt are moved into the history arrays by a server-side script using RedisJSON array commands,
+    so only the new image is sent over the wire and the history never grows past ``max_history_depth``
+    entries (oldest entries are dropped first). Both writes go out in a single pipeline.
+
+    With REDIS_SHARDS set, the blob, the history and the image document all go to the shard of the
+    user's group, read from the user document unless ``group_id`` is given.
+
+    Args:
+        user_id (str): The user ID.
+        image_bytes (bytes): The new avatar image.
+        image_prompt (str): The prompt used to generate the image.
+        max_history_depth (Optional[int]): Maximum history length, defaults to ``AVATAR_HISTORY_MAX_DEPTH``.
+        group_id (Optional[str]): The user's group ID, looked up when sharding is on and it is not given.
+
+    Returns:
+        None
+    """
+    if max_history_depth is None:
+        max_history_depth = AVATAR_HISTORY_MAX_DEPTH
     try:
-        if user.avatar_image_bytes is not None and user.avatar_image_prompt is not None:
-            user.avatar_image_bytes_history.append(user.avatar_image_bytes)
-            user.avatar_image_prompt_history.append(user.avatar_image_prompt)
-        user.avatar_image_bytes = image_bytes
-        user.avatar_image_prompt = image_prompt
-        user.save()
+        if group_id is None and shard_router.enabled:
+            group_id = _user_group_id(user_id)
+        with shard_router.route(group_id):
+            pipeline = redis_connection.pipeline(transaction=False)
+            record_payload(len(image_bytes))
+            digest = put_blob(pipeline, image_bytes)
+            _push_avatar_script(
+                keys=[UserImageModel.make_primary_key(user_id)],
+                args=[json.dumps(digest), json.dumps(image_prompt), max_history_depth, datetime.now().timestamp()],
+                client=pipeline,
+            )
+            updated = pipeline.execute()[-1]
+            if not updated:
+                UserImageModel(
+                    id=user_id, group_id=group_id, avatar_image_ref=digest, avatar_image_prompt=image_prompt
+                ).save()
         logger.info(f"Updated UserImageModel image id: {user_id}")
     except Exception as e:
+        record_error()
         logger.error(f"Failed to update user avatar: {e}")
 
 
-async def async_update_user_avatar(user_id: str, image_bytes: bytes, image_prompt: str = ""):
-    # Update user avatars
-    try:
-        user = UserImageModel.get(user_id)
-    except Exception as e:
-        if isinstance(e, NotFoundError):
-            user = UserImageModel(id=user_id)
-            user.save()
+@instrument("async_update_user_avatar")
+async def async_update_user_avatar(
+    user_id: str,
+    image_bytes: bytes,
+    image_prompt: str = "",
+    max_history_depth: Optional[int] = None,
+    group_id: Optional[str] = None,
+) -> None:
+    """Asyncio update the avatar image for a user, see ``update_user_avatar``.
+
+    Args:
+        user_id (str): The user ID.
+        image_bytes (bytes): The new avatar image.
+        image_prompt (str): The prompt used to generate the image.
+        max_history_depth (Optional[int]): Maximum history length, defaults to ``AVATAR_HISTORY_MAX_DEPTH``.
+        group_id (Optional[str]): The user's group ID, looked up when sharding is on and it is not given.
+
+    Returns:
+        None
+    """
+    if max_history_depth is None:
+        max_history_depth = AVATAR_HISTORY_MAX_DEPTH
     try:
-        user.avatar_image_bytes = image_bytes
-        user.avatar_image_prompt = image_prompt
-        if user.avatar_image_bytes is not None and user.avatar_image_prompt is not None:
-            user.avatar_image_bytes_history.append(image_bytes)
-            user.avatar_image_prompt_history.append(image_prompt)
-        user.save()
+        if group_id is None and shard_router.enabled:
+            group_id = await _async_user_group_id(user_id)
+        with shard_router.route(group_id):
+            pipeline = UserImageModel.async_db().pipeline(transaction=False)
+            record_payload(len(image_bytes))
+            digest = put_blob(pipeline, image_bytes)
+            await _async_push_avatar_script(
+                keys=[UserImageModel.make_primary_key(user_id)],
+                args=[json.dumps(digest), json.dumps(image_prompt), max_history_depth, datetime.now().timestamp()],
+                client=pipeline,
+            )
+            updated = (await pipeline.execute())[-1]
+            if not updated:
+                await UserImageModel(
+                    id=user_id, group_id=group_id, avatar_image_ref=digest, avatar_image_prompt=image_prompt
+                ).async_save()
         logger.info(f"Updated UserImageModel image id: {user_id}")
     except Exception as e:
+        record_error()
         logger.error(f"Failed to update user avatar: {e}")
 
 
-def update_user_conversation_embedding(user_id: str, embedding_array: np.ndarray) -> None:
+@instrument("update_user_conversation_embedding")
+@_on_user_shard(UserModel)
+def update_user_conversation_embedding(user_id: str, embedding_array: NDArray[Any]) -> None:
     """Update the conversation embedding for a user.
 
+    The embedding is written as packed float32 to the user's embedding hash in one round trip,
+    without loading or rewriting the user document.
+
     Args:
         user_id (str): The user ID.
         embedding_array (np.ndarray): The conversation embedding array.
@@ -152,15 +537,23 @@ def update_user_conversation_embedding(user_id: str, embedding_array: np.ndarray
     """
 
     try:
-        user = UserModel.get(user_id)
-        user.conversation_embedding = embedding_array
-        user.save()
+        data = encode_embedding(embedding_array)
+        record_payload(len(data))
+        updated = _set_embedding_script(
+            keys=[UserModel.make_primary_key(user_id), embedding_key(user_id)],
+            args=[data, datetime.now().timestamp()],
+        )
+        if not updated:
+            raise NotFoundError(f"UserModel {user_id} does not exist")
         logger.info(f"Updated UserModel embedding id: {user_id}")
     except Exception as e:
+        record_error()
         logger.error(f"Failed to update user conversation embedding: {e}")
 
 
-async def async_update_user_conversation_embedding(user_id: str, embedding_array: np.ndarray) -> None:
+@instrument("async_update_user_conversation_embedding")
+@_on_user_shard(UserModel)
+async def async_update_user_conversation_embedding(user_id: str, embedding_array: NDArray[Any]) -> None:
     """Asyncio update the conversation embedding for a user.
 
     Args:
@@ -171,9 +564,347 @@ async def async_update_user_conversation_embedding(user_id: str, embedding_array
         None
     """
     try:
-        user = UserModel.get(user_id)
-        user.conversation_embedding = embedding_array
-        user.save()
+        data = encode_embedding(embedding_array)
+        record_payload(len(data))
+        updated = await _async_set_embedding_script(
+            keys=[UserModel.make_primary_key(user_id), embedding_key(user_id)],
+            args=[data, datetime.now().timestamp()],
+            client=UserModel.async_db(),
+        )
+        if not updated:
+            raise NotFoundError(f"UserModel {user_id} does not exist")
         logger.info(f"Updated UserModel embedding id: {user_id}")
     except Exception as e:
-        logger.error(f"Failed to update user avatar: {e}")
+        record_error()
+        logger.error(f"Failed to update user conversation embedding: {e}")
+
+
+@instrument("update_user_conversation_embedding_incremental")
+@_on_user_shard(UserModel)
+def update_user_conversation_embedding_incremental(
+    user_id: str,
+    history: Any,
+    embed: Callable[[List[str]], NDArray[Any]],
+    decay: float = 1.0,
+    batch_size: int = 64,
+    max_attempts: int = 3,
+) -> int:
+    """Fold the messages added to a user's chat history since the last update into their conversation embedding.
+
+    The embedding is the running mean of per-message embeddings (see ``fold_embeddings``), stored with its
+    weight and a watermark counting the history messages already processed. Only the new messages are
+    embedded, so the cost of an update follows the messages since the previous one, not the history size.
+    The aggregate is rebuilt from the whole history the first time, after the history was cleared, and after
+    ``update_user_conversation_embedding`` replaced the embedding. Concurrent updates are detected by the
+    watermark and retried, so no message is folded twice.
+
+    Args:
+        user_id (str): The user ID.
+        history (Any): The user's ``RedisChatMessageHistoryWindowed``.
+        embed (Callable[[List[str]], np.ndarray]): Embeds a batch of texts, one row per text.
+        decay (float): Weight kept by older messages for each newer one, 1 for a plain mean.
+        batch_size (int): Messages per ``embed`` call.
+        max_attempts (int): Tries when other updates of the same user interleave.
+
+    Returns:
+        int: The number of messages embedded.
+    """
+    try:
+        for _ in range(max_attempts):
+            mean, weight, watermark = read_embedding_state(redis_connection, user_id)
+            length, messages = history.messages_since(watermark or 0)
+            if watermark is not None and length < watermark:
+                mean, weight = None, 0.0
+            if not messages:
+                return 0
+            texts = [format_chat_history_as_text([message]) for message in messages]
+            folded, weight = fold_embeddings(mean, weight, embed(texts[:batch_size]), decay)
+            for start in range(batch_size, len(texts), batch_size):
+                folded, weight = fold_embeddings(folded, weight, embed(texts[start : start + batch_size]), decay)
+            data = encode_embedding(folded)
+            record_payload(len(data))
+            updated = _fold_embedding_script(
+                keys=[UserModel.make_primary_key(user_id), embedding_key(user_id)],
+                args=[data, datetime.now().timestamp(), "" if watermark is None else watermark, length, weight],
+            )
+            if updated == 0:
+                raise NotFoundError(f"UserModel {user_id} does not exist")
+            if updated == 1:
+                logger.info(f"Folded {len(messages)} message(s) into UserModel embedding id: {user_id}")
+                return len(messages)
+        raise RuntimeError(f"UserModel {user_id} embedding kept changing during {max_attempts} attempts")
+    except Exception as e:
+        record_error()
+        logger.error(f"Failed to update user conversation embedding incrementally: {e}")
+        return 0
+
+
+@_on_every_shard
+def migrate_user_image_blobs() -> int:
+    """Move inline avatar bytes of existing UserImageModel documents into the blob store.
+
+    Returns:
+        int: The number of migrated documents.
+    """
+    migrated = 0
+    for pk in UserImageModel.all_pks():
+        document = UserImageModel.db().json().get(UserImageModel.make_primary_key(pk))
+        if not document or ("avatar_image_bytes" not in document and "avatar_image_bytes_history" not in document):
+            continue
+        UserImageModel(**document).save()
+        migrated += 1
+    logger.info(f"Migrated {migrated} UserImageModel documents to the blob store")
+    return migrated
+
+
+@_on_every_shard
+def collect_user_image_blobs() -> int:
+    """Delete avatar blobs that are no longer referenced by any UserImageModel.
+
+    The stored blobs are listed before the documents are read, and blobs written meanwhile are kept: an
+    avatar saved while the collection runs is never deleted.
+
+    Returns:
+        int: The number of deleted blobs.
+    """
+    candidates = list_blobs(redis_connection)
+    referenced = set()
+    for pk in UserImageModel.all_pks():
+        document = UserImageModel.db().json().get(UserImageModel.make_primary_key(pk))
+        if not document:
+            continue
+        if document.get("avatar_image_ref"):
+            referenced.add(document["avatar_image_ref"])
+        referenced.update(document.get("avatar_image_ref_history") or [])
+    deleted = delete_unreferenced_blobs(redis_connection, candidates, referenced)
+    logger.info(f"Deleted {deleted} unreferenced avatar blobs")
+    return deleted
+
+
+def collect_interned_values(batch_size: int = 500) -> int:
+    """Delete the interned field values (see ``FieldCodec``) that no document references anymore.
+
+    Interned values are shared by content hash, so a rewritten or deleted prompt leaves its value behind until
+    it is collected here. The stored values are listed before the documents are read, and values interned
+    meanwhile (new, or identical to an orphaned one) are kept: a save running meanwhile never loses its value.
+
+    Args:
+        batch_size (int): Number of documents read per round trip.
+
+    Returns:
+        int: The number of deleted values.
+    """
+    from redis_om.model.model import model_registry
+
+    candidates = list_interned(redis_connection, batch_size)
+    referenced = set()
+    for model in model_registry.values():
+        if not getattr(model, "codec_fields", ()):
+            continue
+        keys = [model.make_primary_key(pk) for pk in model.all_pks()]
+        for start in range(0, len(keys), batch_size):
+            for document in redis_connection.json().mget(keys[start : start + batch_size], "."):
+                if document is not None:
+                    referenced.update(interned_digests(document, model.codec_fields))
+    deleted = delete_unreferenced_interned(redis_connection, candidates, referenced, batch_size)
+    logger.info(f"Deleted {deleted} unreferenced interned values")
+    return deleted
+
+
+@_on_every_shard
+def migrate_conversation_embeddings(batch_size: int = 500) -> int:
+    """Move JSON float lists of existing UserModel documents into packed float32 embedding hashes.
+
+    Args:
+        batch_size (int): Number of users read and written per pipeline.
+
+    Returns:
+        int: The number of migrated users.
+    """
+    paths = ("$.conversation_embedding", "$.group_id", "$.platform_id")
+    migrated = 0
+    bytes_before = bytes_after = 0
+    pks = list(UserModel.all_pks())
+    for start in range(0, len(pks), batch_size):
+        batch = pks[start : start + batch_size]
+        pipeline = redis_connection.pipeline(transaction=False)
+        for pk in batch:
+            pipeline.json().get(UserModel.make_primary_key(pk), *paths)
+        documents = pipeline.execute()
+        pipeline = redis_connection.pipeline(transaction=False)
+        for pk, values in zip(batch, documents):
+            embedding = (values or {}).get(paths[0])
+            if not embedding:
+                continue
+            if embedding[0]:
+                group_id, platform_id = values[paths[1]], values[paths[2]]
+                write_embedding(
+                    pipeline,
+                    pk,
+                    embedding[0],
+                    group_id[0] if group_id else None,
+                    platform_id[0] if platform_id else None,
+                )
+                bytes_before += len(json.dumps(embedding[0]))
+                bytes_after += len(encode_embedding(embedding[0]))
+                migrated += 1
+            pipeline.json().delete(UserModel.make_primary_key(pk), paths[0])
+        pipeline.execute()
+    logger.info(f"Migrated {migrated} conversation embeddings ({bytes_before} JSON bytes -> {bytes_after} bytes)")
+    return migrated
+
+
+@instrument("rebalance_shards")
+def rebalance_shards(batch_size: int = 500) -> Dict[str, int]:
+    """Move the sharded documents to the shard owning their group, after shards were added or removed.
+
+    Every shard is scanned in parallel. Only documents whose owner changed move, about ``1 / n`` of them
+    when an ``n``-th shard is added, together with the keys stored alongside them (see ``shard_keys``).
+
+    Args:
+        batch_size (int): Number of documents read per round trip.
+
+    Returns:
+        Dict[str, int]: The number of documents moved off each shard.
+    """
+    if not shard_router.enabled:
+        return {}
+
+    def rebalance(shard: str) -> int:
+        moved = 0
+        for model in (UserModel, UserImageModel, UserVideoModel):
+            pks = list(model.all_pks())
+            for start in range(0, len(pks), batch_size):
+                batch = pks[start : start + batch_size]
+                pipeline = redis_connection.pipeline(transaction=False)
+                for pk in batch:
+                    pipeline.json().get(model.make_primary_key(pk), f"$.{model.shard_field}")
+                for pk, value in zip(batch, pipeline.execute()):
+                    if value is None:  # Deleted since the scan.
+                        continue
+                    owner = shard_router.shard_for(value[0] if value else None)
+                    if owner is None:  # Sharding was turned off since the scan started.
+                        continue
+                    if owner != shard:
+                        model.move_to_shard(pk, shard, owner)
+                        moved += 1
+        return moved
+
+    moved = shard_router.fan_out(rebalance)
+    logger.info(f"Moved {sum(moved.values())} documents between shards")
+    return moved
+
+
+def _run_chunks(
+    pending: List[Tuple[str, Any]], chunk_size: int, queue: Callable[[Any, str, Any], None]
+) -> Dict[str, Optional[str]]:
+    results: Dict[str, Optional[str]] = {}
+    for start in range(0, len(pending), chunk_size):
+        chunk = []
+        pipeline = redis_connection.pipeline(transaction=False)
+        for user_id, value in pending[start : start + chunk_size]:
+            try:
+                queue(pipeline, user_id, value)
+                chunk.append(user_id)
+            except Exception as e:
+                results[user_id] = str(e)
+        for user_id, response in zip(chunk, pipeline.execute(raise_on_error=False)):
+            if isinstance(response, Exception):
+                results[user_id] = str(response)
+            elif not response:
+                results[user_id] = f"UserModel {user_id} does not exist"
+            else:
+                results[user_id] = None
+    return results
+
+
+def _run_batch(
+    items: Mapping[str, Any], chunk_size: int, queue: Callable[[Any, str, Any], None]
+) -> Dict[str, Optional[str]]:
+    """Queue one scripted update per item on pipelines of ``chunk_size`` commands.
+
+    Returns:
+        Dict[str, Optional[str]]: Per item, None on success or the reason it failed.
+    """
+    results: Dict[str, Optional[str]] = {}
+    pending = list(items.items())
+    if shard_router.enabled and current_shard() is None:
+        # Each shard updates the users it holds, in parallel; the ones no shard holds do not exist.
+        positions = shard_router.partition([UserModel.make_primary_key(user_id) for user_id, _ in pending])
+        for i in positions.pop(None, []):
+            results[pending[i][0]] = f"UserModel {pending[i][0]} does not exist"
+        shards = shard_router.fan_out(
+            lambda shard: _run_chunks([pending[i] for i in positions[shard]], chunk_size, queue), positions
+        )
+        for shard_results in shards.values():
+            results.update(shard_results)
+    else:
+        results.update(_run_chunks(pending, chunk_size, queue))
+    failed = sum(error is not None for error in results.values())
+    if failed:
+        record_error()
+    logger.info(f"Batch updated {len(results) - failed} users, {failed} failed")
+    return results
+
+
+@instrument("batch_update_user_conversation_embeddings")
+def batch_update_user_conversation_embeddings(
+    embeddings: Mapping[str, NDArray[Any]], chunk_size: int = BATCH_CHUNK_SIZE
+) -> Dict[str, Optional[str]]:
+    """Update the conversation embeddings of many users through pipelines.
+
+    Args:
+        embeddings (Mapping[str, np.ndarray]): Embedding by user ID.
+        chunk_size (int): Number of users per pipeline round trip.
+
+    Returns:
+        Dict[str, Optional[str]]: Per user, None on success or the reason the update failed.
+    """
+    now = datetime.now().timestamp()
+
+    def queue(pipeline, user_id, embedding_array):
+        data = encode_embedding(embedding_array)
+        record_payload(len(data))
+        _set_embedding_script(
+            keys=[UserModel.make_primary_key(user_id), embedding_key(user_id)],
+            args=[data, now],
+            client=pipeline,
+        )
+
+    return _run_batch(embeddings, chunk_size, queue)
+
+
+@instrument("batch_update_users")
+def batch_update_users(
+    updates: Mapping[str, Mapping[str, Any]], chunk_size: int = BATCH_CHUNK_SIZE
+) -> Dict[str, Optional[str]]:
+    """Set fields of many users in place through pipelines, without loading or rewriting their documents.
+
+    Values are validated against the UserModel field definitions before anything is sent.
+
+    Args:
+        updates (Mapping[str, Mapping[str, Any]]): Field values by user ID, e.g. ``{"id": {"flagged": True}}``.
+        chunk_size (int): Number of users per pipeline round trip.
+
+    Returns:
+        Dict[str, Optional[str]]: Per user, None on success or the reason the update failed.
+    """
+    now = datetime.now().timestamp()
+
+    def queue(pipeline: Any, user_id: str, fields: Mapping[str, Any]) -> None:
+        args: List[Union[float, str]] = [now, int(bool({"group_id", "platform_id"} & set(fields)))]
+        for name, value in fields.items():
+            field = UserModel.__fields__.get(name)
+            if field is None or name in ("id", "pk"):
+                raise ValueError(f"Cannot update UserModel field {name}")
+            if name == UserModel.shard_field and shard_router.enabled:
+                raise ValueError(f"Cannot update UserModel field {name} in place with sharding, save the user")
+            value, error = field.validate(value, {}, loc=name, cls=UserModel)
+            if error is not None:
+                raise ValueError(f"Invalid value for {name}: {error.exc}")
+            args += [f".{name}", json.dumps(jsonable_encoder(value))]
+        _update_user_script(
+            keys=[UserModel.make_primary_key(user_id), embedding_key(user_id)], args=args, client=pipeline
+        )
+
+    return _run_batch(updates, chunk_size, queue)
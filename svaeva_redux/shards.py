@@ -0,0 +1,193 @@
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from svaeva_redux.connection import async_redis_connection, redis_connection, redis_settings, use_shard
+from svaeva_redux.metrics import instrument
+
+T = TypeVar("T")
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing of keys onto nodes.
+
+    Each node owns ``replicas`` points of the ring, so keys spread evenly and adding a node to ``n`` only
+    moves about ``1 / (n + 1)`` of them, all to the new node.
+    """
+
+    def __init__(self, nodes: Iterable[str], replicas: int = 128):
+        points = sorted((_hash(f"{node}#{replica}"), node) for node in nodes for replica in range(replicas))
+        if not points:
+            raise ValueError("A hash ring needs at least one node")
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node(self, key: str) -> str:
+        """Return the node owning ``key``."""
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+@lru_cache(maxsize=16)
+def hash_ring(nodes: Tuple[str, ...], replicas: int = 128) -> HashRing:
+    """Return the (cached) ring of ``nodes``."""
+    return HashRing(nodes, replicas)
+
+
+class ShardRouter:
+    """Routes users (by ``group_id``) and chat histories (by ``session_id``) to the shards in REDIS_SHARDS.
+
+    Shards are named Redis servers, configured as ``name=url,name=url`` in REDIS_SHARDS or with
+    ``configure_redis(shards={name: url})``. Names, not URLs, are hashed: a shard can move to another
+    server without moving its keys. Without shards everything stays on the configured server, which keeps
+    the unsharded data (conversation presets, metrics, seeding state) in any case.
+
+    ``route`` and ``use_shard`` select a shard for ``redis_connection`` and the models in a block; queries
+    that are not limited to a group ``fan_out`` to every shard in parallel and merge the results.
+    """
+
+    def __init__(self, replicas: int = 128):
+        self.replicas = replicas
+
+    @property
+    def shards(self) -> List[str]:
+        return list(redis_settings().get("shards") or {})
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.shards)
+
+    def ring(self) -> HashRing:
+        return hash_ring(tuple(sorted(self.shards)), self.replicas)
+
+    def shard_for(self, key: Optional[str]) -> Optional[str]:
+        """Return the shard owning ``key`` (a group or session id), None when sharding is off."""
+        if not self.enabled:
+            return None
+        return self.ring().node("" if key is None else str(key))
+
+    @contextlib.contextmanager
+    def route(self, key: Optional[str]) -> Iterator[None]:
+        """Send the commands of the block to the shard owning ``key``, see ``use_shard``."""
+        if not self.enabled:
+            yield
+            return
+        with use_shard(self.shard_for(key)):
+            yield
+
+    def fan_out(self, fn: Callable[[str], T], shards: Optional[Iterable[str]] = None) -> Dict[str, T]:
+        """Call ``fn(shard)`` on every shard (or ``shards``) in parallel threads, each routed to its shard.
+
+        Returns:
+            Dict[str, T]: The result of each shard. Exceptions are raised once every call finished.
+        """
+        shards = list(self.shards if shards is None else shards)
+
+        def call(shard: str) -> T:
+            with use_shard(shard):
+                return fn(shard)
+
+        if len(shards) <= 1:
+            return {shard: call(shard) for shard in shards}
+        with ThreadPoolExecutor(len(shards), thread_name_prefix="shard") as executor:
+            futures = {shard: executor.submit(contextvars.copy_context().run, call, shard) for shard in shards}
+        return {shard: future.result() for shard, future in futures.items()}
+
+    async def async_fan_out(
+        self, fn: Callable[[str], Awaitable[T]], shards: Optional[Iterable[str]] = None
+    ) -> Dict[str, T]:
+        """Await ``fn(shard)`` on every shard (or ``shards``) concurrently, each routed to its shard."""
+        shards = list(self.shards if shards is None else shards)
+
+        async def call(shard: str) -> T:
+            with use_shard(shard):
+                return await fn(shard)
+
+        return dict(zip(shards, await asyncio.gather(*(call(shard) for shard in shards))))
+
+    @instrument("shards.locate")
+    def locate(self, key: str) -> Optional[str]:
+        """Return the shard holding the Redis key ``key``, None if no shard does.
+
+        Costs one EXISTS per shard, in parallel: lookups by id that know the group should use ``route``.
+        """
+        found = self.fan_out(lambda _: redis_connection.exists(key))
+        return next((shard for shard, exists in found.items() if exists), None)
+
+    async def async_locate(self, key: str) -> Optional[str]:
+        found = await self.async_fan_out(lambda _: async_redis_connection.exists(key))
+        return next((shard for shard, exists in found.items() if exists), None)
+
+    @instrument("shards.partition")
+    def partition(self, keys: Sequence[str]) -> Dict[Optional[str], List[int]]:
+        """Group the positions of ``keys`` by the shard holding them (None for the keys no shard holds).
+
+        Costs one pipelined EXISTS per key on every shard, in parallel.
+        """
+
+        def exists(_: str) -> List[Any]:
+            pipeline = redis_connection.pipeline(transaction=False)
+            for key in keys:
+                pipeline.exists(key)
+            counts: List[Any] = pipeline.execute()
+            return counts
+
+        found = self.fan_out(exists)
+        positions: Dict[Optional[str], List[int]] = {}
+        for i in range(len(keys)):
+            shard = next((shard for shard, results in found.items() if results[i]), None)
+            positions.setdefault(shard, []).append(i)
+        return positions
+
+
+@instrument("shards.move_keys")
+def move_keys(source: Any, target: Any, moved: Sequence[str], copied: Sequence[str] = ()) -> int:
+    """Move keys (and copy shared ones, such as content-addressed blobs) between two Redis servers.
+
+    Keys are copied with DUMP/RESTORE, keeping their type and TTL, before the moved ones are deleted from
+    ``source``: an interruption leaves a key on both servers, never on neither. Keys already on ``target``
+    were written there since it became their shard, so they are newer and kept.
+
+    Args:
+        source (Any): Redis client holding the keys.
+        target (Any): Redis client receiving them.
+        moved (Sequence[str]): Keys to move, missing ones are skipped.
+        copied (Sequence[str]): Keys to copy, left on ``source``.
+
+    Returns:
+        int: The number of keys copied to ``target``.
+    """
+    keys = list(dict.fromkeys([*moved, *copied]))
+    if not keys:
+        return 0
+    pipeline = source.pipeline(transaction=False)
+    for key in keys:
+        pipeline.dump(key)
+        pipeline.pttl(key)
+    results = pipeline.execute()
+    pipeline = target.pipeline(transaction=False)
+    restored = [key for key, data in zip(keys, results[::2]) if data is not None]
+    for key, data, ttl in zip(keys, results[::2], results[1::2]):
+        if data is not None:
+            pipeline.restore(key, max(ttl, 0), data)
+    written = 0
+    for key, result in zip(restored, pipeline.execute(raise_on_error=False)):
+        if not isinstance(result, Exception):
+            written += 1
+        elif "BUSYKEY" not in str(result):
+            raise result
+    if moved:
+        source.delete(*moved)
+    return written
+
+
+shard_router = ShardRouter()
@@ -1,5 +1,64 @@
+from typing import Any, Dict, Iterable, List, Mapping, Optional
+
+from langchain_core.messages import BaseMessage, ChatMessage
+
+from svaeva_redux.langchain.redis import RedisChatMessageHistoryWindowed, fetch_messages
+
+_SPEAKERS = {"human": "Human", "ai": "AI", "system": "System", "function": "Function", "tool": "Tool"}
+
+
+def format_chat_history_as_text(messages: Iterable[BaseMessage]) -> str:
+    """
+    Format messages as a transcript, one ``Speaker: content`` line per message
+
+    Args:
+        messages (Iterable[BaseMessage]): The messages, oldest first.
+
+    Returns:
+        str: The transcript.
+    """
+    lines = []
+    for message in messages:
+        if isinstance(message, ChatMessage):
+            speaker = message.role
+        else:
+            speaker = _SPEAKERS.get(message.type, message.type.capitalize())
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        lines.append(f"{speaker}: {content}\n")
+    return "".join(lines)
+
+
+def _windowed_history(
+    session_id: str,
+    url: str,
+    key_prefix: str,
+    chat_history_length: int,
+    max_token_budget: Optional[int],
+    shard_urls: Optional[Mapping[str, str]],
+    conversation: Optional[Any],
+) -> RedisChatMessageHistoryWindowed:
+    if conversation is not None:
+        return RedisChatMessageHistoryWindowed.from_conversation(
+            session_id, conversation, url=url, key_prefix=key_prefix, shard_urls=shard_urls
+        )
+    return RedisChatMessageHistoryWindowed(
+        session_id=session_id,
+        url=url,
+        key_prefix=key_prefix,
+        chat_history_length=chat_history_length,
+        max_token_budget=max_token_budget,
+        shard_urls=shard_urls,
+    )
+
+
 def retrieve_redis_windowed_chat_history_as_text(
-    session_id: str, url: str, key_prefix: str, chat_history_length: int = 30
+    session_id: str,
+    url: str,
+    key_prefix: str,
+    chat_history_length: int = 30,
+    max_token_budget: Optional[int] = None,
+    shard_urls: Optional[Mapping[str, str]] = None,
+    conversation: Optional[Any] = None,
 ) -> str:
     """
     Retrieve the chat history from Redis and return it as a string formatted for ingestion
@@ -9,22 +68,53 @@ def retrieve_redis_windowed_chat_history_as_text(
         url (str): The url of the Redis server.
         key_prefix (str): The key prefix for the chat history.
         chat_history_length (int): The length of the chat history.
+        max_token_budget (Optional[int]): Only keep the latest messages fitting in this many tokens, see
+            ``svaeva_redux.langchain.tokens.conversation_token_budget``.
+        shard_urls (Optional[Mapping[str, str]]): Shards of the chat histories, ``{name: url}``, instead of ``url``.
+        conversation (Optional[Any]): ``ConversationModel`` whose ``chat_history_length`` and token budget (see
+            ``RedisChatMessageHistoryWindowed.from_conversation``) replace ``chat_history_length`` and
+            ``max_token_budget``.
 
     Returns:
         str: The chat history as a string.
     """
 
-    history = RedisChatMessageHistoryWindowed(
-        session_id=session_id,
-        url=url,
-        key_prefix=key_prefix,
-        chat_history_length=chat_history_length,
+    history = _windowed_history(
+        session_id, url, key_prefix, chat_history_length, max_token_budget, shard_urls, conversation
     )
-    conversation = ""
-    for message in history.messages:
-        if message.type == "human":
-            text = "Human: " + message.content
-        elif message.type == "ai":
-            text = "AI: " + message.content
-        conversation += text + "\n"
-    return conversation
+    return format_chat_history_as_text(history.messages)
+
+
+def retrieve_redis_windowed_chat_histories_as_text(
+    session_ids: List[str],
+    url: str,
+    key_prefix: str,
+    chat_history_length: int = 30,
+    max_token_budget: Optional[int] = None,
+    shard_urls: Optional[Mapping[str, str]] = None,
+    conversation: Optional[Any] = None,
+) -> Dict[str, str]:
+    """
+    Retrieve the chat histories of several sessions in a single pipelined fetch and format each as text
+
+    Args:
+        session_ids (List[str]): The session ids.
+        url (str): The url of the Redis server.
+        key_prefix (str): The key prefix for the chat histories.
+        chat_history_length (int): The length of each chat history.
+        max_token_budget (Optional[int]): Only keep the latest messages of each history fitting in this many tokens.
+        shard_urls (Optional[Mapping[str, str]]): Shards of the chat histories, ``{name: url}``, instead of ``url``.
+        conversation (Optional[Any]): ``ConversationModel`` whose limits replace ``chat_history_length`` and
+            ``max_token_budget``, see ``retrieve_redis_windowed_chat_history_as_text``.
+
+    Returns:
+        Dict[str, str]: The chat history of each session as a string.
+    """
+    histories = [
+        _windowed_history(session_id, url, key_prefix, chat_history_length, max_token_budget, shard_urls, conversation)
+        for session_id in session_ids
+    ]
+    return {
+        session_id: format_chat_history_as_text(messages)
+        for session_id, messages in zip(session_ids, fetch_messages(histories))
+    }
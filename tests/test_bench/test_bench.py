@@ -0,0 +1,49 @@
+"""Tests for the benchmark suite."""
+import json
+
+import pytest
+
+from svaeva_redux import connection
+from svaeva_redux.bench import run_benchmarks
+
+
+def test_run_benchmarks():
+    report = run_benchmarks(
+        "configured", iterations=2, names=["user_model", "update_user_conversation_embedding"], allow_writes=True
+    )
+    assert report["errors"] == {}
+    assert [result["name"] for result in report["results"]] == [
+        "user_model.save",
+        "user_model.get",
+        "update_user_conversation_embedding",
+    ]
+    assert all(result["iterations"] == 2 and result["p95_us"] > 0 for result in report["results"])
+    json.dumps(report)
+
+
+def test_run_benchmarks_in_process_fake():
+    pytest.importorskip("fakeredis")
+    settings = connection.redis_settings()
+    report = run_benchmarks(target="fake", iterations=2, names=["user_model"])
+    assert report["target"].startswith("fake")
+    assert len(report["results"]) == 2
+    assert connection.redis_settings() == settings
+
+
+def test_fake_target_ignores_configured_server(monkeypatch):
+    pytest.importorskip("fakeredis")
+    monkeypatch.setenv("REDIS_UNIX_SOCKET", "/nonexistent/redis.sock")
+    monkeypatch.setenv("REDIS_SHARDS", "a=redis://127.0.0.1:1/0,b=redis://127.0.0.1:2/0")
+    report = run_benchmarks(target="fake", iterations=2, names=["user_model", "update_user_avatar"])
+    assert report["errors"] == {}
+    assert len(report["results"]) == 5
+
+
+def test_configured_target_needs_allow_writes():
+    with pytest.raises(ValueError):
+        run_benchmarks("configured", iterations=1, names=["initialize_redis"])
+
+
+def test_unknown_benchmark():
+    with pytest.raises(ValueError):
+        run_benchmarks(names=["nope"])
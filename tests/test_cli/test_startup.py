@@ -0,0 +1,45 @@
+"""Tests for the CLI startup cost."""
+import os
+import re
+import subprocess
+import sys
+
+# Cumulative import time of svaeva_redux.__main__, in microseconds. Most of it is typer and rich.
+IMPORT_TIME_BUDGET_US = 1_000_000
+
+ENV_WITHOUT_REDIS = {key: value for key, value in os.environ.items() if not key.startswith("REDIS_")}
+
+
+def run_python(*args):
+    return subprocess.run(
+        [sys.executable, *args], capture_output=True, text=True, check=True, env=ENV_WITHOUT_REDIS
+    )
+
+
+def test_import_time_budget():
+    """Benchmark: ``python -X importtime`` of the CLI entry point."""
+    result = run_python("-X", "importtime", "-c", "import svaeva_redux.__main__")
+    cumulative = {
+        match.group(2): int(match.group(1))
+        for match in re.finditer(r"import time:\s+\d+ \|\s+(\d+) \|\s*(\S+)", result.stderr)
+    }
+    assert cumulative["svaeva_redux.__main__"] < IMPORT_TIME_BUDGET_US
+    assert not {"numpy", "redis_om", "redis"} & cumulative.keys()
+
+
+def test_version_without_redis_settings():
+    result = run_python("-m", "svaeva_redux", "version")
+    assert "svaeva-redux" in result.stdout
+
+
+def test_lazy_connection():
+    """Importing the models neither needs the REDIS_* variables nor creates a client."""
+    result = run_python(
+        "-c",
+        "from svaeva_redux.schemas.redis import UserModel, redis_connection; "
+        "from svaeva_redux.connection import configure_redis; "
+        "assert not redis_connection._clients; "
+        "configure_redis(host='redis.internal', port=6380); "
+        "print(UserModel.db().connection_pool.connection_kwargs['host'])",
+    )
+    assert result.stdout.strip() == "redis.internal"
@@ -0,0 +1,43 @@
+"""Tests for the shared Redis connection management."""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import redis
+
+from svaeva_redux.connection import create_client, get_shared_client, redis_connection
+from svaeva_redux.langchain.redis import get_shared_client as get_history_client
+
+
+def test_bounded_pool_under_burst():
+    client = create_client(max_connections=4, pool_timeout=5)
+    pool = client.connection_pool
+    assert isinstance(pool, redis.BlockingConnectionPool)
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        assert all(executor.map(lambda _: client.ping(), range(200)))
+    assert len(pool._connections) <= 4
+
+
+def test_retry_with_backoff():
+    client = create_client(host="127.0.0.1", port=1, retries=2, backoff_base=0.05, backoff_cap=1.0)
+    start = time.perf_counter()
+    with pytest.raises(redis.exceptions.ConnectionError):
+        client.ping()
+    # Two retries, after 0.1s and 0.2s.
+    assert time.perf_counter() - start >= 0.3
+
+
+def test_unix_socket_settings():
+    pool = create_client(unix_socket_path="/tmp/redis.sock", db=2).connection_pool
+    assert pool.connection_class is redis.UnixDomainSocketConnection
+    assert pool.connection_kwargs["path"] == "/tmp/redis.sock"
+    assert "socket_keepalive" not in pool.connection_kwargs
+    pool = create_client(url="unix:///tmp/redis.sock?db=3").connection_pool
+    assert pool.connection_class is redis.UnixDomainSocketConnection
+    assert pool.connection_kwargs["db"] == 3
+
+
+def test_shared_clients():
+    url = "redis://{host}:{port}/{db}".format(**redis_connection.connection_pool.connection_kwargs)
+    assert get_shared_client(url) is get_history_client(url)
+    assert isinstance(get_shared_client(url).connection_pool, redis.BlockingConnectionPool)
@@ -0,0 +1,157 @@
+"""Tests for the windowed Redis chat history."""
+import json
+import os
+from types import SimpleNamespace
+
+from langchain_core.messages import AIMessage, ChatMessage, HumanMessage, SystemMessage, message_to_dict
+
+from svaeva_redux.langchain.redis import (
+    MessageWindowCache,
+    RedisChatMessageHistoryWindowed,
+    fetch_messages,
+    get_shared_client,
+)
+from svaeva_redux.langchain.tokens import (
+    MESSAGE_TOKEN_OVERHEAD,
+    approximate_token_count,
+    conversation_token_budget,
+    count_message_tokens,
+)
+from svaeva_redux.utils import (
+    format_chat_history_as_text,
+    retrieve_redis_windowed_chat_histories_as_text,
+    retrieve_redis_windowed_chat_history_as_text,
+)
+
+URL = f"redis://{os.getenv('REDIS_HOST')}:{os.getenv('REDIS_PORT')}/{os.getenv('REDIS_DB_INDEX')}"
+
+
+def test_messages_window():
+    history = RedisChatMessageHistoryWindowed("window-session", url=URL, chat_history_length=3)
+    history.clear()
+    for i in range(5):
+        history.add_message(HumanMessage(content=f"human {i}"))
+        history.add_message(AIMessage(content=f"ai {i}"))
+    assert [m.content for m in history.messages] == ["ai 3", "human 4", "ai 4"]
+
+
+def test_messages_window_cache():
+    cache = MessageWindowCache()
+    history = RedisChatMessageHistoryWindowed("cached-session", url=URL, chat_history_length=3, cache=cache)
+    history.clear()
+    assert history.messages == []
+    history.add_message(HumanMessage(content="human 0"))
+    assert [m.content for m in history.messages] == ["human 0"]
+
+    first = history.messages
+    assert history.messages[0] is first[0]
+
+    writer = RedisChatMessageHistoryWindowed("cached-session", url=URL)
+    for i in range(1, 4):
+        writer.add_message(AIMessage(content=f"ai {i}"))
+    window = history.messages
+    assert [m.content for m in window] == ["ai 1", "ai 2", "ai 3"]
+
+    history.chat_history_length = 2
+    assert [m.content for m in history.messages] == ["ai 2", "ai 3"]
+    history.clear()
+    assert history.messages == []
+
+
+def test_messages_token_budget():
+    history = RedisChatMessageHistoryWindowed("budget-session", url=URL, chat_history_length=10)
+    history.clear()
+    history.add_message(HumanMessage(content="word " * 40))
+    history.add_message(AIMessage(content="short"))
+    history.add_message(HumanMessage(content="also short"))
+    counts = [json.loads(item)["token_count"] for item in history.redis_client.lrange(history.key, 0, -1)]
+    assert counts == [7, 6, 44]
+
+    history.max_token_budget = 13
+    assert [m.content for m in history.messages] == ["short", "also short"]
+    history.max_token_budget = 12
+    assert [m.content for m in history.messages] == ["also short"]
+
+    # Messages stored without a count (written by another history class) are counted on read.
+    history.redis_client.rpush(history.key, json.dumps(message_to_dict(HumanMessage(content="legacy"))))
+    history.max_token_budget = None
+    assert [m.content for m in history.messages][0] == "legacy"
+    history.clear()
+
+
+def test_token_budget_reads_beyond_chat_history_length():
+    writer = RedisChatMessageHistoryWindowed("staged-session", url=URL)
+    writer.clear()
+    for i in range(7):
+        writer.add_message(HumanMessage(content=f"m{i}"))
+    tokens = count_message_tokens(HumanMessage(content="m0"))
+    for cache in (None, MessageWindowCache()):
+        history = RedisChatMessageHistoryWindowed(
+            "staged-session", url=URL, chat_history_length=2, cache=cache, max_token_budget=5 * tokens
+        )
+        assert [m.content for m in history.messages] == ["m2", "m3", "m4", "m5", "m6"]
+        history.max_token_budget = 100 * tokens
+        assert len(history.messages) == 7
+        assert len(fetch_messages([history])[0]) == 7
+
+    conversation = SimpleNamespace(
+        model_token_limit=6 * tokens, max_tokens=tokens, lm_system_prompt="", chat_history_length=1
+    )
+    history = RedisChatMessageHistoryWindowed.from_conversation("staged-session", conversation, url=URL)
+    assert history.max_token_budget == conversation_token_budget(conversation)
+    assert [m.content for m in history.messages] == ["m3", "m4", "m5", "m6"]
+    text = retrieve_redis_windowed_chat_history_as_text(
+        "staged-session", URL, history.key_prefix, conversation=conversation
+    )
+    assert text == format_chat_history_as_text(history.messages)
+    writer.clear()
+
+
+def test_conversation_token_budget():
+    conversation = SimpleNamespace(model_token_limit=4096, max_tokens=512, lm_system_prompt="You are helpful.")
+    assert approximate_token_count("You are helpful.") == 5
+    assert conversation_token_budget(conversation) == 4096 - 512 - 5 - MESSAGE_TOKEN_OVERHEAD
+    assert conversation_token_budget(conversation, token_counter=len) == 4096 - 512 - 16 - MESSAGE_TOKEN_OVERHEAD
+    assert count_message_tokens(HumanMessage(content="hi"), token_counter=len) == 2 + MESSAGE_TOKEN_OVERHEAD
+
+
+def test_shared_client():
+    first = RedisChatMessageHistoryWindowed("a", url=URL)
+    second = RedisChatMessageHistoryWindowed("b", url=URL)
+    assert first.redis_client is second.redis_client is get_shared_client(URL)
+
+
+def test_fetch_messages():
+    histories = [RedisChatMessageHistoryWindowed(f"fetch-{i}", url=URL, chat_history_length=2) for i in range(3)]
+    for i, history in enumerate(histories):
+        history.clear()
+        for j in range(i + 1):
+            history.add_message(HumanMessage(content=f"{i}.{j}"))
+    windows = fetch_messages(histories)
+    assert [[m.content for m in window] for window in windows] == [["0.0"], ["1.0", "1.1"], ["2.1", "2.2"]]
+    assert windows == [history.messages for history in histories]
+
+
+def test_format_chat_history_as_text():
+    messages = [
+        SystemMessage(content="Be brief."),
+        HumanMessage(content="Hi"),
+        AIMessage(content="Hello"),
+        ChatMessage(role="Narrator", content="Later..."),
+    ]
+    assert format_chat_history_as_text(messages) == "System: Be brief.\nHuman: Hi\nAI: Hello\nNarrator: Later...\n"
+
+
+def test_retrieve_chat_histories_as_text():
+    for session_id in ("text-0", "text-1"):
+        history = RedisChatMessageHistoryWindowed(session_id, url=URL, key_prefix="text:")
+        history.clear()
+        history.add_message(HumanMessage(content=f"hi from {session_id}"))
+        history.add_message(AIMessage(content="hello"))
+    texts = retrieve_redis_windowed_chat_histories_as_text(["text-0", "text-1", "empty"], URL, "text:")
+    assert texts == {
+        "text-0": "Human: hi from text-0\nAI: hello\n",
+        "text-1": "Human: hi from text-1\nAI: hello\n",
+        "empty": "",
+    }
+    assert retrieve_redis_windowed_chat_history_as_text("text-1", URL, "text:") == texts["text-1"]
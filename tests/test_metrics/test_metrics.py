@@ -0,0 +1,91 @@
+"""Tests for the operation latency instrumentation."""
+import contextlib
+import logging
+import timeit
+
+import pytest
+
+from svaeva_redux.connection import override_redis
+from svaeva_redux.metrics import (
+    add_hook,
+    clear_metrics,
+    load_metrics,
+    metrics,
+    record_payload,
+    remove_hook,
+    render_prometheus,
+    timed,
+)
+from svaeva_redux.schemas.redis import UserModel
+
+
+def test_model_operations_are_timed():
+    metrics.reset()
+    user = UserModel(id="timed-user", group_id="group_id", platform_id="platform_id")
+    user.save()
+    UserModel.get("timed-user")
+    with pytest.raises(Exception):
+        UserModel.get("missing-timed-user")
+    stats = metrics.snapshot()
+    # UserModel.save runs the base class saves through super(), recorded once.
+    assert stats["UserModel.save"].count == 1
+    assert stats["UserModel.save"].payload_bytes == len(user.json())
+    assert (stats["UserModel.get"].count, stats["UserModel.get"].errors) == (2, 1)
+
+
+def test_hooks():
+    operations = []
+
+    @contextlib.contextmanager
+    def span(operation):
+        operations.append(operation)
+        yield
+
+    add_hook(span)
+    try:
+        with timed("outer"):
+            with timed("inner"):
+                pass
+    finally:
+        remove_hook(span)
+    assert operations == ["outer", "inner"]
+
+
+def test_flush_and_export():
+    metrics.reset()
+    clear_metrics()
+    for size in (10, 20, 30):
+        with timed("export"):
+            record_payload(size)
+    metrics.flush()
+    with timed("export"):
+        pass
+    metrics.flush()
+    stats = load_metrics()["export"]
+    assert (stats.count, stats.payload_bytes, sum(stats.buckets)) == (4, 60, 4)
+    text = render_prometheus({"export": stats})
+    assert 'svaeva_redux_operation_seconds_bucket{operation="export",le="+Inf"} 4' in text
+    assert 'svaeva_redux_operation_seconds_count{operation="export"} 4' in text
+    assert 'svaeva_redux_operation_payload_bytes_total{operation="export"} 60' in text
+    clear_metrics()
+
+
+def test_timer_overhead():
+    """Micro-benchmark: a timed block must stay cheap enough to leave instrumentation on."""
+
+    def block():
+        with timed("overhead"):
+            pass
+
+    overhead = min(timeit.repeat(block, number=10000, repeat=3)) / 10000
+    assert overhead < 20e-6
+
+
+def test_background_flush_survives_an_unavailable_server(caplog):
+    assert metrics.flush_interval > 0
+    metrics.reset()
+    metrics.observe("unflushed", 0.001)
+    with override_redis(url="redis://127.0.0.1:1/0", retries=0), caplog.at_level(logging.DEBUG, "svaeva_redux"):
+        metrics._try_flush()
+    assert "Could not flush the metrics" in caplog.text
+    metrics.reset()
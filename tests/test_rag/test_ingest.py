@@ -0,0 +1,71 @@
+"""Tests for the streaming RAG ingestion pipeline."""
+import json
+
+import numpy as np
+import pytest
+
+from svaeva_redux.rag.redisvl.ingest import HashingEmbedder, Ingestion, chunk_text, ingest, iter_documents
+from svaeva_redux.schemas.redis import redis_connection
+
+TEXT = " ".join(f"word{i}" for i in range(400))
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    (tmp_path / "notes.md").write_text(TEXT)
+    (tmp_path / "docs.ndjson").write_text(
+        "\n".join(json.dumps({"id": f"doc-{i}", "text": f"document {i} " + TEXT[: 100 * i]}) for i in range(1, 6))
+    )
+    ingestion = Ingestion(db=redis_connection)
+    yield tmp_path
+    ingestion.reset()
+    keys = list(redis_connection.scan_iter(match=f"{ingestion.schema['prefix']}:*"))
+    if keys:
+        redis_connection.delete(*keys)
+
+
+def test_chunk_text():
+    chunks = list(chunk_text(TEXT, chunk_size=500, overlap=100))
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    assert chunks[0].startswith("word0 ") and chunks[-1].endswith("word399")
+    # Consecutive chunks overlap and split on whitespace.
+    assert all(chunk.split()[0] in previous for previous, chunk in zip(chunks, chunks[1:]))
+    assert list(chunk_text("short", 500, 100)) == ["short"]
+    with pytest.raises(ValueError):
+        list(chunk_text(TEXT, 100, 100))
+
+
+def test_hashing_embedder():
+    vectors = HashingEmbedder(64)(["hello world", "hello world", "other", ""])
+    assert vectors.shape == (4, 64) and vectors.dtype == np.float32
+    assert np.allclose(vectors[0], vectors[1]) and np.isclose(np.linalg.norm(vectors[0]), 1.0)
+    assert not vectors[3].any()
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_ingest_and_resume(corpus, workers):
+    options = dict(create=False, chunk_size=300, overlap=50, batch_size=4, workers=workers, db=redis_connection)
+    report = ingest([str(corpus)], **options)
+    assert report["documents"] == 6 and report["skipped"] == 0
+    ingestion = Ingestion(db=redis_connection)
+    chunks = list(redis_connection.scan_iter(match=f"{ingestion.schema['prefix']}:*"))
+    assert len(chunks) == report["chunks"]
+    stored = redis_connection.hgetall(ingestion.chunk_key("doc-1", 0))
+    assert stored[b"doc_id"] == b"doc-1" and stored[b"chunk_index"] == b"0"
+    assert np.frombuffer(stored[b"embedding"], dtype=np.float32).shape == (256,)
+
+    # Unchanged documents are skipped, a shrunk one loses its extra chunks.
+    (corpus / "notes.md").write_text("rewritten")
+    report = ingest([str(corpus)], **options)
+    assert (report["documents"], report["skipped"], report["chunks"]) == (1, 5, 1)
+    notes = str(corpus / "notes.md")
+    assert redis_connection.hget(ingestion.chunk_key(notes, 0), "content") == b"rewritten"
+    assert redis_connection.exists(ingestion.chunk_key(notes, 1)) == 0
+
+    assert ingest([str(corpus)], restart=True, **options)["documents"] == 6
+
+
+def test_embedder_dimensions_are_checked(corpus):
+    ingestion = Ingestion(embedder=HashingEmbedder(8), db=redis_connection)
+    with pytest.raises(ValueError):
+        ingestion.run(iter_documents([str(corpus / "notes.md")]))
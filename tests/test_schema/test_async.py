@@ -0,0 +1,100 @@
+"""Tests for the asyncio persistence path."""
+import asyncio
+import os
+import time
+
+import redis.asyncio
+
+from svaeva_redux.schemas.redis import UserImageModel, UserModel
+from svaeva_redux.schemas.utils import async_update_user_avatar, async_update_user_conversation_embedding
+
+DELAY = 0.05
+
+
+async def _start_delayed_proxy(delay: float):
+    """TCP proxy in front of Redis that delays every request by ``delay`` seconds."""
+
+    async def handle(reader, writer):
+        upstream_reader, upstream_writer = await asyncio.open_connection(
+            os.getenv("REDIS_HOST"), int(os.getenv("REDIS_PORT"))
+        )
+
+        async def forward(source, sink, latency):
+            try:
+                while data := await source.read(65536):
+                    await asyncio.sleep(latency)
+                    sink.write(data)
+                    await sink.drain()
+            finally:
+                sink.close()
+
+        await asyncio.gather(forward(reader, upstream_writer, delay), forward(upstream_reader, writer, 0))
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+def test_async_updates_overlap(monkeypatch):
+    n_users = 20
+    pks = [f"async-user-{i}" for i in range(n_users)]
+    for pk in pks:
+        UserModel(id=pk, group_id="group_id", platform_id="platform_id").save()
+
+    async def run():
+        server = await _start_delayed_proxy(DELAY)
+        client = redis.asyncio.Redis(
+            host="127.0.0.1", port=server.sockets[0].getsockname()[1], db=int(os.getenv("REDIS_DB_INDEX"))
+        )
+        monkeypatch.setattr(UserModel._meta, "async_database", client)
+        # Open the pooled connections up front, so only the updates themselves are timed.
+        await asyncio.gather(*(client.ping() for _ in pks))
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(async_update_user_conversation_embedding(pk, [float(i)]) for i, pk in enumerate(pks))
+        )
+        elapsed = time.perf_counter() - start
+        await client.aclose()
+        server.close()
+        await server.wait_closed()
+        return elapsed
+
+    elapsed = asyncio.run(run())
+    # One script call (a single round trip) per user: sequential updates would take n_users round trips.
+    assert elapsed < 4 * 2 * DELAY
+    for i, pk in enumerate(pks):
+        assert UserModel.get(pk).conversation_embedding == [float(i)]
+
+
+def test_async_update_user_avatar(monkeypatch):
+    pk = "async-avatar"
+    UserImageModel.delete(pk)
+
+    async def run():
+        client = redis.asyncio.Redis(
+            host=os.getenv("REDIS_HOST"), port=int(os.getenv("REDIS_PORT")), db=int(os.getenv("REDIS_DB_INDEX"))
+        )
+        monkeypatch.setattr(UserImageModel._meta, "async_database", client)
+        await async_update_user_avatar(pk, b"first", "first prompt")
+        await async_update_user_avatar(pk, b"second", "second prompt")
+        user = await UserImageModel.async_get(pk)
+        await user.async_load_blobs()
+        await client.aclose()
+        return user
+
+    user = asyncio.run(run())
+    assert user.avatar_image_bytes == b"second"
+    assert user.avatar_image_bytes_history == [b"first"]
+    assert user.avatar_image_prompt_history == ["first prompt"]
+
+
+def test_async_connection_across_event_loops(caplog):
+    pk = "async-loops"
+    UserModel(id=pk, group_id="group_id", platform_id="platform_id").save()
+
+    async def run(value):
+        await async_update_user_conversation_embedding(pk, [value])
+        return await UserModel.async_db().ping()
+
+    # The default connection, its pooled connections must not outlive the first loop.
+    assert asyncio.run(run(1.0)) and asyncio.run(run(2.0))
+    assert not [record for record in caplog.records if record.levelname == "ERROR"]
+    assert UserModel.get(pk).conversation_embedding == [2.0]
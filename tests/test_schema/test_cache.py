@@ -0,0 +1,75 @@
+"""Tests for the in-process ConversationModel cache."""
+import time
+
+from svaeva_redux.schemas.cache import ModelCache
+from svaeva_redux.schemas.redis import ConversationModel, conversation_cache, redis_connection
+
+CONVERSATION = {
+    "name": "cached-conversation",
+    "lm_system_prompt": "You are a helpful assistant.",
+    "engine": "gpt-4",
+    "engine_type": "openai",
+    "author": "author",
+}
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_get_cached():
+    ConversationModel(**CONVERSATION).save()
+    stats = conversation_cache.stats()
+    first = ConversationModel.get_cached(CONVERSATION["name"])
+    assert ConversationModel.get_cached(CONVERSATION["name"]) is first
+    assert conversation_cache.stats()["misses"] == stats["misses"] + 1
+    assert conversation_cache.stats()["hits"] == stats["hits"] + 1
+
+    # Another worker, subscribed to the same channel, drops its entry when the conversation is saved.
+    worker = ModelCache(conversation_cache.channel)
+    worker.listen(redis_connection)
+    assert worker.get(CONVERSATION["name"], ConversationModel.get).temperature == 0.7
+    updated = ConversationModel(**{**CONVERSATION, "temperature": 0.2})
+    updated.save()
+    assert ConversationModel.get_cached(CONVERSATION["name"]).temperature == 0.2
+    wait_for(lambda: worker.stats()["size"] == 0)
+    assert worker.get(CONVERSATION["name"], ConversationModel.get).temperature == 0.2
+
+    ConversationModel.delete(CONVERSATION["name"])
+    wait_for(lambda: worker.stats()["size"] == 0)
+
+
+def test_cache_bounds():
+    loads = []
+
+    def load(key):
+        loads.append(key)
+        return key.upper()
+
+    cache = ModelCache("test-channel", ttl=0.05, max_entries=2)
+    assert [cache.get(key, load) for key in ("a", "b", "a", "c")] == ["A", "B", "A", "C"]
+    assert cache.get("a", load) == "A"
+    assert cache.get("b", load) == "B"  # least recently used, evicted by "c"
+    assert loads == ["a", "b", "c", "b"]
+    time.sleep(0.06)
+    cache.get("a", load)
+    assert loads[-1] == "a"
+    assert cache.stats() == {"hits": 2, "misses": 5, "size": 2}
+
+
+def test_load_racing_an_invalidation_is_not_cached():
+    cache = ModelCache("test-channel")
+    versions = iter(["stale", "fresh"])
+
+    def load(key):
+        value = next(versions)
+        if value == "stale":
+            cache.invalidate(key)  # The key changes while the stale value is loaded.
+        return value
+
+    assert cache.get("a", load) == "stale"
+    assert cache.get("a", load) == "fresh"
+    assert cache.get("a", load) == "fresh"
@@ -0,0 +1,73 @@
+"""Tests for the chunked video storage."""
+import io
+import os
+
+import pytest
+
+from svaeva_redux.schemas import chunks
+from svaeva_redux.schemas.chunks import chunk_key, iter_chunks
+from svaeva_redux.schemas.redis import UserVideoModel, redis_connection
+from svaeva_redux.schemas.transfer import export_records, import_records
+
+VIDEO = bytes(range(256)) * 40
+
+
+def test_iter_chunks():
+    expected = [VIDEO[i : i + 1000] for i in range(0, len(VIDEO), 1000)]
+    assert list(iter_chunks(VIDEO, 1000)) == expected
+    assert list(iter_chunks(io.BytesIO(VIDEO), 1000)) == expected
+    assert list(iter_chunks((VIDEO[i : i + 333] for i in range(0, len(VIDEO), 333)), 1000)) == expected
+
+
+def test_upload_and_range_reads():
+    video = UserVideoModel(id="chunked-video")
+    video.upload_video(iter([VIDEO[:5000], VIDEO[5000:]]), chunk_size=1000)
+    assert redis_connection.exists(chunk_key(video.avatar_video_ref, 10)) == 1
+    stored = UserVideoModel.get("chunked-video")
+    assert stored.avatar_video_size == len(VIDEO)
+    assert stored.avatar_video_bytes == VIDEO
+    assert stored.read_video(999, 2001) == VIDEO[999:2001]
+    assert stored.read_video(10000) == VIDEO[10000:]
+    assert stored.read_video(20000) == b""
+    assert all(len(chunk) <= 1000 for chunk in stored.iter_video(500, 4500))
+
+    previous = stored.avatar_video_ref
+    stored.avatar_video_bytes = b"replaced"
+    stored.save()
+    assert redis_connection.exists(chunk_key(previous, 0)) == 0
+    assert UserVideoModel.get("chunked-video").avatar_video_bytes == b"replaced"
+
+    ref = stored.avatar_video_ref
+    UserVideoModel.delete("chunked-video")
+    assert redis_connection.exists(chunk_key(ref, 0)) == 0
+
+
+def test_file_store(tmp_path, monkeypatch):
+    monkeypatch.setenv("VIDEO_STORE_PATH", str(tmp_path))
+    monkeypatch.setattr(chunks, "_stores", {})
+    video = UserVideoModel(id="file-video")
+    video.upload_video(io.BytesIO(VIDEO), chunk_size=4096)
+    path = os.path.join(tmp_path, video.avatar_video_ref)
+    assert os.path.getsize(path) == len(VIDEO)
+
+    stored = UserVideoModel.get("file-video")
+    assert stored.avatar_video_store == "file"
+    assert stored.read_video(4000, 8200) == VIDEO[4000:8200]
+    assert [len(chunk) for chunk in stored.iter_video()] == [4096, 4096, 2048]
+
+    UserVideoModel.delete("file-video")
+    assert not os.path.exists(path)
+    with pytest.raises(ValueError):
+        chunks.chunk_store("missing")
+
+
+def test_export_import_video_chunks():
+    video = UserVideoModel(id="exported-video", avatar_video_bytes=VIDEO)
+    video.save()
+    stream = io.StringIO()
+    report = export_records(stream, ["UserVideoModel"])
+    assert report["records"]["VideoChunk"] >= 1
+    UserVideoModel.delete("exported-video")
+    import_records(io.StringIO(stream.getvalue()))
+    assert UserVideoModel.get("exported-video").avatar_video_bytes == VIDEO
+    UserVideoModel.delete("exported-video")
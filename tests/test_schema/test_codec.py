@@ -0,0 +1,124 @@
+"""Tests for the field codec."""
+import asyncio
+import io
+
+import pytest
+
+from svaeva_redux.schemas import utils
+from svaeva_redux.schemas.codec import FieldCodec, decode_value, field_codec, intern_key, list_interned
+from svaeva_redux.schemas.indexes import apply_index_profile
+from svaeva_redux.schemas.redis import ConversationModel, redis_connection
+from svaeva_redux.schemas.transfer import export_records, import_records
+from svaeva_redux.schemas.utils import collect_interned_values
+
+PROMPT = "You are a helpful assistant who answers in short sentences. " * 40
+
+
+@pytest.fixture
+def zlib_codec(monkeypatch):
+    monkeypatch.setattr(field_codec, "algorithm", "zlib")
+    monkeypatch.setattr(field_codec, "intern", True)
+    return field_codec
+
+
+def test_encode_decode():
+    inline = FieldCodec("zlib", threshold=100, intern=False)
+    encoded = inline.encode(redis_connection, PROMPT)
+    assert len(encoded) < len(PROMPT) // 4
+    assert decode_value(encoded, {}) == PROMPT
+    assert inline.encode(redis_connection, "short") == "short"
+    assert FieldCodec().encode(redis_connection, PROMPT) == PROMPT
+    with pytest.raises(ValueError):
+        FieldCodec("brotli")
+
+
+def test_interned_prompts_are_shared(zlib_codec):
+    conversations = [
+        ConversationModel(
+            name=f"interned-{i}", lm_system_prompt=PROMPT, engine="gpt-4", engine_type="openai", author="a"
+        )
+        for i in range(2)
+    ]
+    for conversation in conversations:
+        conversation.save()
+    stored = [redis_connection.json().get(conversation.key(), ".lm_system_prompt") for conversation in conversations]
+    assert stored[0] == stored[1] and len(stored[0]) < 100
+    assert redis_connection.strlen(intern_key(stored[0].split("@")[1])) < len(PROMPT) // 4
+
+    assert ConversationModel.get("interned-0").lm_system_prompt == PROMPT
+    assert asyncio.run(ConversationModel.async_get("interned-1")).lm_system_prompt == PROMPT
+
+    stream = io.StringIO()
+    export_records(stream, ["ConversationModel"])
+    redis_connection.delete(intern_key(stored[0].split("@")[1]))
+    import_records(io.StringIO(stream.getvalue()))
+    assert ConversationModel.get("interned-0").lm_system_prompt == PROMPT
+
+    with pytest.raises(ValueError):
+        apply_index_profile({"ConversationModel": {"lm_system_prompt": "TAG"}})
+    apply_index_profile(None)
+    for conversation in conversations:
+        ConversationModel.delete(conversation.name)
+
+
+def test_raw_documents_still_load(zlib_codec):
+    ConversationModel(
+        name="raw-prompt", lm_system_prompt="short", engine="gpt-4", engine_type="openai", author="a"
+    ).save()
+    assert redis_connection.json().get(ConversationModel.make_key("raw-prompt"), ".lm_system_prompt") == "short"
+    assert ConversationModel.get("raw-prompt").lm_system_prompt == "short"
+    ConversationModel.delete("raw-prompt")
+
+
+def test_unreferenced_interned_values_are_collected(zlib_codec):
+    kept = ConversationModel(name="kept", lm_system_prompt=PROMPT, engine="gpt-4", engine_type="openai", author="a")
+    rewritten = ConversationModel(
+        name="rewritten", lm_system_prompt=PROMPT + "v1", engine="gpt-4", engine_type="openai", author="a"
+    )
+    kept.save()
+    rewritten.save()
+
+    def digest(name):
+        return redis_connection.json().get(ConversationModel.make_key(name), ".lm_system_prompt").split("@")[1]
+
+    shared, old = digest("kept"), digest("rewritten")
+    rewritten.lm_system_prompt = PROMPT + "v2"
+    rewritten.save()
+    new = digest("rewritten")
+    # Earlier tests may have left unreferenced values too.
+    assert collect_interned_values() >= 1
+    assert not redis_connection.exists(intern_key(old))
+    assert redis_connection.exists(intern_key(shared)) and redis_connection.exists(intern_key(new))
+    assert ConversationModel.get("rewritten").lm_system_prompt == PROMPT + "v2"
+
+    for conversation in (kept, rewritten):
+        ConversationModel.delete(conversation.name)
+    assert collect_interned_values() == 2
+    assert not redis_connection.exists(intern_key(shared)) and not redis_connection.exists(intern_key(new))
+
+
+def test_interned_values_reused_during_collection_are_kept(zlib_codec, monkeypatch):
+    prompt = PROMPT + "reused"
+    conversation = ConversationModel(
+        name="reused", lm_system_prompt=prompt, engine="gpt-4", engine_type="openai", author="a"
+    )
+    conversation.save()
+    digest = redis_connection.json().get(ConversationModel.make_key("reused"), ".lm_system_prompt").split("@")[1]
+    ConversationModel.delete("reused")
+
+    def list_then_reuse(db, *args):
+        candidates = list_interned(db, *args)
+        # A save interning the orphaned value again, whose document is only written after the references are read.
+        zlib_codec.encode(redis_connection, prompt)
+        return candidates
+
+    monkeypatch.setattr(utils, "list_interned", list_then_reuse)
+    collect_interned_values()
+    assert redis_connection.exists(intern_key(digest))
+    conversation.save()
+    assert ConversationModel.get("reused").lm_system_prompt == prompt
+
+    ConversationModel.delete("reused")
+    monkeypatch.undo()
+    assert collect_interned_values() >= 1
+    assert not redis_connection.exists(intern_key(digest))
@@ -0,0 +1,101 @@
+"""Tests for the compact conversation embedding codec."""
+import json
+import os
+
+import numpy as np
+from langchain_core.messages import AIMessage, HumanMessage
+
+from svaeva_redux.langchain.redis import RedisChatMessageHistoryWindowed
+from svaeva_redux.schemas.embeddings import decode_embedding, embedding_key, encode_embedding, fold_embeddings
+from svaeva_redux.schemas.redis import UserModel
+from svaeva_redux.schemas.utils import (
+    migrate_conversation_embeddings,
+    update_user_conversation_embedding,
+    update_user_conversation_embedding_incremental,
+)
+
+URL = f"redis://{os.getenv('REDIS_HOST')}:{os.getenv('REDIS_PORT')}/{os.getenv('REDIS_DB_INDEX')}"
+
+
+def test_codec_round_trip():
+    embedding = np.random.default_rng(0).standard_normal(1536)
+    data = encode_embedding(embedding)
+    decoded = decode_embedding(data)
+    assert len(data) == 4 * 1536
+    assert len(data) * 4 < len(json.dumps(embedding.tolist()))
+    assert decoded.dtype == np.float32
+    assert not decoded.flags.owndata
+    np.testing.assert_allclose(decoded, embedding, rtol=1e-6)
+
+
+def test_update_user_conversation_embedding():
+    pk = "embedding-user"
+    UserModel(id=pk, group_id="group_id", platform_id="platform_id").save()
+    update_user_conversation_embedding(pk, np.array([1.0, 2.0, 3.0]))
+    user = UserModel.get(pk)
+    assert user.conversation_embedding == [1.0, 2.0, 3.0]
+    assert user.conversation_embedding_array.dtype == np.float32
+    assert "conversation_embedding" not in UserModel.db().json().get(UserModel.make_primary_key(pk))
+    assert UserModel.db().hget(embedding_key(pk), "group_id") == b"group_id"
+
+
+def test_migrate_conversation_embeddings():
+    pk = "legacy-embedding-user"
+    UserModel.db().delete(embedding_key(pk))
+    UserModel.db().json().set(
+        UserModel.make_primary_key(pk),
+        "$",
+        {"id": pk, "group_id": "group_id", "platform_id": "platform_id", "conversation_embedding": [0.5, 0.25]},
+    )
+    assert migrate_conversation_embeddings() >= 1
+    assert "conversation_embedding" not in UserModel.db().json().get(UserModel.make_primary_key(pk))
+    assert UserModel.get(pk).conversation_embedding == [0.5, 0.25]
+
+
+def test_fold_embeddings():
+    vectors = np.random.default_rng(1).standard_normal((10, 4))
+    mean, weight = fold_embeddings(None, 0.0, vectors[:6])
+    mean, weight = fold_embeddings(mean, weight, vectors[6:])
+    np.testing.assert_allclose(mean, vectors.mean(axis=0), rtol=1e-5)
+    assert weight == 10
+
+    decayed, _ = fold_embeddings(*fold_embeddings(None, 0.0, vectors[:6], 0.5), vectors[6:], 0.5)
+    expected, _ = fold_embeddings(None, 0.0, vectors, 0.5)
+    np.testing.assert_allclose(decayed, expected, rtol=1e-5)
+    weights = 0.5 ** np.arange(9, -1, -1)
+    np.testing.assert_allclose(expected, weights @ vectors / weights.sum(), rtol=1e-5)
+
+
+def test_update_user_conversation_embedding_incremental():
+    pk = "incremental-embedding-user"
+    UserModel(id=pk, group_id="group_id", platform_id="platform_id").save()
+    UserModel.db().delete(embedding_key(pk))
+    history = RedisChatMessageHistoryWindowed(f"{pk}-session", url=URL, chat_history_length=2)
+    history.clear()
+    embedded = []
+
+    def embed(texts):
+        embedded.extend(texts)
+        return np.array([[float(len(embedded) - len(texts) + i), 1.0] for i in range(len(texts))])
+
+    for i in range(3):
+        history.add_message(HumanMessage(content=f"message {i}"))
+    assert update_user_conversation_embedding_incremental(pk, history, embed, batch_size=2) == 3
+    assert embedded == ["Human: message 0\n", "Human: message 1\n", "Human: message 2\n"]
+    assert update_user_conversation_embedding_incremental(pk, history, embed) == 0
+
+    history.add_message(AIMessage(content="answer"))
+    assert update_user_conversation_embedding_incremental(pk, history, embed) == 1
+    assert embedded[-1] == "AI: answer\n"
+    # The mean of every message so far, beyond the history window.
+    np.testing.assert_allclose(UserModel.get(pk).conversation_embedding_array, [1.5, 1.0])
+    assert UserModel.db().hget(embedding_key(pk), "group_id") == b"group_id"
+
+    # A replaced embedding or a cleared history restarts the aggregate.
+    update_user_conversation_embedding(pk, np.array([9.0, 9.0]))
+    assert update_user_conversation_embedding_incremental(pk, history, embed) == 4
+    history.clear()
+    history.add_message(HumanMessage(content="again"))
+    assert update_user_conversation_embedding_incremental(pk, history, embed) == 1
+    np.testing.assert_allclose(UserModel.get(pk).conversation_embedding_array, [len(embedded) - 1, 1.0])
+    assert update_user_conversation_embedding_incremental("missing-user", history, embed) == 0
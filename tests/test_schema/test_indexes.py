@@ -0,0 +1,48 @@
+"""Tests for the index profiles."""
+import json
+
+import pytest
+
+from svaeva_redux.schemas.indexes import apply_index_profile
+from svaeva_redux.schemas.redis import ConversationModel, UserModel
+from svaeva_redux.schemas.utils import migrate_indexes, schema_hash
+
+
+def indexed_fields(cls):
+    return {part.split()[2] for part in cls.schema_for_fields() if part}
+
+
+def test_apply_index_profile(tmp_path):
+    declared_hash = schema_hash()  # Also resolves the primary keys, see schema_hash.
+    declared = indexed_fields(UserModel)
+    try:
+        apply_index_profile("lookup")
+        assert indexed_fields(UserModel) == {"id", "group_id", "platform_id"}
+        assert indexed_fields(ConversationModel) == {"name"}
+        assert schema_hash() != declared_hash
+
+        path = tmp_path / "profile.json"
+        path.write_text(json.dumps({"UserModel": {"group_id": "TAG", "age": "NUMERIC", "description": "TEXT"}}))
+        apply_index_profile(str(path))
+        assert indexed_fields(UserModel) == {"id", "group_id", "age", "description"}
+        assert "$.description AS description_fts TEXT" in UserModel.redisearch_schema()
+        # Models left out of the profile keep their declared indexes.
+        assert "engine" in indexed_fields(ConversationModel)
+
+        for profile in ({"UserModel": {"age": "TAG"}}, {"UserModel": {"missing": "TAG"}}, {"Missing": {}}, "missing"):
+            with pytest.raises(ValueError):
+                apply_index_profile(profile)
+    finally:
+        apply_index_profile(None)
+    assert indexed_fields(UserModel) == declared
+    assert schema_hash() == declared_hash
+
+
+def test_migrate_indexes():
+    try:
+        memory = migrate_indexes("lookup")
+        assert {UserModel._meta.index_name, ConversationModel._meta.index_name} <= set(memory)
+        assert all(set(sizes) == {"before", "after"} for sizes in memory.values())
+    finally:
+        apply_index_profile(None)
+        migrate_indexes()
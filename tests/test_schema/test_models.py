@@ -0,0 +1,36 @@
+"""Tests for the model base classes."""
+import timeit
+
+from svaeva_redux.schemas.redis import UserModel
+
+USER = {
+    "id": "tracked-user",
+    "group_id": "group_id",
+    "platform_id": "platform_id",
+    "first_name": "first_name",
+    "country": "US",
+}
+
+
+def test_dirty_tracking():
+    user = UserModel(**USER)
+    assert user.dirty_fields == set()
+    user.first_name = "renamed"
+    assert user.dirty_fields == {"first_name"}
+    user._prepare_save()
+    assert user.date_updated_timestamp == user.date_accessed_timestamp
+    assert '"date_accessed"' not in user.json()
+
+
+def test_attribute_access_is_not_tracked():
+    """Micro-benchmark: construction, attribute reads and serialization of a UserModel."""
+    user = UserModel(**USER)
+    accessed = user.date_accessed_timestamp
+    construct = min(timeit.repeat(lambda: UserModel(**USER), number=200, repeat=3)) / 200
+    read = min(timeit.repeat(lambda: user.first_name, number=10000, repeat=3)) / 10000
+    serialize = min(timeit.repeat(user.json, number=200, repeat=3)) / 200
+    assert user.date_accessed_timestamp == accessed
+    assert user.dirty_fields == set()
+    # A plain attribute read, no clock calls or hidden writes.
+    assert read < 1e-6
+    assert construct < 1e-3 and serialize < 1e-3
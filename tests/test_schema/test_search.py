@@ -0,0 +1,46 @@
+"""Tests for conversation embedding similarity search."""
+import numpy as np
+import pytest
+
+from svaeva_redux.schemas.redis import UserModel
+from svaeva_redux.schemas.search import _search_brute_force, find_similar_users, iter_user_pages, iter_users
+
+
+def _save_users():
+    embeddings = {
+        "similar-a": ("group-a", [1.0, 0.0, 0.0]),
+        "similar-b": ("group-a", [0.9, 0.1, 0.0]),
+        "similar-c": ("group-a", [0.0, 1.0, 0.0]),
+        "similar-d": ("group-b", [1.0, 0.0, 0.0]),
+    }
+    for pk, (group_id, embedding) in embeddings.items():
+        UserModel(id=pk, group_id=group_id, platform_id="platform_id", conversation_embedding=embedding).save()
+
+
+def test_find_similar_users():
+    _save_users()
+    result = find_similar_users(np.array([1.0, 0.0, 0.0]), k=2, group_id="group-a")
+    assert [user_id for user_id, _ in result] == ["similar-a", "similar-b"]
+    assert result[0][1] < 1e-6
+
+
+def test_brute_force_range():
+    _save_users()
+    result = _search_brute_force(np.array([1.0, 0.0, 0.0], dtype=np.float32), 10, "group-a", None, 0.5, "COSINE")
+    assert {user_id for user_id, _ in result} == {"similar-a", "similar-b"}
+
+
+def test_iter_user_pages():
+    for i in range(7):
+        UserModel(id=f"paged-{i}", group_id="paged-group", platform_id=f"platform-{i % 2}", interaction_count=i).save()
+    pages = list(iter_user_pages(group_id="paged-group", fields=("id", "interaction_count", "age"), page_size=3))
+    assert [len(page) for page in pages] == [3, 3, 1]
+    users = sorted((user for page in pages for user in page), key=lambda user: user["interaction_count"])
+    assert users == [{"id": f"paged-{i}", "interaction_count": i, "age": None} for i in range(7)]
+
+    ids = {user["id"] for user in iter_users(group_id="paged-group", platform_id="platform-1", fields=("id",))}
+    assert ids == {"paged-1", "paged-3", "paged-5"}
+    with pytest.raises(ValueError):
+        next(iter_users(fields=("conversation_embedding_array",)))
+    for i in range(7):
+        UserModel.delete(f"paged-{i}")
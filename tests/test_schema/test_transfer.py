@@ -0,0 +1,63 @@
+"""Tests for the NDJSON export and import."""
+import io
+import json
+
+import numpy as np
+import pytest
+
+from svaeva_redux.schemas.blobs import blob_digest, blob_key
+from svaeva_redux.schemas.embeddings import embedding_key
+from svaeva_redux.schemas.redis import ConversationModel, UserImageModel, UserModel, redis_connection
+from svaeva_redux.schemas.transfer import export_records, import_records, open_ndjson
+
+
+def test_export_import_round_trip(tmp_path):
+    user = UserModel(id="transfer-user", group_id="group_id", platform_id="platform_id", first_name="first")
+    user.conversation_embedding = [0.5, 1.5, 2.5]
+    user.save()
+    image = UserImageModel(id="transfer-user", avatar_image_prompt="prompt")
+    image.avatar_image_bytes = b"first image"
+    image.save()
+    image.avatar_image_bytes_history = [b"old image"]
+    image.save()
+
+    path = str(tmp_path / "export.ndjson.gz")
+    with open_ndjson(path, "w") as stream:
+        report = export_records(stream, ["UserModel", "UserImageModel"], batch_size=2)
+    assert report["records"]["UserModel"] >= 1 and report["records"]["UserImageModel"] >= 1
+    assert report["bytes"] > 0 and report["records_per_second"] > 0
+
+    UserModel.delete(user.id)
+    UserImageModel.delete(image.id)
+    redis_connection.delete(embedding_key(user.id), blob_key(blob_digest(b"first image")))
+    with open_ndjson(path) as stream:
+        report = import_records(stream, batch_size=2)
+    assert report["records"]["UserModel"] >= 1
+
+    restored = UserModel.get(user.id)
+    assert restored.first_name == "first"
+    np.testing.assert_array_equal(restored.conversation_embedding_array, [0.5, 1.5, 2.5])
+    restored_image = UserImageModel.get(image.id)
+    assert restored_image.avatar_image_bytes == b"first image"
+    assert restored_image.avatar_image_bytes_history == [b"old image"]
+    UserModel.delete(user.id)
+    UserImageModel.delete(image.id)
+
+
+def test_export_skips_index_keys_and_invalidates_conversations():
+    stream = io.StringIO()
+    export_records(stream, ["ConversationModel"])
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert records and all(record["model"] == "ConversationModel" for record in records)
+    assert all("name" in record["document"] for record in records)
+
+    name = records[0]["pk"]
+    ConversationModel.get_cached(name)
+    records[0]["document"]["temperature"] = 0.1
+    import_records(io.StringIO("".join(json.dumps(record) + "\n" for record in records)))
+    assert ConversationModel.get_cached(name).temperature == 0.1
+
+
+def test_export_unknown_model():
+    with pytest.raises(ValueError):
+        export_records(io.StringIO(), ["MissingModel"])
@@ -1,7 +1,9 @@
 """Tests for hello function."""
 # import pytest
+import threading
 
-from svaeva_redux.schemas.redis import UserImageModel, UserModel, UserVideoModel
+from svaeva_redux.schemas.counters import WriteBehindCounter
+from svaeva_redux.schemas.redis import UserImageModel, UserModel, UserVideoModel, redis_connection
 from svaeva_redux.schemas.utils import update_user_avatar, update_user_conversation_embedding
 
 
@@ -93,3 +95,45 @@ def test_user_update_embedding():
     # except NotFoundError:
     #     user = None
     # assert user is None
+
+
+def test_increment_interaction_count():
+    pk = "increment-user"
+    UserModel(id=pk, group_id="group_id", platform_id="platform_id", first_name="first").save()
+    workers = [UserModel.get(pk) for _ in range(4)]
+    threads = [
+        threading.Thread(target=lambda user=user: [user.increment_interaction_count() for _ in range(25)])
+        for user in workers
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    user = UserModel.get(pk)
+    assert user.interaction_count == 100
+    assert user.first_name == "first"
+    assert user.date_accessed_timestamp >= workers[0].date_created_timestamp
+
+    unsaved = UserModel(id="increment-unsaved", group_id="group_id", platform_id="platform_id")
+    unsaved.increment_interaction_count(2)
+    assert UserModel.get("increment-unsaved").interaction_count == 2
+    UserModel.delete(pk)
+    UserModel.delete("increment-unsaved")
+
+
+def test_write_behind_interaction_count():
+    counter = WriteBehindCounter(redis_connection, ".interaction_count", ".date_accessed_timestamp")
+    user = UserModel(id="write-behind-user", group_id="group_id", platform_id="platform_id")
+    user.save()
+    for _ in range(3):
+        counter.add(user.key(), 1, 123.0)
+    counter.add(UserModel.make_key("write-behind-missing"), 5)
+    assert counter.pending(user.key()) == 3
+    assert UserModel.get(user.id).interaction_count == 0
+    assert counter.flush() == 1
+    assert counter.pending(user.key()) == 0
+    stored = UserModel.get(user.id)
+    assert stored.interaction_count == 3
+    assert UserModel.db().json().get(user.key(), ".date_accessed_timestamp") == 123.0
+    assert counter.flush() == 0
+    UserModel.delete(user.id)
@@ -0,0 +1,124 @@
+"""Tests for the schema helpers."""
+import json
+import time
+
+import numpy as np
+
+from svaeva_redux.schemas import utils
+from svaeva_redux.schemas.blobs import blob_digest, blob_key, list_blobs, put_blob
+from svaeva_redux.schemas.redis import ConversationModel, UserImageModel, UserModel, redis_connection
+from svaeva_redux.schemas.utils import (
+    PRESET_HASHES_KEY,
+    batch_update_user_conversation_embeddings,
+    batch_update_users,
+    collect_user_image_blobs,
+    initialize_redis,
+    load_presets,
+    update_user_avatar,
+)
+
+
+def test_update_user_avatar_bounded_history():
+    pk = "avatar-history"
+    UserImageModel.delete(pk)
+    for i in range(5):
+        update_user_avatar(pk, f"image {i}".encode(), f"prompt {i}", max_history_depth=3)
+    user = UserImageModel.get(pk)
+    assert user.avatar_image_bytes == b"image 4"
+    assert user.avatar_image_prompt == "prompt 4"
+    assert user.avatar_image_bytes_history == [b"image 1", b"image 2", b"image 3"]
+    assert user.avatar_image_prompt_history == ["prompt 1", "prompt 2", "prompt 3"]
+
+
+def test_update_user_avatar_latency_is_flat():
+    """Benchmark: update latency must not grow with the history depth."""
+    image = b"x" * 64 * 1024
+
+    def time_updates(pk, depth, rounds=20):
+        UserImageModel.delete(pk)
+        for _ in range(depth + 1):
+            update_user_avatar(pk, image, "prompt", max_history_depth=depth)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            update_user_avatar(pk, image, "prompt", max_history_depth=depth)
+        return (time.perf_counter() - start) / rounds
+
+    shallow = time_updates("avatar-bench-shallow", 1)
+    deep = time_updates("avatar-bench-deep", 50)
+    assert deep < shallow * 5
+
+
+def test_user_image_blobs_are_deduplicated_and_lazy():
+    image = b"\x89PNG shared image"
+    first = UserImageModel(id="blob-a", avatar_image_bytes=image, avatar_image_prompt="a")
+    second = UserImageModel(id="blob-b", avatar_image_bytes=image, avatar_image_prompt="b")
+    first.save()
+    second.save()
+    assert first.avatar_image_ref == second.avatar_image_ref
+    assert UserImageModel.db().exists(blob_key(first.avatar_image_ref))
+
+    document = UserImageModel.db().json().get(UserImageModel.make_primary_key("blob-a"))
+    assert "avatar_image_bytes" not in document
+    user = UserImageModel.get("blob-a")
+    assert user._blobs == {}
+    assert user.avatar_image_bytes == image
+
+
+def test_blobs_written_during_collection_are_kept(monkeypatch):
+    orphan, reused, new = b"orphan image", b"reused image", b"image saved during collection"
+    for data in (orphan, reused):
+        put_blob(redis_connection, data)
+
+    def list_then_write(db, *args):
+        candidates = list_blobs(db, *args)
+        UserImageModel(id="blob-during-gc", avatar_image_bytes=new).save()
+        # Reused by a save whose document is only written after the references are read.
+        put_blob(redis_connection, reused)
+        return candidates
+
+    monkeypatch.setattr(utils, "list_blobs", list_then_write)
+    assert collect_user_image_blobs() >= 1
+    assert not redis_connection.exists(blob_key(blob_digest(orphan)))
+    assert redis_connection.exists(blob_key(blob_digest(reused)), blob_key(blob_digest(new))) == 2
+    assert UserImageModel.get("blob-during-gc").avatar_image_bytes == new
+
+
+def test_batch_updates_report_missing_users():
+    for pk in ("batch-a", "batch-b"):
+        UserModel(id=pk, group_id="group_id", platform_id="platform_id").save()
+    UserModel.delete("batch-missing")
+
+    results = batch_update_users(
+        {"batch-a": {"interaction_count": 3}, "batch-b": {"age": 500}, "batch-missing": {"flagged": True}},
+        chunk_size=2,
+    )
+    assert results["batch-a"] is None
+    assert results["batch-b"].startswith("Invalid value for age")
+    assert "does not exist" in results["batch-missing"]
+    assert UserModel.get("batch-a").interaction_count == 3
+
+    results = batch_update_user_conversation_embeddings(
+        {"batch-a": np.ones(3), "batch-b": np.zeros(3), "batch-missing": np.ones(3)}, chunk_size=2
+    )
+    assert results == {"batch-a": None, "batch-b": None, "batch-missing": "UserModel batch-missing does not exist"}
+    assert UserModel.get("batch-b").conversation_embedding == [0.0, 0.0, 0.0]
+
+
+def test_initialize_redis_is_idempotent(tmp_path):
+    presets = [
+        {"name": "seeded-0", "engine": "gpt-4", "engine_type": "openai", "author": "author"},
+        {"name": "seeded-1", "engine": "gpt-4", "engine_type": "openai", "author": "author"},
+    ]
+    redis_connection.delete(PRESET_HASHES_KEY)
+    assert initialize_redis(presets) == ["seeded-0", "seeded-1"]
+    created = ConversationModel.get("seeded-0").date_created_timestamp
+    assert initialize_redis(presets) == []
+    assert ConversationModel.get("seeded-0").date_created_timestamp == created
+
+    presets[1]["temperature"] = 0.1
+    ConversationModel.delete("seeded-0")
+    path = tmp_path / "presets.json"
+    path.write_text(json.dumps(presets))
+    assert initialize_redis(load_presets(str(path))) == ["seeded-0", "seeded-1"]
+    assert ConversationModel.get("seeded-1").temperature == 0.1
+    assert initialize_redis(presets, force=True) == ["seeded-0", "seeded-1"]
@@ -0,0 +1,121 @@
+"""Tests for the consistent-hash shard router and rebalancing."""
+import asyncio
+import os
+
+import numpy as np
+import pytest
+from langchain_core.messages import HumanMessage
+
+from svaeva_redux.connection import override_redis
+from svaeva_redux.langchain.redis import RedisChatMessageHistoryWindowed, history_shard, rebalance_histories
+from svaeva_redux.schemas.blobs import blob_digest, blob_key
+from svaeva_redux.schemas.embeddings import embedding_key
+from svaeva_redux.schemas.redis import UserImageModel, UserModel, redis_connection
+from svaeva_redux.schemas.utils import (
+    async_update_user_avatar,
+    batch_update_users,
+    rebalance_shards,
+    update_user_avatar,
+    update_user_conversation_embedding,
+)
+from svaeva_redux.shards import HashRing, shard_router
+
+BASE_URL = f"redis://{os.getenv('REDIS_HOST')}:{os.getenv('REDIS_PORT')}"
+SHARDS = {"a": f"{BASE_URL}/1", "b": f"{BASE_URL}/2"}
+
+
+def group_on(shard):
+    return next(f"group-{i}" for i in range(100) if shard_router.shard_for(f"group-{i}") == shard)
+
+
+def make_user(pk, group_id):
+    return UserModel(id=pk, group_id=group_id, platform_id="platform", interaction_count=1)
+
+
+@pytest.fixture
+def shards():
+    with override_redis(shards=SHARDS):
+        yield {name: redis_connection.shard(name) for name in SHARDS}
+        for client in (redis_connection.shard(name) for name in SHARDS):
+            client.flushdb()
+
+
+def test_ring_moves_keys_only_to_new_node():
+    keys = [f"key-{i}" for i in range(2000)]
+    before = HashRing(["a", "b", "c"])
+    after = HashRing(["a", "b", "c", "d"])
+    moved = [key for key in keys if before.node(key) != after.node(key)]
+    assert all(after.node(key) == "d" for key in moved)
+    assert 0.15 < len(moved) / len(keys) < 0.35
+
+
+def test_router_disabled_without_shards():
+    assert not shard_router.enabled and shard_router.shard_for("group") is None
+    assert rebalance_shards() == {}
+
+
+def test_users_routed_by_group(shards):
+    group_a, group_b = group_on("a"), group_on("b")
+    make_user("shard-user", group_a).save()
+    key = UserModel.make_primary_key("shard-user")
+    assert shards["a"].exists(key) and not shards["b"].exists(key)
+    with override_redis():
+        assert not redis_connection.exists(key)
+    assert UserModel.locate("shard-user") == "a"
+    with shard_router.route(group_a):
+        assert UserModel.get("shard-user").group_id == group_a
+    assert UserModel.get("shard-user").interaction_count == 1
+
+    update_user_conversation_embedding("shard-user", np.ones(4))
+    assert shards["a"].exists(embedding_key("shard-user"))
+
+    # Changing the group moves the document, and its embedding, to the new shard.
+    user = UserModel.get("shard-user")
+    user.group_id = group_b
+    user.save()
+    assert not shards["a"].exists(key) and shards["b"].exists(key)
+    assert shards["b"].exists(embedding_key("shard-user"))
+    assert UserModel.get("shard-user").group_id == group_b
+
+    results = batch_update_users({"shard-user": {"flagged": True}, "missing-user": {"flagged": True}})
+    assert results["shard-user"] is None and "does not exist" in results["missing-user"]
+    assert UserModel.get("shard-user").flagged
+    assert batch_update_users({"shard-user": {"group_id": group_a}})["shard-user"] is not None
+
+
+def test_first_avatar_update_on_user_shard(shards):
+    group_b = group_on("b")
+    make_user("avatar-user", group_b).save()
+    update_user_avatar("avatar-user", b"first avatar")
+    asyncio.run(async_update_user_avatar("async-avatar-user", b"async avatar", group_id=group_b))
+    for pk, image in (("avatar-user", b"first avatar"), ("async-avatar-user", b"async avatar")):
+        key = UserImageModel.make_primary_key(pk)
+        assert shards["b"].exists(key, blob_key(blob_digest(image))) == 2 and not shards["a"].exists(key)
+        assert UserImageModel.get(pk).avatar_image_bytes == image
+    update_user_avatar("avatar-user", b"second avatar")
+    assert UserImageModel.get("avatar-user").avatar_image_bytes_history == [b"first avatar"]
+
+
+def test_rebalance_shards(shards):
+    with override_redis(shards={"a": SHARDS["a"]}):
+        for i in range(20):
+            make_user(f"rebalanced-{i}", f"group-{i}").save()
+    moved = rebalance_shards(batch_size=7)
+    owners = {i: shard_router.shard_for(f"group-{i}") for i in range(20)}
+    assert moved == {"a": sum(owner == "b" for owner in owners.values()), "b": 0}
+    for i, owner in owners.items():
+        key = UserModel.make_primary_key(f"rebalanced-{i}")
+        assert shards[owner].exists(key) and not shards["b" if owner == "a" else "a"].exists(key)
+    assert rebalance_shards() == {"a": 0, "b": 0}
+
+
+def test_rebalance_histories(shards):
+    session = next(f"session-{i}" for i in range(100) if history_shard(SHARDS, f"session-{i}") == "b")
+    before = RedisChatMessageHistoryWindowed(session, shard_urls={"a": SHARDS["a"]}, ttl=600)
+    before.add_message(HumanMessage(content="old"))
+    after = RedisChatMessageHistoryWindowed(session, shard_urls=SHARDS)
+    after.add_message(HumanMessage(content="new"))
+    assert rebalance_histories(SHARDS) == {"a": 1, "b": 0}
+    assert not shards["a"].exists(after.key)
+    assert [message.content for message in after.messages] == ["old", "new"]
+    assert 0 < shards["b"].ttl(after.key) <= 600